@@ -0,0 +1,178 @@
+# benchmarks/bench_serialization.py
+# 工具结果序列化路径的 CPU 与内存分配对比 (默认 1000 条目的上游响应):
+#   1. MCP 工具返回: structured_output 开启 (结果在 content 与 structuredContent 中各编码一次, 并做 schema 校验)
+#      与关闭 (只编码一次) 时, 从工具返回值到 JSON-RPC 响应字节的开销;
+#   2. 单页透传: 解析后重新序列化 vs RawJSON 原样嵌入 (get_metric_model_matrix 的单元格);
+#   3. fetch_all 合并: 标准库 json vs compass_json (已安装 orjson 时使用 orjson);
+#   4. main.py 的 SSE 结果: 解析 -> indent=2 重新序列化 -> 再次 dumps vs ItemsArrayParser 原文拼接。
+#
+# 用法:
+#   python benchmarks/bench_serialization.py --items 1000 --repeat 50
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jsonschema
+from mcp import types
+from mcp.server.fastmcp.tools import Tool
+import compass_json
+from compass_json import RawJSON
+from compass_bulk import merge_items
+from main import ItemsArrayParser
+
+
+def make_response(n_items: int, seed: int = 0) -> str:
+    """构造与丰富化提交数据结构相近的上游响应原文。"""
+    rng = random.Random(seed)
+    items = []
+    for i in range(n_items):
+        items.append({
+            "uuid": f"{rng.getrandbits(128):032x}",
+            "hash": f"{rng.getrandbits(160):040x}",
+            "author_name": rng.choice(["张三", "李四", "alice", "bob", "王五"]),
+            "author_email": f"dev{rng.randrange(500)}@example.com",
+            "author_org_name": rng.choice(["华为", "Gitee", "independent", None]),
+            "repo_name": "https://github.com/oss-compass/compass-web-service",
+            "message": "fix: 修复同步水位在并发写入时回退的问题\n\nSigned-off-by: dev",
+            "grimoire_creation_date": f"2024-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}T08:00:00+08:00",
+            "lines_added": rng.randrange(0, 2000),
+            "lines_removed": rng.randrange(0, 800),
+            "lines_changed": rng.randrange(0, 2800),
+            "files": rng.randrange(1, 40),
+            "is_merge": rng.random() < 0.1,
+            "tz": 8,
+        })
+    return json.dumps({"count": n_items, "total_page": 1, "page": 1, "items": items}, ensure_ascii=False)
+
+
+def measure(fn, repeat: int) -> dict:
+    """返回每次调用的 CPU 毫秒数 (取中位数) 与单次调用的峰值内存分配 (KiB)。"""
+    fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        timings.append((time.process_time() - start) * 1000)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    timings.sort()
+    return {"cpu_ms": timings[len(timings) // 2], "peak_kib": peak / 1024}
+
+
+# --- 1. MCP 工具返回 ---
+
+def _tool_result_bytes(tool: Tool, result: str) -> bytes:
+    """复现 FastMCP + lowlevel server 处理工具返回值并编码 JSON-RPC 响应的过程。"""
+    converted = tool.fn_metadata.convert_result(result)
+    if isinstance(converted, tuple):
+        content, structured = converted
+        jsonschema.validate(instance=structured, schema=tool.output_schema)
+    else:
+        content, structured = converted, None
+    call_result = types.CallToolResult(content=list(content), structuredContent=structured, isError=False)
+    response = types.JSONRPCResponse(jsonrpc="2.0", id=1, result=call_result.model_dump(by_alias=True, mode="json", exclude_none=True))
+    return response.model_dump_json(by_alias=True, exclude_none=True).encode()
+
+
+def bench_tool_result(text: str, repeat: int) -> list[tuple[str, dict]]:
+    async def get_data(label: str) -> str:
+        return text
+
+    rows = []
+    for structured in (True, False):
+        tool = Tool.from_function(get_data, structured_output=structured)
+        stats = measure(lambda: _tool_result_bytes(tool, text), repeat)
+        stats["bytes"] = len(_tool_result_bytes(tool, text))
+        rows.append((f"structured_output={structured}", stats))
+    return rows
+
+
+# --- 2. 单页透传 ---
+
+def bench_passthrough(text: str, repeat: int) -> list[tuple[str, dict]]:
+    def reencode():
+        data = json.loads(text)
+        return json.dumps({"matrix": {"repo": {"project_activity": data}}}, ensure_ascii=False)
+
+    def passthrough():
+        compass_json.loads(text)  # 仍然解析一次用于校验与计数
+        return compass_json.dumps({"matrix": {"repo": {"project_activity": RawJSON(text)}}})
+
+    return [("parse + json.dumps", measure(reencode, repeat)), ("RawJSON passthrough", measure(passthrough, repeat))]
+
+
+# --- 3. fetch_all 合并 ---
+
+def bench_merge(pages: list[str], repeat: int) -> list[tuple[str, dict]]:
+    def stdlib():
+        items = merge_items([json.loads(p)["items"] for p in pages])
+        return json.dumps({"count": len(items), "items": items}, ensure_ascii=False)
+
+    def fast():
+        items = merge_items([compass_json.loads(p)["items"] for p in pages])
+        return compass_json.dumps({"count": len(items), "items": items})
+
+    backend = "orjson" if compass_json.orjson is not None else "json (orjson not installed)"
+    return [("json", measure(stdlib, repeat)), (f"compass_json [{backend}]", measure(fast, repeat))]
+
+
+# --- 4. main.py SSE 结果 ---
+
+def bench_sse(text: str, repeat: int) -> list[tuple[str, dict]]:
+    raw = text.encode()
+
+    def double_encoded():
+        data = json.loads(raw)
+        result = json.dumps(data["items"], indent=2, ensure_ascii=False)
+        return f"event: tool_result\ndata: {json.dumps({'result': result})}\n\n"
+
+    def spliced():
+        parser = ItemsArrayParser()
+        items = []
+        for start in range(0, len(raw), 65536):
+            items.extend(parser.feed(raw[start:start + 65536]))
+        items.extend(parser.feed(b"", final=True))
+        return f'event: tool_result\ndata: {{"result": [{",".join(items)}]}}\n\n'
+
+    return [("loads + dumps(indent=2) + dumps", measure(double_encoded, repeat)), ("ItemsArrayParser splice", measure(spliced, repeat))]
+
+
+def report(title: str, rows: list[tuple[str, dict]]) -> None:
+    print(f"\n{title}")
+    base = rows[0][1]
+    for name, stats in rows:
+        line = f"  {name:<36} cpu {stats['cpu_ms']:8.2f} ms   peak alloc {stats['peak_kib']:9.0f} KiB"
+        if "bytes" in stats:
+            line += f"   response {stats['bytes'] / 1024:7.0f} KiB"
+        if stats is not base:
+            line += f"   ({base['cpu_ms'] / max(stats['cpu_ms'], 1e-9):.1f}x faster, {stats['peak_kib'] / max(base['peak_kib'], 1e-9):.0%} of peak)"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="工具结果序列化路径的 CPU 与分配对比")
+    parser.add_argument("--items", type=int, default=1000, help="单个上游响应的条目数")
+    parser.add_argument("--pages", type=int, default=10, help="fetch_all 合并测试的页数")
+    parser.add_argument("--repeat", type=int, default=50, help="每项测量的重复次数")
+    args = parser.parse_args()
+
+    text = make_response(args.items)
+    pages = [make_response(args.items, seed=i) for i in range(args.pages)]
+    print(f"upstream response: {args.items} items, {len(text.encode()) / 1024:.0f} KiB; orjson: {compass_json.orjson is not None}")
+    report("1. MCP tool result -> JSON-RPC bytes", bench_tool_result(text, args.repeat))
+    report("2. single page embedded in a larger result", bench_passthrough(text, args.repeat))
+    report(f"3. fetch_all merge of {args.pages} pages", bench_merge(pages, max(5, args.repeat // 5)))
+    report("4. main.py SSE tool_result", bench_sse(text, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
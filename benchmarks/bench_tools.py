@@ -0,0 +1,431 @@
+# benchmarks/bench_tools.py
+# 工具服务的端到端吞吐压测: 启动本地模拟上游 (mock_compass.py) 与每个工具集各自的服务进程
+# (compass_server.py --toolsets <工具集> --transport streamable-http), 以 N 个并发 MCP 客户端
+# 逐个场景调用工具, 报告每个场景的 QPS、p50/p95/p99 延迟、错误数、每次调用的上游请求数,
+# 以及服务进程树 (含渲染 worker) 的 CPU 时间与峰值 RSS。
+#
+# 结果可保存为基线 (benchmarks/baselines/<名称>.json), 之后的运行与基线对比,
+# QPS 下降或 p95 上升超过容差时以非零状态退出, 可直接用于 CI。
+#
+# 用法:
+#   python benchmarks/bench_tools.py --toolsets model,enriched --concurrency 8 --requests 200 --save-baseline main
+#   python benchmarks/bench_tools.py --toolsets model,enriched --concurrency 8 --requests 200 --compare main
+#   python benchmarks/bench_tools.py --list                      # 列出全部场景
+#
+# CPU 与 RSS 从 /proc 读取, 只在 Linux 上可用 (其他平台这两列为空)。
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import importlib.util
+import statistics
+import subprocess
+from datetime import datetime
+from typing import Callable, Optional
+
+import httpx
+from mcp import ClientSession
+from mcp.client.streamable_http import streamablehttp_client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from compass_metrics import classify_result
+
+BASELINE_DIR = os.path.join(ROOT, "benchmarks", "baselines")
+
+# --- 场景 ---
+# 每个场景: (场景名, 工具名, 参数生成函数 (请求序号 -> 参数))。
+# 每次请求使用不同的仓库地址或绘图数据, 避免命中缓存, 测量的是完整的请求路径。
+
+def _label(i: int) -> str:
+    return f"https://github.com/bench/repo-{i}"
+
+
+def _window(i: int, months: int = 1) -> dict:
+    return {"label": _label(i), "begin_date": "2024-01-01", "end_date": f"{2024 + months // 12}-{months % 12 + 1:02d}-01"}
+
+
+SCENARIOS: dict[str, list[tuple[str, str, Callable[[int], dict]]]] = {
+    "model": [
+        ("project_activity.page", "get_project_activity", lambda i: {**_window(i)}),
+        ("milestone_persona.fetch_all", "get_contributor_milestone_persona", lambda i: {**_window(i, 6), "fetch_all": True}),
+        ("metric_model_matrix.3x7", "get_metric_model_matrix", lambda i: {
+            "labels": [_label(i * 3 + k) for k in range(3)], "begin_date": "2024-01-01", "end_date": "2024-02-01",
+        }),
+    ],
+    "enriched": [
+        ("git_commit.page", "get_git_commit_enriched_data", lambda i: {**_window(i), "size": 100}),
+        ("git_commit.fetch_all_12m", "get_git_commit_enriched_data", lambda i: {**_window(i, 12), "fetch_all": True}),
+        ("issue.fetch_all_3m", "get_issue_enriched_data", lambda i: {**_window(i, 3), "fetch_all": True}),
+    ],
+    "plot": [
+        ("plot_from_python", "generate_plot_from_python", lambda i: {
+            "python_code": f"import matplotlib.pyplot as plt\nplt.plot([1, 2, 3, {i}])\nplt.title('bench {i}')",
+        }),
+        ("chart_from_spec", "generate_chart_from_spec", lambda i: {"spec": {
+            "source": {"dataset": "git_commit", **_window(i, 6)},
+            "chart": "stacked_bar", "x": "grimoire_creation_date", "bucket": "month",
+            "y": "lines_added", "group_by": "author_org_name", "top_n": 3,
+        }}),
+    ],
+    "gitee_pr": [
+        ("pull_requests.page", "get_pull_requests", lambda i: {**_window(i)}),
+    ],
+}
+
+
+# --- 进程与资源 ---
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_http(url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+def _process_tree(pid: int) -> list[int]:
+    """pid 及其全部子孙进程 (读取 /proc)。"""
+    children: dict[int, list[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def sample_resources(pid: int) -> Optional[tuple[float, int]]:
+    """进程树的 (累计 CPU 秒数, 当前 RSS 字节数); 非 Linux 平台返回 None。"""
+    if not os.path.isdir("/proc"):
+        return None
+    ticks, page = os.sysconf("SC_CLK_TCK"), os.sysconf("SC_PAGE_SIZE")
+    cpu, rss = 0.0, 0
+    for member in _process_tree(pid):
+        try:
+            with open(f"/proc/{member}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{member}/statm") as f:
+                rss += int(f.read().split()[1]) * page
+        except OSError:
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / ticks
+    return cpu, rss
+
+
+# --- 压测 ---
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def _call(session: ClientSession, tool: str, arguments: dict) -> tuple[float, str]:
+    started = time.perf_counter()
+    try:
+        result = await session.call_tool(tool, arguments)
+    except Exception as e:
+        return time.perf_counter() - started, f"exception:{type(e).__name__}"
+    elapsed = time.perf_counter() - started
+    if result.isError:
+        return elapsed, "tool_error"
+    text = "".join(getattr(block, "text", "") for block in result.content)
+    return elapsed, classify_result(text)
+
+
+async def run_scenario(url: str, pid: int, mock_url: str, tool: str, make_args, concurrency: int, requests: int, warmup: int, offset: int) -> dict:
+    """以 concurrency 个客户端会话共发出 requests 次调用, 返回统计结果。"""
+    next_index = offset
+    latencies: list[float] = []
+    outcomes: dict[str, int] = {}
+
+    async def client(count_results: bool, total: int, counter: list) -> None:
+        nonlocal next_index
+        async with streamablehttp_client(url) as (read, write, _):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                while counter[0] < total:
+                    counter[0] += 1
+                    index = next_index
+                    next_index += 1
+                    elapsed, outcome = await _call(session, tool, make_args(index))
+                    if count_results:
+                        latencies.append(elapsed)
+                        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    if warmup:
+        warmed = [0]
+        await asyncio.gather(*(client(False, warmup, warmed) for _ in range(min(concurrency, warmup))))
+
+    async with httpx.AsyncClient() as http:
+        await http.post(f"{mock_url}/stats/reset")
+        before = sample_resources(pid)
+        peak_rss = before[1] if before else None
+        counter = [0]
+        started = time.perf_counter()
+        task = asyncio.gather(*(client(True, requests, counter) for _ in range(concurrency)))
+        while not task.done():
+            await asyncio.wait([task], timeout=0.1)
+            sample = sample_resources(pid)
+            if sample and peak_rss is not None:
+                peak_rss = max(peak_rss, sample[1])
+        await task
+        wall = time.perf_counter() - started
+        after = sample_resources(pid)
+        upstream = (await http.get(f"{mock_url}/stats")).json()
+
+    stats = {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "qps": round(len(latencies) / wall, 2),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+        "errors": sum(count for outcome, count in outcomes.items() if outcome != "ok"),
+        "outcomes": outcomes,
+        "upstream_per_call": round(sum(upstream.values()) / max(len(latencies), 1), 2),
+        "cpu_ms_per_call": None,
+        "peak_rss_mib": None,
+    }
+    if before and after:
+        stats["cpu_ms_per_call"] = round((after[0] - before[0]) * 1000 / max(len(latencies), 1), 2)
+        stats["cpu_utilization"] = round((after[0] - before[0]) / wall, 3)
+        stats["peak_rss_mib"] = round(peak_rss / 1024 / 1024, 1)
+    return stats
+
+
+def server_env(mock_url: str, args: argparse.Namespace) -> dict:
+    """工具服务进程的环境变量: 上游指向模拟服务, 关闭会影响可比性的缓存与限速。"""
+    env = dict(os.environ)
+    env.update({
+        "COMPASS_MODEL_BASE_URL": f"{mock_url}/model/",
+        "COMPASS_ENRICHED_BASE_URL": f"{mock_url}/enriched",
+        "IMGBB_UPLOAD_URL": f"{mock_url}/imgbb/1/upload",
+        "IMAGE_SINK": "imgbb",
+        "IMGBB_API_KEY": "bench",
+        "GITEE_ACCESS_TOKEN": "bench",
+        "COMPASS_DISK_CACHE_PATH": "",
+        "PLOT_RENDER_WORKERS": str(args.render_workers),
+        "PYTHONUNBUFFERED": "1",
+    })
+    if not args.keep_rate_limits:
+        env.update({"COMPASS_RATE_PER_HOST": "0", "COMPASS_RATE_PER_TOKEN": "0"})
+    return env
+
+
+async def run_toolset(toolset: str, mock_url: str, args: argparse.Namespace, log) -> dict:
+    port = _free_port()
+    command = [sys.executable, os.path.join(ROOT, "compass_server.py"), "--toolsets", toolset,
+               "--host", "127.0.0.1", "--port", str(port), "--transport", "streamable-http"]
+    server = subprocess.Popen(command, cwd=ROOT, env=server_env(mock_url, args), stdout=log, stderr=subprocess.STDOUT)
+    results = {}
+    try:
+        await asyncio.to_thread(_wait_for_http, f"http://127.0.0.1:{port}/metrics", server)
+        offset = 0
+        for name, tool, make_args in SCENARIOS[toolset]:
+            if args.scenarios and name not in args.scenarios:
+                continue
+            stats = await run_scenario(
+                f"http://127.0.0.1:{port}/mcp", server.pid, mock_url, tool, make_args,
+                args.concurrency, args.requests, args.warmup, offset,
+            )
+            # 不同场景使用不重叠的请求序号, 后面的场景不会命中前面场景留下的缓存
+            offset += args.requests + args.warmup + args.concurrency
+            results[name] = {"toolset": toolset, "tool": tool, **stats}
+            print_row(name, results[name])
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return results
+
+
+# --- 报告与基线 ---
+
+HEADER = f"{'scenario':<30} {'qps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>5} {'up/call':>8} {'cpu/call':>9} {'rss':>8}"
+
+
+def _fmt(value, suffix: str = "") -> str:
+    return "-" if value is None else f"{value}{suffix}"
+
+
+def print_row(name: str, stats: dict) -> None:
+    print(
+        f"{name:<30} {stats['qps']:>8} {stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8} "
+        f"{stats['errors']:>5} {stats['upstream_per_call']:>8} {_fmt(stats['cpu_ms_per_call']):>9} {_fmt(stats['peak_rss_mib']):>8}",
+        flush=True,
+    )
+
+
+def environment() -> dict:
+    has_orjson = importlib.util.find_spec("orjson") is not None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "orjson": has_orjson,
+        "commit": commit,
+    }
+
+
+def compare(baseline: dict, results: dict, tolerance: float) -> list[str]:
+    """与基线对比, 打印差异并返回回归的场景列表 (QPS 下降或 p95 上升超过容差)。"""
+    if baseline.get("config", {}).get("mock") != results["config"]["mock"]:
+        print("warning: mock settings differ from the baseline; results may not be comparable")
+    regressions = []
+    print(f"\ncompared with baseline {baseline.get('name')!r} ({baseline.get('created_at')}, commit {baseline.get('environment', {}).get('commit')})")
+    print(f"{'scenario':<30} {'qps':>18} {'p95 ms':>20} {'cpu/call':>18}")
+    for name, current in results["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            print(f"{name:<30} (not in baseline)")
+            continue
+        qps_change = current["qps"] / previous["qps"] - 1 if previous["qps"] else 0.0
+        p95_change = current["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0.0
+        cpu = ""
+        if current.get("cpu_ms_per_call") is not None and previous.get("cpu_ms_per_call"):
+            cpu = f"{current['cpu_ms_per_call'] / previous['cpu_ms_per_call'] - 1:+.1%}"
+        regressed = qps_change < -tolerance or p95_change > tolerance
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:<30} {previous['qps']:>7} -> {current['qps']:<7} {previous['p95_ms']:>8} -> {current['p95_ms']:<8} {cpu:>12}"
+            f"   qps {qps_change:+.1%} p95 {p95_change:+.1%}{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="工具服务端到端压测 (本地模拟上游)")
+    parser.add_argument("--toolsets", default="model,enriched,plot", help=f"逗号分隔的工具集 ({', '.join(SCENARIOS)})")
+    parser.add_argument("--scenarios", help="只运行指定的场景 (逗号分隔)")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发客户端会话数")
+    parser.add_argument("--requests", type=int, default=200, help="每个场景的调用次数")
+    parser.add_argument("--warmup", type=int, default=10, help="每个场景正式计时前的预热调用次数")
+    parser.add_argument("--render-workers", type=int, default=2, help="绘图服务的渲染进程数")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="保留默认的令牌桶限速 (默认关闭以测量服务本身的吞吐)")
+    parser.add_argument("--latency-ms", type=float, default=50, help="模拟上游的平均延迟")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="模拟上游延迟的标准差")
+    parser.add_argument("--total-items", type=int, default=300, help="模拟上游一年窗口内的条目数")
+    parser.add_argument("--item-bytes", type=int, default=400, help="模拟上游单个条目的字节数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟上游的错误率")
+    parser.add_argument("--error-status", type=int, default=503, help="模拟上游错误的状态码")
+    parser.add_argument("--save-baseline", metavar="NAME", help="把结果保存为基线")
+    parser.add_argument("--compare", metavar="NAME", help="与已保存的基线对比")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="判定回归的相对容差, 默认 0.1 (10%%)")
+    parser.add_argument("--output", help="另外把结果写入该 JSON 文件")
+    parser.add_argument("--list", action="store_true", help="列出全部场景后退出")
+    return parser
+
+
+async def run(args: argparse.Namespace) -> dict:
+    mock_port = _free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    mock_args = [
+        "--port", str(mock_port), "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--total-items", str(args.total_items), "--item-bytes", str(args.item_bytes),
+        "--error-rate", str(args.error_rate), "--error-status", str(args.error_status),
+    ]
+    log_path = os.path.join(ROOT, "bench_servers.log")
+    with open(log_path, "w") as log:
+        mock = subprocess.Popen([sys.executable, os.path.join(ROOT, "benchmarks", "mock_compass.py"), *mock_args], stdout=log, stderr=subprocess.STDOUT)
+        try:
+            await asyncio.to_thread(_wait_for_http, f"{mock_url}/stats", mock)
+            print(HEADER)
+            results = {}
+            for toolset in args.toolsets:
+                results.update(await run_toolset(toolset, mock_url, args, log))
+        finally:
+            mock.terminate()
+            mock.wait(timeout=10)
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "config": {
+            "concurrency": args.concurrency, "requests": args.requests, "warmup": args.warmup,
+            "render_workers": args.render_workers, "keep_rate_limits": args.keep_rate_limits,
+            "mock": {
+                "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "total_items": args.total_items,
+                "item_bytes": args.item_bytes, "error_rate": args.error_rate, "error_status": args.error_status,
+            },
+        },
+        "results": results,
+    }
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    if args.list:
+        for toolset, scenarios in SCENARIOS.items():
+            for name, tool, _ in scenarios:
+                print(f"{toolset:<10} {name:<30} {tool}")
+        return
+    args.toolsets = [name.strip() for name in args.toolsets.split(",") if name.strip()]
+    unknown = [name for name in args.toolsets if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"unknown toolsets {unknown}; available: {', '.join(SCENARIOS)}")
+    args.scenarios = set(args.scenarios.split(",")) if args.scenarios else None
+
+    baseline = None
+    if args.compare:
+        path = os.path.join(BASELINE_DIR, f"{args.compare}.json")
+        if not os.path.exists(path):
+            sys.exit(f"baseline {path} not found")
+        with open(path, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"name": args.save_baseline, **results}, f, ensure_ascii=False, indent=2)
+        print(f"\nbaseline saved to {path}")
+    if baseline is not None:
+        regressions = compare(baseline, results, args.tolerance)
+        if regressions:
+            sys.exit(f"\n{len(regressions)} scenario(s) regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
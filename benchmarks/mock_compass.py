@@ -0,0 +1,163 @@
+# benchmarks/mock_compass.py
+# 压测用的本地 Compass 模拟服务, 模拟:
+#   - 指标模型接口   POST /model/api/v2/metricModel/<name>
+#   - 丰富化数据接口 POST /enriched/api/v2/<kind>/search、/enriched/api/v2/metadata/pullRequests 等
+#   - imgbb 上传接口 POST /imgbb/1/upload
+# 延迟 (均值 + 抖动)、数据量 (总条目数、单条目字节数) 与错误率 (429/503) 均可配置,
+# 相同参数的请求返回相同的数据 (按 label/端点/日期/页码确定性生成), 便于多次运行对比。
+#
+# 用法:
+#   python benchmarks/mock_compass.py --port 9100 --latency-ms 50 --jitter-ms 20 --total-items 300 --error-rate 0.01
+# 然后让工具服务指向它:
+#   COMPASS_MODEL_BASE_URL=http://127.0.0.1:9100/model/ COMPASS_ENRICHED_BASE_URL=http://127.0.0.1:9100/enriched \
+#   IMGBB_UPLOAD_URL=http://127.0.0.1:9100/imgbb/1/upload python compass_server.py
+#
+# GET /stats 返回各路由按状态码的请求数, POST /stats/reset 清零。
+
+import json
+import math
+import random
+import asyncio
+import hashlib
+import argparse
+from collections import Counter
+from datetime import date, timedelta
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+
+class MockConfig:
+    def __init__(self, args: argparse.Namespace):
+        self.latency = args.latency_ms / 1000
+        self.jitter = args.jitter_ms / 1000
+        self.upload_latency = args.upload_latency_ms / 1000
+        self.total_items = args.total_items
+        self.item_bytes = args.item_bytes
+        self.error_rate = args.error_rate
+        self.error_status = args.error_status
+        self.retry_after = args.retry_after
+        self.seed = args.seed
+
+
+def _rng(*parts) -> random.Random:
+    """按请求参数确定性生成的随机数发生器。"""
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def make_item(kind: str, label: str, index: int, total: int, begin: date, end: date, item_bytes: int, seed: int) -> dict:
+    """生成一个与真实响应结构相近的条目; 日期均匀落在查询窗口内, 按 index 降序排列。"""
+    rng = _rng(seed, kind, label, begin, end, index)
+    day = end - timedelta(days=index * max((end - begin).days, 1) // total)
+    item = {
+        "uuid": f"{rng.getrandbits(128):032x}",
+        "label": label,
+        "grimoire_creation_date": f"{day.isoformat()}T08:00:00+08:00",
+        "author_name": rng.choice(["张三", "李四", "alice", "bob", "王五"]),
+        "author_org_name": rng.choice(["华为", "Gitee", "independent"]),
+        "lines_added": rng.randrange(0, 2000),
+        "lines_removed": rng.randrange(0, 800),
+        "state": rng.choice(["open", "closed", "merged"]),
+        "activity_score": round(rng.random() * 10, 4),
+    }
+    padding = item_bytes - len(json.dumps(item, ensure_ascii=False))
+    if padding > 0:
+        item["message"] = "x" * padding
+    return item
+
+
+async def _delay(config: MockConfig, latency: float) -> None:
+    delay = max(0.0, random.gauss(latency, config.jitter)) if config.jitter else latency
+    if delay:
+        await asyncio.sleep(delay)
+
+
+def _maybe_error(config: MockConfig) -> Response | None:
+    if config.error_rate and random.random() < config.error_rate:
+        headers = {"Retry-After": str(config.retry_after)} if config.retry_after is not None else None
+        return JSONResponse({"error": "mock overload"}, status_code=config.error_status, headers=headers)
+    return None
+
+
+def create_app(config: MockConfig) -> Starlette:
+    stats: Counter = Counter()
+
+    async def query(request: Request) -> Response:
+        kind = request.path_params["path"]
+        await _delay(config, config.latency)
+        error = _maybe_error(config)
+        if error is not None:
+            stats[(kind, error.status_code)] += 1
+            return error
+        try:
+            body = await request.json()
+            label = body["label"]
+            begin, end = date.fromisoformat(body["begin_date"]), date.fromisoformat(body["end_date"])
+            page, size = max(int(body.get("page", 1)), 1), max(int(body.get("size", 10)), 1)
+        except (ValueError, KeyError, TypeError) as e:
+            stats[(kind, 400)] += 1
+            return JSONResponse({"error": f"bad request: {e}"}, status_code=400)
+        # 总条目数与窗口长度成正比 (以一年为基准), 分片查询各分片的条目数之和与整窗查询一致
+        total = max(1, round(config.total_items * max((end - begin).days, 1) / 365))
+        start = (page - 1) * size
+        items = [
+            make_item(kind, label, index, total, begin, end, config.item_bytes, config.seed)
+            for index in range(start, min(start + size, total))
+        ]
+        stats[(kind, 200)] += 1
+        return JSONResponse({"count": total, "total_page": math.ceil(total / size), "page": page, "items": items})
+
+    async def upload(request: Request) -> Response:
+        await _delay(config, config.upload_latency)
+        error = _maybe_error(config)
+        if error is not None:
+            stats[("imgbb", error.status_code)] += 1
+            return error
+        form = await request.form()
+        image = form.get("image")
+        data = await image.read() if image is not None else b""
+        digest = hashlib.sha256(data).hexdigest()
+        stats[("imgbb", 200)] += 1
+        url = f"http://{request.url.netloc}/imgbb/i/{digest}.png"
+        return JSONResponse({"success": True, "status": 200, "data": {"url": url, "size": len(data)}})
+
+    async def get_stats(request: Request) -> Response:
+        if request.method == "POST":
+            stats.clear()
+        return JSONResponse({f"{route} {status}": count for (route, status), count in sorted(stats.items())})
+
+    return Starlette(routes=[
+        Route("/{service:str}/api/v2/{path:path}", query, methods=["POST"]),
+        Route("/imgbb/1/upload", upload, methods=["POST"]),
+        Route("/stats", get_stats, methods=["GET"]),
+        Route("/stats/reset", get_stats, methods=["POST"]),
+    ])
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="压测用的本地 Compass / imgbb 模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=50, help="查询接口的平均延迟")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="延迟的标准差")
+    parser.add_argument("--upload-latency-ms", type=float, default=100, help="上传接口的平均延迟")
+    parser.add_argument("--total-items", type=int, default=300, help="一年窗口内的条目总数 (按窗口长度等比缩放)")
+    parser.add_argument("--item-bytes", type=int, default=400, help="单个条目序列化后的近似字节数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的请求比例 (0~1)")
+    parser.add_argument("--error-status", type=int, default=503, help="错误响应的状态码, 如 429 或 503")
+    parser.add_argument("--retry-after", type=float, default=None, help="错误响应附带的 Retry-After 秒数")
+    parser.add_argument("--seed", type=int, default=0, help="数据生成的随机种子")
+    return parser
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    uvicorn.run(create_app(MockConfig(args)), host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
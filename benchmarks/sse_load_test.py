@@ -0,0 +1,147 @@
+# benchmarks/sse_load_test.py
+# main.py SSE 端点的并发连接压测: 逐级增加保持打开的空闲连接数,
+# 并在每一级测量新连接收到首个事件 (tool_metadata) 的延迟, 验证单个 worker 在数千连接下 p99 保持平稳。
+#
+# 用法:
+#   MCP_HEARTBEAT_INTERVAL=15 uvicorn main:app --port 8002 --no-access-log
+#   python benchmarks/sse_load_test.py --url http://127.0.0.1:8002/mcp --connections 4000 --step 1000
+
+import argparse
+import asyncio
+import resource
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+def _raise_fd_limit() -> int:
+    """尽量提高本进程可打开的文件描述符数量, 返回生效的软限制。"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        soft = hard
+    return soft
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class SSEConnection:
+    """基于原始 asyncio 流的极简 SSE 客户端, 每个连接只占用一个 socket 和一个读取任务。"""
+
+    def __init__(self, host: str, port: int, path: str):
+        self.host, self.port, self.path = host, port, path
+        self.reader = None
+        self.writer = None
+        self.events = 0
+        self._drain_task = None
+
+    async def open(self) -> float:
+        """建立连接并等待第一个事件, 返回耗时 (秒)。"""
+        started = time.perf_counter()
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(
+            f"GET {self.path} HTTP/1.1\r\nHost: {self.host}\r\nAccept: text/event-stream\r\n\r\n".encode()
+        )
+        await self.writer.drain()
+        await self.reader.readuntil(b"\r\n\r\n")  # 响应头
+        await self.reader.readuntil(b"\n\n")  # tool_metadata 事件
+        self.events += 1
+        return time.perf_counter() - started
+
+    def hold(self) -> None:
+        """在后台持续读取心跳, 保持连接为打开状态。"""
+        self._drain_task = asyncio.create_task(self._drain())
+
+    async def _drain(self) -> None:
+        try:
+            while await self.reader.read(4096):
+                self.events += 1
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    @property
+    def alive(self) -> bool:
+        return self._drain_task is not None and not self._drain_task.done()
+
+    async def close(self) -> None:
+        if self._drain_task is not None:
+            self._drain_task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+async def _open_batch(host: str, port: int, path: str, count: int, concurrency: int) -> list[SSEConnection]:
+    semaphore = asyncio.Semaphore(concurrency)
+    connections = []
+
+    async def open_one() -> None:
+        async with semaphore:
+            conn = SSEConnection(host, port, path)
+            await conn.open()
+            conn.hold()
+            connections.append(conn)
+
+    results = await asyncio.gather(*(open_one() for _ in range(count)), return_exceptions=True)
+    failures = [r for r in results if isinstance(r, Exception)]
+    if failures:
+        print(f"  警告: {len(failures)} 个连接建立失败, 例如: {failures[0]!r}")
+    return connections
+
+
+async def _probe(host: str, port: int, path: str, probes: int) -> list[float]:
+    latencies = []
+    for _ in range(probes):
+        conn = SSEConnection(host, port, path)
+        try:
+            latencies.append(await conn.open())
+        finally:
+            await conn.close()
+    return latencies
+
+
+async def run(url: str, connections: int, step: int, probes: int, hold: float, open_concurrency: int) -> None:
+    parts = urlsplit(url)
+    host, port, path = parts.hostname, parts.port or 80, parts.path or "/"
+    print(f"文件描述符上限: {_raise_fd_limit()}")
+    print(f"{'held':>8} {'alive':>8} {'p50(ms)':>10} {'p95(ms)':>10} {'p99(ms)':>10} {'max(ms)':>10}")
+
+    held: list[SSEConnection] = []
+    level = 0
+    try:
+        while level < connections:
+            batch = min(step, connections - level)
+            held.extend(await _open_batch(host, port, path, batch, open_concurrency))
+            level += batch
+            await asyncio.sleep(hold)
+            latencies = [v * 1000 for v in await _probe(host, port, path, probes)]
+            alive = sum(1 for conn in held if conn.alive)
+            print(
+                f"{len(held):>8} {alive:>8} {statistics.median(latencies):>10.2f} "
+                f"{_percentile(latencies, 95):>10.2f} {_percentile(latencies, 99):>10.2f} {max(latencies):>10.2f}"
+            )
+    finally:
+        await asyncio.gather(*(conn.close() for conn in held), return_exceptions=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="main.py SSE 端点并发连接压测")
+    parser.add_argument("--url", default="http://127.0.0.1:8002/mcp")
+    parser.add_argument("--connections", type=int, default=4000, help="最终保持打开的空闲连接数")
+    parser.add_argument("--step", type=int, default=1000, help="每一级新增的连接数")
+    parser.add_argument("--probes", type=int, default=100, help="每一级测量首事件延迟的探测连接数")
+    parser.add_argument("--hold", type=float, default=2.0, help="每一级建立连接后、探测前的等待秒数")
+    parser.add_argument("--open-concurrency", type=int, default=200, help="建立连接时的并发数")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.connections, args.step, args.probes, args.hold, args.open_concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# chart_specs.py
+# 声明式图表规格: 由服务端按规格获取 Compass 数据 (复用缓存与分片), 用 NumPy 向量化地分桶、分组、聚合,
+# 生成只包含绘图所需数组的 figure 字典, 交给渲染进程池直接绘制, 不经过 exec, 数据也不经过模型上下文。
+
+import numpy as np
+from compass_bulk import DATASETS, fetch_dataset
+from compass_columns import (
+    numeric_column, date_column, category_column, bucket_dates, full_date_axis, grouped_aggregate, MISSING_CATEGORY,
+)
+
+# --- 配置 ---
+CHART_TYPES = ("line", "bar", "stacked_bar", "scatter", "hist", "pie")
+AGGREGATIONS = ("count", "sum", "mean", "min", "max", "median")
+BUCKETS = ("day", "week", "month", "year")
+# 散点图最多绘制的点数, 超出时等间隔抽样
+MAX_SCATTER_POINTS = 5000
+DEFAULT_TOP_N = 10
+
+
+class ChartSpecError(ValueError):
+    """图表规格不合法或数据无法按规格绘制。"""
+
+
+# --- 规格校验 ---
+
+def _require(spec: dict, key: str, kind=str):
+    value = spec.get(key)
+    if not isinstance(value, kind) or value == "":
+        raise ChartSpecError(f"'{key}' is required and must be a {kind.__name__}.")
+    return value
+
+
+def _choice(spec: dict, key: str, options: tuple, default):
+    value = spec.get(key, default)
+    if value not in options:
+        raise ChartSpecError(f"'{key}' must be one of {', '.join(map(str, options))}, got {value!r}.")
+    return value
+
+
+def validate_spec(spec: dict) -> dict:
+    """校验并补全默认值, 返回规范化后的规格。"""
+    if not isinstance(spec, dict):
+        raise ChartSpecError("spec must be a JSON object.")
+    source = spec.get("source")
+    if not isinstance(source, dict):
+        raise ChartSpecError("'source' is required: {\"dataset\", \"label\", \"begin_date\", \"end_date\"}.")
+    dataset = _require(source, "dataset")
+    if dataset not in DATASETS:
+        raise ChartSpecError(f"Unknown dataset {dataset!r}; available: {', '.join(DATASETS)}.")
+
+    chart = _choice(spec, "chart", CHART_TYPES, "line")
+    normalized = {
+        "source": {
+            "dataset": dataset,
+            "label": _require(source, "label"),
+            "begin_date": _require(source, "begin_date"),
+            "end_date": _require(source, "end_date"),
+        },
+        "chart": chart,
+        "x": spec.get("x") or None,
+        "y": spec.get("y") or None,
+        "aggregate": _choice(spec, "aggregate", AGGREGATIONS, "sum" if spec.get("y") else "count"),
+        "bucket": _choice(spec, "bucket", BUCKETS + (None,), None),
+        "group_by": spec.get("group_by") or None,
+        "top_n": spec.get("top_n", DEFAULT_TOP_N),
+        "bins": spec.get("bins", 20),
+        "title": spec.get("title", ""),
+        "xlabel": spec.get("xlabel"),
+        "ylabel": spec.get("ylabel"),
+    }
+    if chart == "hist":
+        if not (normalized["y"] or normalized["x"]):
+            raise ChartSpecError("hist needs a numeric 'y' (or 'x') field.")
+    elif normalized["x"] is None:
+        raise ChartSpecError(f"{chart} chart needs an 'x' field.")
+    if chart == "scatter" and normalized["y"] is None:
+        raise ChartSpecError("scatter chart needs both 'x' and 'y' fields.")
+    if normalized["aggregate"] != "count" and normalized["y"] is None and chart not in ("scatter", "hist"):
+        raise ChartSpecError(f"aggregate {normalized['aggregate']!r} needs a numeric 'y' field.")
+    if not isinstance(normalized["top_n"], int) or normalized["top_n"] < 1:
+        raise ChartSpecError("'top_n' must be a positive integer.")
+    if not isinstance(normalized["bins"], int) or not 1 <= normalized["bins"] <= 500:
+        raise ChartSpecError("'bins' must be an integer between 1 and 500.")
+    return normalized
+
+
+# --- 数据获取 ---
+
+async def load_items(source: dict) -> list:
+    """按数据源获取窗口内的全部条目 (走 fetch_all 的分页、分片与缓存), 失败时抛出 CompassDataError。"""
+    data = await fetch_dataset(source["dataset"], source["label"], source["begin_date"], source["end_date"])
+    return data["items"]
+
+
+def build_figure(spec: dict, items: list) -> dict:
+    """
+    按规格把条目转换为 figure 字典: {"chart", "x", "x_is_date", "series": [{"name", "values"}], ...}。
+
+    除了把字段取成列之外, 分桶、分组、聚合、取 Top N 全部用 NumPy 数组运算完成。
+    """
+    chart = spec["chart"]
+    figure = {
+        "chart": chart,
+        "title": spec["title"],
+        "xlabel": spec["xlabel"] if spec["xlabel"] is not None else (spec["x"] or ""),
+        "ylabel": spec["ylabel"] if spec["ylabel"] is not None else (
+            f"{spec['aggregate']}({spec['y']})" if spec["y"] else spec["aggregate"]
+        ),
+        "x_is_date": False,
+    }
+    if not items:
+        raise ChartSpecError("The data source returned no items for this window.")
+
+    if chart == "hist":
+        field = spec["y"] or spec["x"]
+        values = numeric_column(items, field)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            raise ChartSpecError(f"Field {field!r} has no numeric values.")
+        counts, edges = np.histogram(values, bins=spec["bins"])
+        figure.update(x=edges.tolist(), series=[{"name": field, "values": counts.tolist()}], points=int(len(values)))
+        figure["xlabel"] = spec["xlabel"] if spec["xlabel"] is not None else field
+        figure["ylabel"] = spec["ylabel"] if spec["ylabel"] is not None else "count"
+        return figure
+
+    if chart == "scatter":
+        xs, ys = numeric_column(items, spec["x"]), numeric_column(items, spec["y"])
+        valid = ~(np.isnan(xs) | np.isnan(ys))
+        xs, ys = xs[valid], ys[valid]
+        if not len(xs):
+            raise ChartSpecError(f"Fields {spec['x']!r}/{spec['y']!r} have no numeric pairs.")
+        stride = max(1, -(-len(xs) // MAX_SCATTER_POINTS))
+        figure.update(x=xs[::stride].tolist(), series=[{"name": spec["y"], "values": ys[::stride].tolist()}], points=int(len(xs)))
+        figure["ylabel"] = spec["ylabel"] if spec["ylabel"] is not None else spec["y"]
+        return figure
+
+    # --- 分桶的 x 轴 ---
+    if spec["bucket"]:
+        keys = bucket_dates(date_column(items, spec["x"]), spec["bucket"])
+        valid = ~np.isnat(keys)
+        if not valid.any():
+            raise ChartSpecError(f"Field {spec['x']!r} has no YYYY-MM-DD dates to bucket.")
+        axis = full_date_axis(keys[valid], spec["bucket"])
+        x_index = np.searchsorted(axis, keys)
+        figure["x_is_date"] = True
+        x_labels = axis.astype(str).tolist()
+    else:
+        keys = category_column(items, spec["x"])
+        valid = keys != ""
+        axis, x_index = np.unique(keys[valid].astype(str), return_inverse=True)
+        full_index = np.zeros(len(keys), dtype=np.int64)
+        full_index[valid] = x_index
+        x_index = full_index
+        x_labels = axis.tolist()
+
+    values = numeric_column(items, spec["y"]) if spec["y"] else None
+
+    # --- 分组 ---
+    if spec["group_by"]:
+        groups = category_column(items, spec["group_by"])
+        groups[groups == ""] = MISSING_CATEGORY
+        group_names, group_index = np.unique(groups[valid].astype(str), return_inverse=True)
+    else:
+        group_names, group_index = np.array([spec["y"] or "count"]), np.zeros(int(valid.sum()), dtype=np.int64)
+
+    n_x, n_groups = len(x_labels), len(group_names)
+    flat = group_index * n_x + x_index[valid]
+    matrix = grouped_aggregate(
+        flat, values[valid] if values is not None else None, n_groups * n_x, spec["aggregate"]
+    ).reshape(n_groups, n_x)
+
+    # --- Top N ---
+    dropped = 0
+    if spec["group_by"] and n_groups > spec["top_n"]:
+        totals = np.nansum(np.abs(matrix), axis=1)
+        keep = np.sort(np.argsort(-totals, kind="stable")[:spec["top_n"]])
+        dropped = n_groups - len(keep)
+        matrix, group_names = matrix[keep], group_names[keep]
+    if not spec["bucket"] and n_x > spec["top_n"] and chart in ("bar", "stacked_bar", "pie"):
+        totals = np.nansum(np.abs(matrix), axis=0)
+        keep = np.argsort(-totals, kind="stable")[:spec["top_n"]]
+        matrix = matrix[:, keep]
+        x_labels = [x_labels[i] for i in keep]
+
+    figure.update(
+        x=x_labels,
+        series=[
+            {"name": str(name), "values": [None if np.isnan(v) else float(v) for v in row]}
+            for name, row in zip(group_names, matrix)
+        ],
+        points=int(valid.sum()),
+        groups_dropped=dropped,
+    )
+    return figure
+
+
+def figure_summary(figure: dict) -> dict:
+    """工具返回值中附带的简要信息, 让模型知道图中画了什么而无需拿到原始数据。"""
+    summary = {
+        "chart": figure["chart"],
+        "points": figure.get("points", 0),
+        "series": [s["name"] for s in figure["series"]],
+    }
+    if figure["chart"] not in ("scatter", "hist") and figure["x"]:
+        summary["x_range"] = [figure["x"][0], figure["x"][-1]]
+    if figure.get("groups_dropped"):
+        summary["groups_dropped"] = figure["groups_dropped"]
+    return summary
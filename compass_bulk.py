@@ -0,0 +1,405 @@
+# compass_bulk.py
+# 批量获取 Compass 数据: 自动翻页, 并发请求剩余页面后合并去重; 长时间窗口按日期分片并行获取
+
+import os
+import json
+import math
+import asyncio
+from datetime import date, timedelta
+from typing import Awaitable, Callable, Optional
+from compass_client import post_to_compass, MODEL_BASE_URL, ENRICHED_BASE_URL
+from compass_tracing import span
+import compass_json
+
+# --- 配置 ---
+# 获取剩余页面时的最大并发请求数
+FETCH_ALL_CONCURRENCY = int(os.getenv("COMPASS_FETCH_ALL_CONCURRENCY", "4"))
+# 单次 fetch_all 最多请求的页数, 防止超大仓库拖垮服务
+FETCH_ALL_MAX_PAGES = int(os.getenv("COMPASS_FETCH_ALL_MAX_PAGES", "200"))
+# fetch_all 模式下每页的最小条目数 (调用方传入更大的 size 时以调用方为准)
+FETCH_ALL_PAGE_SIZE = int(os.getenv("COMPASS_FETCH_ALL_PAGE_SIZE", "100"))
+
+# 查询窗口超过该天数时按日期分片获取
+SHARD_THRESHOLD_DAYS = int(os.getenv("COMPASS_SHARD_THRESHOLD_DAYS", "92"))
+# 分片粒度: month 或 week (分片边界按自然月/自然周对齐, 便于不同窗口复用同一分片的缓存)
+SHARD_UNIT = os.getenv("COMPASS_SHARD_UNIT", "month")
+# 同时获取的分片数
+SHARD_CONCURRENCY = int(os.getenv("COMPASS_SHARD_CONCURRENCY", "4"))
+
+# 可按名称批量获取的数据集: 名称 -> (基础 URL, 端点), 与各工具服务中的端点一致。
+# 按来源分别列出, 判断数据集属于哪个服务时以此为准, 不比较基础 URL (两个服务可以配置为同一地址)
+MODEL_DATASETS = {
+    "contributor_milestone_persona": (MODEL_BASE_URL, "api/v2/metricModel/contributorMilestonePersona"),
+    "contributor_role_persona": (MODEL_BASE_URL, "api/v2/metricModel/contributorRolePersona"),
+    "contributor_domain_persona": (MODEL_BASE_URL, "api/v2/metricModel/contributorDomainPersona"),
+    "organizations_activity": (MODEL_BASE_URL, "api/v2/metricModel/organizationsActivity"),
+    "project_activity": (MODEL_BASE_URL, "api/v2/metricModel/activity"),
+    "community_service_and_support": (MODEL_BASE_URL, "api/v2/metricModel/communityServiceAndSupport"),
+    "collaboration_development_index": (MODEL_BASE_URL, "api/v2/metricModel/collaborationDevelopmentIndex"),
+}
+ENRICHED_DATASETS = {
+    "fork": (ENRICHED_BASE_URL, "api/v2/fork/search"),
+    "pull_event": (ENRICHED_BASE_URL, "api/v2/pull_event/search"),
+    "git_commit": (ENRICHED_BASE_URL, "api/v2/git/search"),
+    "issue": (ENRICHED_BASE_URL, "api/v2/issue/search"),
+    "pull_request": (ENRICHED_BASE_URL, "api/v2/metadata/pullRequests"),
+    "repo": (ENRICHED_BASE_URL, "api/v2/repo/search"),
+    "stargazer": (ENRICHED_BASE_URL, "api/v2/stargazer/search"),
+    "watch": (ENRICHED_BASE_URL, "api/v2/watch/search"),
+    "releases": (ENRICHED_BASE_URL, "api/v2/releases/search"),
+    "github_event": (ENRICHED_BASE_URL, "api/v2/event/search"),
+    "github_repo_event": (ENRICHED_BASE_URL, "api/v2/repo_event/search"),
+}
+DATASETS = {**MODEL_DATASETS, **ENRICHED_DATASETS}
+
+# 用于去重的条目字段, 按顺序取第一个存在的字段
+_IDENTITY_FIELDS = ("uuid", "id", "hash")
+
+
+def _parse_page(text: str) -> Optional[dict]:
+    """解析一页响应; 返回 None 表示这是错误信息而不是数据页。"""
+    try:
+        data = compass_json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("items"), list):
+        return None
+    return data
+
+
+def _total_pages(data: dict, page_size: int) -> Optional[int]:
+    if isinstance(data.get("total_page"), int):
+        return data["total_page"]
+    if isinstance(data.get("count"), int):
+        return math.ceil(data["count"] / page_size)
+    return None
+
+
+def item_identity(item) -> str:
+    if isinstance(item, dict):
+        for field in _IDENTITY_FIELDS:
+            if item.get(field) is not None:
+                return f"{field}:{item[field]}"
+    return json.dumps(item, sort_keys=True, ensure_ascii=False)
+
+
+def merge_items(pages: list[list]) -> list:
+    """按页顺序合并条目, 去掉翻页过程中因数据变动而重复出现的记录。"""
+    seen = set()
+    merged = []
+    for items in pages:
+        for item in items:
+            key = item_identity(item)
+            if key not in seen:
+                seen.add(key)
+                merged.append(item)
+    return merged
+
+
+class ItemSink:
+    """
+    逐页接收条目而不保留原始条目, 供需要处理超大结果的调用方 (如服务端聚合) 边获取边转换。
+
+    跨页、跨分片按记录 ID 去重 (只保留 ID), consume 收到的每一批都是此前未出现过的条目。
+    """
+
+    def __init__(self, consume: Callable[[list], Awaitable[None]]):
+        self._consume = consume
+        self._seen: set[str] = set()
+        self.count = 0
+
+    async def add(self, items: list) -> None:
+        fresh = []
+        for item in items:
+            key = item_identity(item)
+            if key not in self._seen:
+                self._seen.add(key)
+                fresh.append(item)
+        if fresh:
+            self.count += len(fresh)
+            await self._consume(fresh)
+
+
+class PageBudget:
+    """一次查询中所有分片共享的页数上限; 只在事件循环中使用, 无需加锁。"""
+
+    def __init__(self, pages: int):
+        self.left = pages
+
+    def take(self, wanted: int) -> int:
+        """申请至多 wanted 页, 返回实际分到的页数。"""
+        granted = max(0, min(wanted, self.left))
+        self.left -= granted
+        return granted
+
+
+class CompassDataError(Exception):
+    """请求失败且没有可返回的数据; details 为上游返回的错误信息 (JSON 字符串)。"""
+
+    def __init__(self, details: str):
+        super().__init__(details)
+        self.details = details
+
+
+async def _gather(coroutines) -> list:
+    """并发运行并按顺序返回结果; 任一任务出错 (如超出时间预算) 或调用方被取消时取消其余任务, 不留下无人等待的上游请求。"""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def fetch_all_pages_data(
+    base_url: str,
+    endpoint: str,
+    label: str,
+    begin_date: str,
+    end_date: str,
+    direction: str = "desc",
+    page_size: int = FETCH_ALL_PAGE_SIZE,
+    max_pages: int = FETCH_ALL_MAX_PAGES,
+    sink: Optional[ItemSink] = None,
+    page_budget: Optional[PageBudget] = None,
+) -> dict:
+    """
+    获取查询窗口内的全部数据, 返回结果字典。
+
+    先请求第一页得到总数, 再以 FETCH_ALL_CONCURRENCY 为上限并发请求其余页面,
+    最后合并去重。某些页失败时仍返回已获取的数据, 并在 errors 中列出失败的页。
+    第一页就失败时抛出 CompassDataError。
+    传入 sink 时每页条目到达后即交给 sink, 结果中的 items 为空。
+    传入 page_budget 时请求的页数 (含第一页) 还受共享预算限制, 预算已用完时不发请求, 直接返回截断的空结果。
+    结果中 count 为上游给出的窗口总数 (上游未给出且结果被截断时为 None), fetched 为实际返回 (去重后) 的条目数。
+    """
+    page_size = max(page_size, FETCH_ALL_PAGE_SIZE)
+    if page_budget is not None and page_budget.take(1) == 0:
+        return {"count": None, "fetched": 0, "total_page": None, "fetched_pages": 0, "truncated": True, "items": []}
+    first_text = await post_to_compass(base_url, endpoint, label, begin_date, end_date, direction=direction, page=1, size=page_size)
+    first = _parse_page(first_text)
+    if first is None:
+        raise CompassDataError(first_text)
+
+    pages = {1: first["items"]}
+    if sink is not None:
+        pages[1] = []
+        await sink.add(first["items"])
+    fetched = {1: len(first["items"])}
+    errors = []
+    total_pages = _total_pages(first, page_size)
+    semaphore = asyncio.Semaphore(FETCH_ALL_CONCURRENCY)
+
+    async def fetch_page(page: int) -> None:
+        async with semaphore:
+            text = await post_to_compass(base_url, endpoint, label, begin_date, end_date, direction=direction, page=page, size=page_size)
+        data = _parse_page(text)
+        if data is None:
+            errors.append({"page": page, "details": text})
+            return
+        fetched[page] = len(data["items"])
+        if sink is None:
+            pages[page] = data["items"]
+        else:
+            pages[page] = []
+            await sink.add(data["items"])
+
+    if total_pages is not None:
+        last_page = min(total_pages, max_pages)
+        if page_budget is not None:
+            last_page = 1 + page_budget.take(last_page - 1)
+        truncated = total_pages > last_page
+        await _gather(fetch_page(page) for page in range(2, last_page + 1))
+    else:
+        # 响应中没有总数时只能逐页请求, 直到遇到不满一页的结果
+        last_page, truncated = 1, False
+        while fetched[last_page] >= page_size and last_page < max_pages:
+            if page_budget is not None and page_budget.take(1) == 0:
+                truncated = True
+                break
+            last_page += 1
+            await fetch_page(last_page)
+            if last_page not in fetched:
+                break
+
+    items = merge_items([pages[page] for page in sorted(pages)])
+    fetched_items = len(items) if sink is None else sink.count
+    count = first.get("count")
+    if not isinstance(count, int):
+        count = None if truncated or errors else fetched_items
+    result = {
+        "count": count,
+        "fetched": fetched_items,
+        "total_page": total_pages,
+        "fetched_pages": len(fetched),
+        "truncated": truncated,
+        "items": items,
+    }
+    if errors:
+        result["errors"] = sorted(errors, key=lambda e: e["page"])
+    return result
+
+
+async def fetch_all_pages(
+    base_url: str,
+    endpoint: str,
+    label: str,
+    begin_date: str,
+    end_date: str,
+    direction: str = "desc",
+    page_size: int = FETCH_ALL_PAGE_SIZE,
+    max_pages: int = FETCH_ALL_MAX_PAGES,
+) -> str:
+    """fetch_all_pages_data 的 JSON 字符串版本; 第一页就失败时原样返回错误信息。"""
+    try:
+        result = await fetch_all_pages_data(base_url, endpoint, label, begin_date, end_date, direction=direction, page_size=page_size, max_pages=max_pages)
+    except CompassDataError as e:
+        return e.details
+    return compass_json.dumps(result)
+
+
+def _next_boundary(day: date, unit: str) -> date:
+    if unit == "week":
+        return day + timedelta(days=7 - day.weekday())
+    if day.month == 12:
+        return date(day.year + 1, 1, 1)
+    return date(day.year, day.month + 1, 1)
+
+
+def split_date_range(begin_date: str, end_date: str, unit: str = SHARD_UNIT) -> list[tuple[str, str]]:
+    """
+    把 [begin_date, end_date] 切分为按自然月 (或自然周) 对齐的分片。
+
+    相邻分片共享边界日期 (前一片的结束日 = 后一片的开始日), 这样无论上游把结束日期
+    视为闭区间还是开区间都不会漏数据, 边界上重复的记录在合并时去重。
+    """
+    begin, end = date.fromisoformat(begin_date), date.fromisoformat(end_date)
+    shards = []
+    start = begin
+    while start < end:
+        stop = min(_next_boundary(start, unit), end)
+        shards.append((start.isoformat(), stop.isoformat()))
+        start = stop
+    return shards or [(begin_date, end_date)]
+
+
+def _window_days(begin_date: str, end_date: str) -> Optional[int]:
+    try:
+        return (date.fromisoformat(end_date) - date.fromisoformat(begin_date)).days
+    except ValueError:
+        return None
+
+
+async def fetch_range_data(
+    base_url: str,
+    endpoint: str,
+    label: str,
+    begin_date: str,
+    end_date: str,
+    direction: str = "desc",
+    page_size: int = FETCH_ALL_PAGE_SIZE,
+    max_pages: int = FETCH_ALL_MAX_PAGES,
+    sink: Optional[ItemSink] = None,
+) -> dict:
+    """
+    获取查询窗口内的全部数据, 长窗口自动按日期分片, 返回结果字典。
+
+    窗口不超过 SHARD_THRESHOLD_DAYS 时等同于 fetch_all_pages_data; 否则切分为对齐的分片,
+    以 SHARD_CONCURRENCY 为上限并行获取, 每个分片的每一页都单独走缓存, 之后重叠窗口的查询
+    可以直接复用已获取的分片。结果按 direction 指定的时间顺序合并去重。
+    max_pages 是所有分片合计的页数上限, 按分片开始获取的先后 (即 direction 的时间顺序) 分配,
+    预算用完后其余分片不再请求, 结果标记为 truncated。
+    所有分片都失败时抛出第一个分片的 CompassDataError。
+    传入 sink 时各分片的条目逐页交给 sink (跨分片去重), 结果中的 items 为空。
+    count 与不分片时一致, 为上游的窗口总数, fetched 为实际返回的条目数: 各分片都完整时两者相等;
+    有分片被截断或失败时另外请求一次整个窗口的总数 (size=1, 分片共享边界日期, 不能把各分片的总数相加)。
+    """
+    days = _window_days(begin_date, end_date)
+    if days is None or days <= SHARD_THRESHOLD_DAYS:
+        return await fetch_all_pages_data(base_url, endpoint, label, begin_date, end_date, direction=direction, page_size=page_size, max_pages=max_pages, sink=sink)
+
+    shards = split_date_range(begin_date, end_date)
+    if direction.lower() == "desc":
+        shards.reverse()
+    semaphore = asyncio.Semaphore(SHARD_CONCURRENCY)
+    page_budget = PageBudget(max_pages)
+
+    async def fetch_shard(shard: tuple[str, str]) -> dict | CompassDataError:
+        async with semaphore:
+            with span("shard", begin_date=shard[0], end_date=shard[1]):
+                try:
+                    return await fetch_all_pages_data(base_url, endpoint, label, shard[0], shard[1], direction=direction, page_size=page_size, max_pages=max_pages, sink=sink, page_budget=page_budget)
+                except CompassDataError as e:
+                    return e
+
+    results = await _gather(fetch_shard(shard) for shard in shards)
+
+    pages, errors = [], []
+    truncated = False
+    for (shard_begin, shard_end), data in zip(shards, results):
+        if isinstance(data, CompassDataError):
+            errors.append({"begin_date": shard_begin, "end_date": shard_end, "details": data.details})
+            continue
+        pages.append(data["items"])
+        truncated = truncated or data.get("truncated", False)
+        for error in data.get("errors", []):
+            errors.append({"begin_date": shard_begin, "end_date": shard_end, **error})
+
+    if not pages:
+        raise results[0]
+
+    items = merge_items(pages)
+    fetched_items = len(items) if sink is None else sink.count
+    count = fetched_items
+    if truncated or errors:
+        count = await _window_count(base_url, endpoint, label, begin_date, end_date)
+    result = {
+        "count": count,
+        "fetched": fetched_items,
+        "shards": len(shards),
+        "truncated": truncated,
+        "items": items,
+    }
+    if errors:
+        result["errors"] = errors
+    return result
+
+
+async def _window_count(base_url: str, endpoint: str, label: str, begin_date: str, end_date: str) -> Optional[int]:
+    """上游给出的整个窗口的条目总数 (只请求一条记录), 无法获取时返回 None。"""
+    data = _parse_page(await post_to_compass(base_url, endpoint, label, begin_date, end_date, page=1, size=1))
+    if data is None or not isinstance(data.get("count"), int):
+        return None
+    return data["count"]
+
+
+async def fetch_range(
+    base_url: str,
+    endpoint: str,
+    label: str,
+    begin_date: str,
+    end_date: str,
+    direction: str = "desc",
+    page_size: int = FETCH_ALL_PAGE_SIZE,
+    max_pages: int = FETCH_ALL_MAX_PAGES,
+) -> str:
+    """fetch_range_data 的 JSON 字符串版本, 供工具直接返回; 全部失败时原样返回错误信息。"""
+    try:
+        result = await fetch_range_data(base_url, endpoint, label, begin_date, end_date, direction=direction, page_size=page_size, max_pages=max_pages)
+    except CompassDataError as e:
+        return e.details
+    return compass_json.dumps(result)
+
+
+async def fetch_dataset(
+    dataset: str,
+    label: str,
+    begin_date: str,
+    end_date: str,
+    page_size: int = FETCH_ALL_PAGE_SIZE,
+    max_pages: int = FETCH_ALL_MAX_PAGES,
+    sink: Optional[ItemSink] = None,
+) -> dict:
+    """按 DATASETS 中的名称获取窗口内的全部条目 (按时间升序), 失败时抛出 CompassDataError。"""
+    base_url, endpoint = DATASETS[dataset]
+    return await fetch_range_data(base_url, endpoint, label, begin_date, end_date, direction="asc", page_size=page_size, max_pages=max_pages, sink=sink)
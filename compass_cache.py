@@ -0,0 +1,361 @@
+# compass_cache.py
+# Compass API 响应的进程内缓存: 按条目设置 TTL, 超出内存上限时按 LRU 淘汰
+
+import os
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Any, Optional
+from dotenv import load_dotenv
+
+# --- 初始化 ---
+
+# 加载 .env 文件 (缓存配置在模块导入时读取)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+dotenv_path = os.path.join(script_dir, '.env')
+load_dotenv(dotenv_path=dotenv_path)
+
+# --- 配置 ---
+# 内存缓存占用的内存上限 (字节), 设为 0 可关闭缓存
+CACHE_MAX_BYTES = int(os.getenv("COMPASS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# 默认 TTL (秒): 查询窗口覆盖今天的结果会变化, 只短暂缓存; 完全落在过去的窗口可以缓存更久
+DEFAULT_LIVE_TTL = float(os.getenv("COMPASS_CACHE_TTL_LIVE", "300"))
+DEFAULT_HISTORICAL_TTL = float(os.getenv("COMPASS_CACHE_TTL_HISTORICAL", "86400"))
+# 条目过期后仍可返回旧值 (同时在后台重新验证) 的时长 (秒), 0 表示过期即失效; 关注列表中的查询另见 compass_prefetch.py
+DEFAULT_STALE_SECONDS = float(os.getenv("COMPASS_CACHE_STALE_SECONDS", "0"))
+
+# 持久化磁盘缓存 (SQLite) 的文件路径, 留空表示不启用; 只保存已结束足够久、不再变化的历史窗口
+DISK_CACHE_PATH = os.getenv("COMPASS_DISK_CACHE_PATH", "")
+# 窗口结束后多少天才写入磁盘缓存 (磁盘条目没有 TTL): 上游仍可能补录刚结束窗口内延迟到达的事件
+DISK_CACHE_SETTLE_DAYS = int(os.getenv("COMPASS_DISK_CACHE_SETTLE_DAYS", "7"))
+# 磁盘缓存压缩后的总大小上限 (字节), 超出后按最近访问时间淘汰
+DISK_CACHE_MAX_BYTES = int(os.getenv("COMPASS_DISK_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# 按端点前缀覆盖 TTL: (覆盖今天的查询, 历史查询)
+# 指标模型由后端周期性计算, 当天的数据更新不频繁, 因此可以比原始事件缓存得更久
+ENDPOINT_TTLS = {
+    "api/v2/metricModel/": (1800, 7 * 86400),
+    "api/v2/repo/search": (300, 3600),
+}
+
+
+def _endpoint_ttls(endpoint: str) -> tuple[float, float]:
+    endpoint = endpoint.lstrip("/")
+    for prefix, ttls in ENDPOINT_TTLS.items():
+        if endpoint.startswith(prefix):
+            return ttls
+    return DEFAULT_LIVE_TTL, DEFAULT_HISTORICAL_TTL
+
+
+def is_historical(end_date: str) -> bool:
+    """查询窗口是否已完全结束 (end_date 早于今天)。无法解析的日期按实时数据处理。"""
+    try:
+        return date.fromisoformat(end_date.strip()) < date.today()
+    except (AttributeError, ValueError):
+        return False
+
+
+def is_settled(end_date: str, settle_days: int = DISK_CACHE_SETTLE_DAYS) -> bool:
+    """查询窗口是否已结束至少 settle_days 天 (end_date <= 今天 - settle_days), 结果可以永久保存。"""
+    try:
+        return date.fromisoformat(end_date.strip()) <= date.today() - timedelta(days=settle_days)
+    except (AttributeError, ValueError):
+        return False
+
+
+def ttl_for(endpoint: str, end_date: str) -> float:
+    """根据端点与查询结束日期计算缓存 TTL (秒)。"""
+    live_ttl, historical_ttl = _endpoint_ttls(endpoint)
+    return historical_ttl if is_historical(end_date) else live_ttl
+
+
+def make_key(
+    url: str,
+    label: str,
+    begin_date: str,
+    end_date: str,
+    direction: str,
+    page: int,
+    size: int,
+    scope: Optional[str] = None,
+) -> str:
+    """
+    由规范化后的请求参数生成缓存键 (不包含 access_token)。
+
+    scope 用于隔离不同访问令牌的缓存 (传入令牌指纹), 作为数组的最后一个元素, 键仍是合法的 JSON。
+    """
+    fields = [url, label.strip(), begin_date.strip(), end_date.strip(), direction.lower(), int(page), int(size)]
+    if scope:
+        fields.append(scope)
+    return json.dumps(fields, ensure_ascii=False, separators=(",", ":"))
+
+
+class ResponseCache:
+    """
+    带 TTL 的 LRU 缓存, 按值占用的内存字节数限制总大小。
+
+    默认按 sys.getsizeof 估算字符串/字节值的大小; 缓存其他结构时由调用方通过 size 参数给出。
+    写入时可指定 stale 秒数: 过期后的这段时间内 get() 视为未命中, 但 get_stale() 仍返回旧值,
+    供调用方先返回旧值再在后台刷新 (stale-while-revalidate)。
+    只在单个事件循环内使用, 因此不需要加锁。
+    """
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+        # key -> (value, size, expires_at, stale_until)
+        self._entries: OrderedDict[str, tuple[Any, int, float, float]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, size, expires_at, stale_until = entry
+        now = time.monotonic()
+        if expires_at <= now:
+            if stale_until <= now:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_stale(self, key: str) -> Optional[Any]:
+        """已过期但仍在 stale 期内的旧值 (未过期或已超出 stale 期时返回 None)。"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, _, expires_at, stale_until = entry
+        now = time.monotonic()
+        if not expires_at <= now < stale_until:
+            return None
+        self._entries.move_to_end(key)
+        self.stale_hits += 1
+        return value
+
+    def remaining_ttl(self, key: str) -> Optional[float]:
+        """距离过期的秒数 (已过期为负数), 不存在时返回 None。不影响命中统计与 LRU 顺序。"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return entry[2] - time.monotonic()
+
+    def set(self, key: str, value: Any, ttl: float, size: Optional[int] = None, stale: float = 0.0) -> None:
+        if self.max_bytes <= 0 or ttl <= 0:
+            return
+        if size is None:
+            size = sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        expires_at = time.monotonic() + ttl
+        self._entries[key] = (value, size, expires_at, expires_at + max(stale, 0.0))
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale_hits": self.stale_hits,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _remove(self, key: str) -> None:
+        _, size, _, _ = self._entries.pop(key)
+        self.current_bytes -= size
+
+
+class DiskCache:
+    """
+    基于 SQLite 的持久化缓存, 响应体以 zlib 压缩后存储。
+
+    仅用于历史窗口 (结果不再变化), 因此条目没有 TTL, 只在超出容量时按最近访问时间淘汰。
+    所有方法都是同步的, 在事件循环中请通过 asyncio.to_thread 调用。
+    """
+
+    def __init__(self, path: str, max_bytes: int = DISK_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                label TEXT NOT NULL,
+                begin_date TEXT NOT NULL,
+                end_date TEXT NOT NULL,
+                body BLOB NOT NULL,
+                raw_size INTEGER NOT NULL,
+                stored_size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+        self.current_bytes = self._conn.execute("SELECT COALESCE(SUM(stored_size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT body FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def set(self, key: str, value: str) -> None:
+        url, label, begin_date, end_date = json.loads(key)[:4]
+        raw = value.encode("utf-8")
+        body = zlib.compress(raw, 6)
+        if len(body) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT stored_size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self.current_bytes -= old[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, label, begin_date, end_date, body, len(raw), len(body), now, now),
+            )
+            self.current_bytes += len(body)
+            self._evict_locked()
+            self._conn.commit()
+
+    def purge(self, label: Optional[str] = None, older_than_days: Optional[float] = None) -> int:
+        """删除匹配的条目并返回删除数量; 不带任何条件时清空整个缓存。"""
+        clauses, params = [], []
+        if label is not None:
+            clauses.append("label = ?")
+            params.append(label)
+        if older_than_days is not None:
+            clauses.append("accessed_at < ?")
+            params.append(time.time() - older_than_days * 86400)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            deleted = self._conn.execute(f"DELETE FROM responses{where}", params).rowcount
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+            self.current_bytes = self._conn.execute("SELECT COALESCE(SUM(stored_size), 0) FROM responses").fetchone()[0]
+        return deleted
+
+    def entries(self, limit: int = 50) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url, label, begin_date, end_date, raw_size, stored_size, created_at, accessed_at "
+                "FROM responses ORDER BY accessed_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        columns = ("url", "label", "begin_date", "end_date", "raw_size", "stored_size", "created_at", "accessed_at")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, raw_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(raw_size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "path": self.path,
+            "entries": count,
+            "raw_bytes": raw_bytes,
+            "stored_bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _evict_locked(self) -> None:
+        while self.current_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, stored_size FROM responses ORDER BY accessed_at ASC LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, stored_size in rows:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.current_bytes -= stored_size
+                if self.current_bytes <= self.max_bytes:
+                    break
+
+
+# 进程内共享的响应缓存实例
+response_cache = ResponseCache()
+# 持久化缓存实例, 未配置 COMPASS_DISK_CACHE_PATH 时为 None
+disk_cache: Optional[DiskCache] = DiskCache(DISK_CACHE_PATH) if DISK_CACHE_PATH else None
+
+
+# --- 命令行工具 ---
+# 用法:
+#   python compass_cache.py stats
+#   python compass_cache.py list --limit 20
+#   python compass_cache.py purge [--label URL] [--older-than DAYS]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="查看或清理 Compass 持久化磁盘缓存")
+    parser.add_argument("--path", default=DISK_CACHE_PATH, help="缓存文件路径, 默认读取 COMPASS_DISK_CACHE_PATH")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="显示条目数与占用空间")
+    list_parser = subparsers.add_parser("list", help="按最近访问时间列出条目")
+    list_parser.add_argument("--limit", type=int, default=50)
+    purge_parser = subparsers.add_parser("purge", help="删除条目 (不带条件时清空全部)")
+    purge_parser.add_argument("--label", help="只删除指定仓库的条目")
+    purge_parser.add_argument("--older-than", type=float, metavar="DAYS", help="只删除超过 N 天未访问的条目")
+    args = parser.parse_args()
+
+    if not args.path:
+        parser.error("未配置缓存路径, 请设置 COMPASS_DISK_CACHE_PATH 或使用 --path。")
+
+    cache = DiskCache(args.path)
+    try:
+        if args.command == "stats":
+            print(json.dumps(cache.stats(), indent=2, ensure_ascii=False))
+        elif args.command == "list":
+            print(json.dumps(cache.entries(args.limit), indent=2, ensure_ascii=False))
+        elif args.command == "purge":
+            deleted = cache.purge(label=args.label, older_than_days=args.older_than)
+            print(f"已删除 {deleted} 条缓存。")
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
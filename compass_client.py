@@ -0,0 +1,483 @@
+# compass_client.py
+# 所有 Compass 工具服务共享的 HTTP 连接池与请求辅助函数
+
+import os
+import json
+import asyncio
+import time
+import hashlib
+import importlib.util
+import contextvars
+import contextlib
+import httpx
+from typing import Any, Awaitable, Callable, Optional, Sequence
+import uvicorn
+from mcp.server import FastMCP
+from dotenv import load_dotenv
+from compass_cache import response_cache, disk_cache, make_key, ttl_for, is_settled, DEFAULT_STALE_SECONDS
+from compass_limits import TokenBucket, AdaptiveLimiter, RetryBudget, backoff_delay, parse_retry_after
+from compass_metrics import registry, observe_phase, upstream_outcome, UPSTREAM_REQUESTS, UPSTREAM_RETRIES
+from compass_tracing import span
+from compass_deadline import Deadline, DeadlineExceeded, budget, deadline_at, remaining, shared_context
+
+# --- 初始化 ---
+
+# 加载 .env 文件 (连接池配置需要在创建客户端之前读取)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+dotenv_path = os.path.join(script_dir, '.env')
+load_dotenv(dotenv_path=dotenv_path)
+
+# --- 配置 ---
+# 连接池上限: 同时打开的连接总数与保持空闲(keep-alive)的连接数
+MAX_CONNECTIONS = int(os.getenv("COMPASS_HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("COMPASS_HTTP_MAX_KEEPALIVE", "20"))
+# 空闲连接在池中保留的秒数
+KEEPALIVE_EXPIRY = float(os.getenv("COMPASS_HTTP_KEEPALIVE_EXPIRY", "30"))
+# 是否启用 HTTP/2 多路复用 (需要安装 h2: pip install 'httpx[http2]')
+HTTP2_ENABLED = os.getenv("COMPASS_HTTP2", "0").lower() in ("1", "true", "yes")
+
+# 对同一上游主机同时进行中的请求数: 初始上限与自适应 (AIMD) 调整的上限, 所有工具调用共享
+HOST_CONCURRENCY = int(os.getenv("COMPASS_HOST_CONCURRENCY", "8"))
+HOST_MAX_CONCURRENCY = int(os.getenv("COMPASS_HOST_MAX_CONCURRENCY", "32"))
+# 令牌桶限速 (每秒请求数, 0 表示不限): 按上游主机与按访问令牌分别限速, 突发量为速率的 2 倍
+RATE_PER_HOST = float(os.getenv("COMPASS_RATE_PER_HOST", "50"))
+RATE_PER_TOKEN = float(os.getenv("COMPASS_RATE_PER_TOKEN", "20"))
+# 重试: 每个请求最多尝试的次数, 指数退避的基数与上限 (秒)
+RETRY_ATTEMPTS = int(os.getenv("COMPASS_RETRY_ATTEMPTS", "4"))
+RETRY_BACKOFF_BASE = float(os.getenv("COMPASS_RETRY_BACKOFF_BASE", "0.5"))
+RETRY_BACKOFF_MAX = float(os.getenv("COMPASS_RETRY_BACKOFF_MAX", "10"))
+# 重试预算: 10 秒窗口内重试次数不超过 最低次数 + 比例 x 请求数
+RETRY_BUDGET_RATIO = float(os.getenv("COMPASS_RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN = int(os.getenv("COMPASS_RETRY_BUDGET_MIN", "10"))
+# Retry-After 超过该秒数时不再等待, 直接把错误返回给调用方
+RETRY_AFTER_MAX = float(os.getenv("COMPASS_RETRY_AFTER_MAX", "60"))
+# 视为过载、值得重试的状态码 (所有 Compass 查询 POST 都是只读的, 可以安全重试)
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+# Compass API 请求的默认超时时间 (秒)
+REQUEST_TIMEOUT = 30.0
+
+# Compass API 的基础 URL: 指标模型服务与丰富化数据服务分别部署在不同的域名下
+# (可用环境变量指向本地模拟服务做压测, 见 benchmarks/mock_compass.py)
+MODEL_BASE_URL = os.getenv("COMPASS_MODEL_BASE_URL", "https://compass.gitee.com/")
+ENRICHED_BASE_URL = os.getenv("COMPASS_ENRICHED_BASE_URL", "https://oss-compass.isrc.ac.cn")
+
+_client: httpx.AsyncClient | None = None
+# 限流状态与共享客户端同生命周期 (其中的锁与条件变量绑定创建时的事件循环)
+_host_limiters: dict[str, AdaptiveLimiter] = {}
+_rate_buckets: dict[str, TokenBucket] = {}
+_retry_budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN)
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+# --- 连接池生命周期 ---
+
+def get_client() -> httpx.AsyncClient:
+    """返回进程内共享的 AsyncClient, 首次调用时按配置创建连接池。"""
+    global _client
+    if _client is None or _client.is_closed:
+        http2 = HTTP2_ENABLED
+        if http2 and not _http2_available():
+            print("警告: COMPASS_HTTP2 已开启但未安装 h2, 回退到 HTTP/1.1。")
+            http2 = False
+        _client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """关闭共享客户端并释放池中的所有连接。"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _host_limiters.clear()
+    _rate_buckets.clear()
+    for task in list(_revalidations.values()):
+        task.cancel()
+
+
+# --- 限流 ---
+
+def host_limiter(url: str) -> AdaptiveLimiter:
+    """返回 url 所在主机的自适应并发限制器, 首次使用时以 HOST_CONCURRENCY 为初始上限创建。"""
+    host = httpx.URL(url).host
+    limiter = _host_limiters.get(host)
+    if limiter is None:
+        limiter = _host_limiters[host] = AdaptiveLimiter(HOST_CONCURRENCY, maximum=HOST_MAX_CONCURRENCY)
+    return limiter
+
+
+def _bucket(key: str, rate: float) -> TokenBucket:
+    bucket = _rate_buckets.get(key)
+    if bucket is None:
+        bucket = _rate_buckets[key] = TokenBucket(rate, rate * 2)
+    return bucket
+
+
+def rate_buckets(url: str, token: str) -> tuple[TokenBucket, TokenBucket]:
+    """返回 (主机令牌桶, 访问令牌的令牌桶); 令牌只以哈希形式作为键。"""
+    fingerprint = hashlib.sha256(token.encode()).hexdigest()[:16]
+    return (
+        _bucket("host:" + httpx.URL(url).host, RATE_PER_HOST),
+        _bucket("token:" + fingerprint, RATE_PER_TOKEN),
+    )
+
+
+def limiter_status() -> dict:
+    """各主机当前的自适应并发上限与进行中的请求数。"""
+    return {host: limiter.snapshot() for host, limiter in _host_limiters.items()}
+
+
+# 读不到连接池状态时只提示一次
+_pool_warned = False
+
+
+def _pool_connections() -> Optional[tuple[int, int]]:
+    """
+    共享连接池中 (活跃, 空闲) 的连接数; 没有客户端或读不到时返回 None。
+
+    httpx 没有公开连接池状态, 这里经由其内部的 transport._pool (httpcore 连接池) 读取;
+    升级 httpx/httpcore 后结构变化时不会让抓取失败, 只是不再输出该指标, 并打印一次提示。
+    """
+    global _pool_warned
+    if _client is None:
+        return None
+    try:
+        connections = list(getattr(getattr(_client, "_transport", None), "_pool", None).connections)
+        idle = sum(1 for connection in connections if connection.is_idle())
+    except (AttributeError, TypeError) as e:
+        if not _pool_warned:
+            _pool_warned = True
+            print(f"警告: 无法读取 httpx 连接池状态, compass_http_connections 指标将为空 ({e!r})。")
+        return None
+    return len(connections) - idle, idle
+
+
+@registry.collector
+def _collect_client_metrics():
+    """抓取时读取连接池、并发限制器与响应缓存的状态。"""
+    connections = []
+    counts = _pool_connections()
+    if counts is not None:
+        connections = [(("active",), counts[0]), (("idle",), counts[1])]
+    limits = [((host,), limiter.limit) for host, limiter in _host_limiters.items()]
+    inflight = [((host,), limiter.inflight) for host, limiter in _host_limiters.items()]
+    cache_requests = [
+        (("memory", "hit"), response_cache.hits),
+        (("memory", "miss"), response_cache.misses),
+        (("memory", "stale"), response_cache.stale_hits),
+    ]
+    if disk_cache is not None:
+        cache_requests += [(("disk", "hit"), disk_cache.hits), (("disk", "miss"), disk_cache.misses)]
+    return [
+        ("compass_http_connections", "gauge", "Connections in the shared HTTP pool.", ("state",), connections),
+        ("compass_host_concurrency_limit", "gauge", "Current adaptive concurrency limit per host.", ("host",), limits),
+        ("compass_host_inflight_requests", "gauge", "Upstream requests in flight per host.", ("host",), inflight),
+        ("compass_cache_requests_total", "counter", "Response cache lookups by cache and result.", ("cache", "result"), cache_requests),
+        ("compass_cache_bytes", "gauge", "Bytes held by the in-memory response cache.", (), [((), response_cache.current_bytes)]),
+    ]
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    """ASGI 应用的启动/关闭钩子: 启动时建立连接池, 关闭时释放。"""
+    get_client()
+    try:
+        yield
+    finally:
+        await close_client()
+
+
+def with_lifespans(starlette_app, lifespans: Sequence[Callable] = ()):
+    """
+    把共享连接池与额外的进程级钩子 (如绘图进程池) 挂到 Starlette 应用自身的 lifespan 上, 返回该应用。
+
+    钩子在连接池之后依次启动, 按相反顺序关闭。
+    注意: FastMCP 自带的 lifespan 参数是按 MCP 会话触发的 (每个 SSE 连接一次),
+    不适合管理进程级资源, 因此这里改为包装 Starlette 应用自身的 lifespan。
+    """
+    inner_lifespan = starlette_app.router.lifespan_context
+
+    @contextlib.asynccontextmanager
+    async def combined_lifespan(asgi_app):
+        async with contextlib.AsyncExitStack() as stack:
+            await stack.enter_async_context(lifespan(asgi_app))
+            for extra in lifespans:
+                await stack.enter_async_context(extra(asgi_app))
+            state = await stack.enter_async_context(inner_lifespan(asgi_app))
+            yield state
+
+    starlette_app.router.lifespan_context = combined_lifespan
+    return starlette_app
+
+
+def serve_sse(app: FastMCP, lifespans: Sequence[Callable] = ()) -> None:
+    """以 SSE 模式运行 FastMCP 服务, 并把共享连接池与 lifespans 中的额外钩子挂到应用的生命周期上。"""
+    uvicorn.run(
+        with_lifespans(app.sse_app(), lifespans),
+        host=app.settings.host,
+        port=app.settings.port,
+        log_level=app.settings.log_level.lower(),
+    )
+
+
+# --- 请求合并 (singleflight) ---
+
+class SingleFlight:
+    """
+    合并相同键的并发调用: 同一时刻只执行一次底层协程, 所有等待者共享它的结果。
+
+    底层协程运行在独立任务中, 某个等待者被取消 (断开或超出时间预算) 不会影响其他等待者;
+    只有当所有等待者都离开时, 底层任务才会被取消。底层任务的时间预算取所有等待者中最晚的截止时间。
+    """
+
+    def __init__(self):
+        self.shared = 0
+        # key -> (task, 当前等待者数量, 共享的截止时间)
+        self._calls: dict[str, list] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            deadline = Deadline(deadline_at())
+            task = asyncio.get_running_loop().create_task(fn(), context=shared_context(deadline))
+            call = [task, 0, deadline]
+            self._calls[key] = call
+            task.add_done_callback(lambda _, k=key, c=call: self._forget(k, c))
+        else:
+            self.shared += 1
+            call[2].extend(deadline_at())
+        call[1] += 1
+        try:
+            return await asyncio.shield(call[0])
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not call[0].done():
+                call[0].cancel()
+                self._forget(key, call)
+
+    def _forget(self, key: str, call: list) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+
+# 进程内共享的请求合并器
+inflight_requests = SingleFlight()
+
+# 缓存键 -> 过期后仍可返回旧值的秒数; 由 compass_prefetch 按关注列表维护, 其余查询使用 DEFAULT_STALE_SECONDS
+stale_windows: dict[str, float] = {}
+# 进行中的后台重新验证: 缓存键 -> 任务 (同时持有任务的强引用)
+_revalidations: dict[str, asyncio.Task] = {}
+
+
+# --- 请求辅助函数 ---
+
+async def post_to_compass(
+    base_url: str,
+    endpoint: str,
+    label: str,
+    begin_date: str,
+    end_date: str,
+    direction: str = "desc",
+    page: int = 1,
+    size: int = 10,
+    access_token: Optional[str] = None,
+) -> str:
+    """
+    通过共享连接池调用 Gitee Compass API, 返回响应文本或错误信息的 JSON 字符串。
+
+    access_token 默认读取环境变量 GITEE_ACCESS_TOKEN; 调用方传入其他令牌时, 缓存按令牌隔离
+    (不同令牌可见的数据可能不同), 限流仍共用同一主机的并发名额与该令牌自己的令牌桶。
+
+    成功的响应会写入进程内缓存, 相同参数的后续调用直接命中缓存; 错误响应不缓存。
+    已结束 DISK_CACHE_SETTLE_DAYS 天以上的历史窗口还会写入持久化磁盘缓存 (若已启用), 服务重启后依然有效。
+    缓存未命中时, 参数相同的并发调用会合并为一次上游请求。
+    条目刚过期但仍在 stale 期内时直接返回旧值, 同时在后台重新请求上游并回填缓存。
+    """
+    full_url = base_url.rstrip("/") + "/" + endpoint.lstrip("/")
+    default_token = os.getenv("GITEE_ACCESS_TOKEN")
+    token = access_token or default_token
+
+    if not token:
+        return json.dumps({"status": 401, "error": "Access token not found in .env file."})
+
+    scope = None if token == default_token else hashlib.sha256(token.encode()).hexdigest()[:16]
+    cache_key = make_key(full_url, label, begin_date, end_date, direction, page, size, scope)
+    with span("compass.post", endpoint=endpoint, label=label, begin_date=begin_date, end_date=end_date, page=page) as current:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            current.set("cache", "memory")
+            return cached
+
+        payload = _query_payload(token, label, begin_date, end_date, direction, page, size)
+        stale = response_cache.get_stale(cache_key)
+        if stale is not None:
+            current.set("cache", "stale")
+            _revalidate(cache_key, full_url, endpoint, payload)
+            return stale
+        return await inflight_requests.do(
+            cache_key, lambda: _fetch_uncached(cache_key, full_url, endpoint, payload)
+        )
+
+
+async def refresh_compass(
+    base_url: str,
+    endpoint: str,
+    label: str,
+    begin_date: str,
+    end_date: str,
+    direction: str = "desc",
+    page: int = 1,
+    size: int = 10,
+) -> str:
+    """跳过内存缓存直接请求上游并回填缓存 (供后台预取使用), 返回值与 post_to_compass 相同。"""
+    full_url = base_url.rstrip("/") + "/" + endpoint.lstrip("/")
+    token = os.getenv("GITEE_ACCESS_TOKEN")
+    if not token:
+        return json.dumps({"status": 401, "error": "Access token not found in .env file."})
+    cache_key = make_key(full_url, label, begin_date, end_date, direction, page, size)
+    payload = _query_payload(token, label, begin_date, end_date, direction, page, size)
+    return await inflight_requests.do(
+        cache_key, lambda: _fetch_uncached(cache_key, full_url, endpoint, payload)
+    )
+
+
+def _query_payload(token: str, label: str, begin_date: str, end_date: str, direction: str, page: int, size: int) -> dict:
+    return {
+        "access_token": token,
+        "label": label,
+        "direction": direction,
+        "begin_date": begin_date,
+        "end_date": end_date,
+        "page": page,
+        "size": size,
+    }
+
+
+def _revalidate(cache_key: str, full_url: str, endpoint: str, payload: dict) -> None:
+    """在后台重新请求一个已过期的条目 (同一键同时只有一个), 不阻塞当前调用。"""
+    if cache_key in _revalidations:
+        return
+    # 使用空的上下文, 后台请求不计入触发它的工具调用的指标与追踪
+    task = asyncio.get_running_loop().create_task(
+        inflight_requests.do(cache_key, lambda: _fetch_uncached(cache_key, full_url, endpoint, payload)),
+        context=contextvars.Context(),
+    )
+    _revalidations[cache_key] = task
+
+    def done(finished: asyncio.Task) -> None:
+        _revalidations.pop(cache_key, None)
+        if not finished.cancelled() and finished.exception() is not None:
+            print(f"后台刷新缓存失败: {finished.exception()!r}")
+
+    task.add_done_callback(done)
+
+
+async def _fetch_uncached(cache_key: str, full_url: str, endpoint: str, payload: dict) -> str:
+    """查询磁盘缓存并在未命中时请求上游, 成功后回填各级缓存。"""
+    end_date = payload["end_date"]
+    settled = is_settled(end_date)
+    stale = stale_windows.get(cache_key, DEFAULT_STALE_SECONDS)
+    if settled and disk_cache is not None:
+        with span("disk_cache.get") as current:
+            cached = await asyncio.to_thread(disk_cache.get, cache_key)
+            current.set("hit", cached is not None)
+        if cached is not None:
+            response_cache.set(cache_key, cached, ttl_for(endpoint, end_date), stale=stale)
+            return cached
+
+    try:
+        response = await _post_with_retry(full_url, payload)
+        response.raise_for_status()
+        response_cache.set(cache_key, response.text, ttl_for(endpoint, end_date), stale=stale)
+        if settled and disk_cache is not None:
+            await asyncio.to_thread(disk_cache.set, cache_key, response.text)
+        return response.text
+    except httpx.HTTPStatusError as e:
+        error = {"status": e.response.status_code, "error": "HTTP Error", "details": e.response.text}
+        retry_after = parse_retry_after(e.response.headers.get("Retry-After"))
+        if retry_after is not None:
+            error["retry_after"] = round(retry_after, 1)
+        return json.dumps(error)
+    except httpx.RequestError as e:
+        return json.dumps({"status": 500, "error": "Request Failed", "details": str(e)})
+
+
+async def _post_with_retry(full_url: str, payload: dict) -> httpx.Response:
+    """
+    经限流后发送查询 POST, 过载时带抖动指数退避重试。
+
+    每次尝试先取主机与访问令牌的令牌桶, 再占用主机的自适应并发名额; 429/5xx/超时/连接错误
+    会让并发上限减半, 并在重试预算允许时退避后重试 (有 Retry-After 时至少等待该时长,
+    同时暂停该主机的令牌桶)。最后一次尝试的响应原样返回, 传输错误则重新抛出。
+
+    每次尝试的超时不超过调用剩余的时间预算, 退避等待超出剩余预算时直接放弃重试;
+    预算用完抛出 DeadlineExceeded (因预算缩短而超时不视为上游过载, 不调整并发上限)。
+    """
+    headers = {"Content-Type": "application/json"}
+    client = get_client()
+    host = httpx.URL(full_url).host
+    limiter = host_limiter(full_url)
+    buckets = rate_buckets(full_url, payload["access_token"])
+    _retry_budget.record_request()
+
+    for attempt in range(1, RETRY_ATTEMPTS + 1):
+        with span("http.post", host=host, attempt=attempt) as current:
+            queued = time.perf_counter()
+            # 预算已用完时不再排队占用令牌与并发名额
+            budget(REQUEST_TIMEOUT)
+            for bucket in buckets:
+                await bucket.acquire()
+            started = await limiter.acquire()
+            sent = time.perf_counter()
+            observe_phase("queue", sent - queued)
+            current.set("queue_ms", round((sent - queued) * 1000, 3))
+            # 被取消等其他异常不调整并发上限
+            outcome = "ignore"
+            try:
+                timeout = budget(REQUEST_TIMEOUT)
+                response = await client.post(url=full_url, headers=headers, json=payload, timeout=timeout)
+                UPSTREAM_REQUESTS.inc((host, upstream_outcome(response.status_code)))
+                current.set("status", response.status_code)
+                current.set("bytes", len(response.content))
+                if response.status_code in RETRYABLE_STATUS:
+                    outcome, error = "overload", None
+                else:
+                    outcome = "success" if response.is_success else "ignore"
+                    return response
+            except httpx.TransportError as e:
+                UPSTREAM_REQUESTS.inc((host, upstream_outcome(error=e)))
+                if isinstance(e, httpx.TimeoutException) and timeout < REQUEST_TIMEOUT:
+                    raise DeadlineExceeded(f"Upstream request to {host} ran out of the call's time budget.") from e
+                outcome, response, error = "overload", None, e
+            finally:
+                observe_phase("upstream", time.perf_counter() - sent)
+                limiter.release(started, outcome)
+
+        retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+        if retry_after is not None:
+            buckets[0].pause(min(retry_after, RETRY_AFTER_MAX))
+        delay = max(retry_after or 0.0, backoff_delay(attempt, RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX))
+        left = remaining()
+        give_up = (
+            attempt == RETRY_ATTEMPTS
+            or (retry_after is not None and retry_after > RETRY_AFTER_MAX)
+            or (left is not None and delay >= left)
+            or not _retry_budget.try_spend()
+        )
+        if give_up:
+            if error is not None:
+                raise error
+            return response
+        UPSTREAM_RETRIES.inc((host,))
+        await asyncio.sleep(delay)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# compass_columns.py
+# Compass 条目的列式表示与向量化分组聚合: 只抽取需要的字段, 转成紧凑的 NumPy 数组
+# (数值 float64, 时间 datetime64, 类别字典编码为 int32), 分组、分桶、聚合全部用数组运算完成。
+
+import math
+import numpy as np
+
+MISSING_CATEGORY = "(none)"
+# 时间字段的解析精度: 日期 (YYYY-MM-DD) 或秒 (YYYY-MM-DDTHH:MM:SS); 时区后缀被忽略
+_DATETIME_WIDTH = {"D": 10, "s": 19}
+# 时长字段支持的单位 -> 秒数
+DURATION_UNITS = {"seconds": 1, "minutes": 60, "hours": 3600, "days": 86400}
+
+
+# --- 列构建 ---
+
+def _field(items: list, field: str) -> list:
+    return [item.get(field) if isinstance(item, dict) else None for item in items]
+
+
+def numeric_column(items: list, field: str) -> np.ndarray:
+    """取数值列, 缺失或非数值记为 NaN。"""
+    values = _field(items, field)
+    return np.array(
+        [v if isinstance(v, (int, float)) and not isinstance(v, bool) else np.nan for v in values],
+        dtype=float,
+    )
+
+
+def datetime_column(items: list, field: str, unit: str = "D") -> np.ndarray:
+    """取时间列 (datetime64[unit]), 只使用字符串开头的日期/时间部分, 无法识别的记为 NaT。"""
+    width = _DATETIME_WIDTH[unit]
+    values = np.array([v[:width].replace(" ", "T") if isinstance(v, str) else "" for v in _field(items, field)])
+    dates = np.full(len(values), np.datetime64("NaT"), dtype=f"datetime64[{unit}]")
+    if not len(values):
+        return dates
+    # 秒精度时也接受只有日期的值
+    valid = np.char.str_len(values) >= 10
+    if valid.any():
+        try:
+            dates[valid] = values[valid].astype(f"datetime64[{unit}]")
+        except ValueError:
+            # 存在格式不正确的值时逐个解析
+            for i in np.flatnonzero(valid):
+                try:
+                    dates[i] = np.datetime64(values[i], unit)
+                except ValueError:
+                    pass
+    return dates
+
+
+def date_column(items: list, field: str) -> np.ndarray:
+    return datetime_column(items, field, "D")
+
+
+def category_column(items: list, field: str) -> np.ndarray:
+    """取类别列为字符串数组 (object), 缺失记为空字符串。"""
+    return np.array(["" if v is None else str(v) for v in _field(items, field)], dtype=object)
+
+
+def encode_categories(items: list, field: str) -> tuple[np.ndarray, list[str]]:
+    """类别列字典编码: 返回 (int32 编码, 类别列表), 缺失值编码为 MISSING_CATEGORY。"""
+    mapping: dict[str, int] = {}
+    codes = np.fromiter(
+        (mapping.setdefault(MISSING_CATEGORY if v is None else str(v), len(mapping)) for v in _field(items, field)),
+        dtype=np.int32,
+        count=len(items),
+    )
+    return codes, list(mapping)
+
+
+def duration_column(start: np.ndarray, end: np.ndarray, unit: str = "hours") -> np.ndarray:
+    """两个时间列之差 (end - start), 以 unit 为单位的 float64; 任一端缺失或结果为负时为 NaN。"""
+    seconds = (end.astype("datetime64[s]") - start.astype("datetime64[s]")).astype("float64")
+    seconds[np.isnat(start) | np.isnat(end)] = np.nan
+    seconds[seconds < 0] = np.nan
+    return seconds / DURATION_UNITS[unit]
+
+
+# --- 时间分桶 ---
+
+def bucket_dates(dates: np.ndarray, bucket: str) -> np.ndarray:
+    """把日期向下取整到桶的起点 (周以周一为起点), 结果为 datetime64[D]。"""
+    dates = dates.astype("datetime64[D]")
+    if bucket == "day":
+        return dates
+    if bucket == "week":
+        # 1970-01-01 是周四, 偏移 3 天后按 7 取模即为距本周一的天数
+        days = dates.astype("int64")
+        weeks = (days - (days + 3) % 7).astype("datetime64[D]")
+        return np.where(np.isnat(dates), dates, weeks)
+    unit = "M" if bucket == "month" else "Y"
+    return dates.astype(f"datetime64[{unit}]").astype("datetime64[D]")
+
+
+def full_date_axis(keys: np.ndarray, bucket: str) -> np.ndarray:
+    """补齐首尾之间缺失的时间桶, 使没有数据的时间段显示为 0 而不是被跳过。"""
+    first, last = keys.min(), keys.max()
+    if bucket == "day":
+        return np.arange(first, last + 1)
+    if bucket == "week":
+        return np.arange(first, last + 1, 7)
+    unit = "M" if bucket == "month" else "Y"
+    return np.arange(first.astype(f"datetime64[{unit}]"), last.astype(f"datetime64[{unit}]") + 1).astype("datetime64[D]")
+
+
+# --- 分组聚合 ---
+
+def group_index(key_columns: list[np.ndarray], n_rows: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    多列分组: 返回 (每行所属的组号, 每组的键 [组数 x 列数])。
+
+    各列先是整数编码 (类别编码或时间桶的整数值), 再按行合并求唯一值; 没有分组列时所有行同属一组。
+    """
+    if not key_columns:
+        return np.zeros(n_rows, dtype=np.int64), np.zeros((1, 0), dtype=np.int64)
+    # 每列先压缩为 0..k-1 的稠密编码, 再按混合进制合成一个 int64 键, 用一维 unique 分组 (比按行 unique 快得多)
+    uniques, codes = [], []
+    for column in key_columns:
+        values, inverse = np.unique(np.asarray(column, dtype=np.int64), return_inverse=True)
+        uniques.append(values)
+        codes.append(inverse.reshape(-1))
+    radix = [len(u) for u in uniques]
+    if math.prod(radix) >= 2 ** 62:
+        stacked = np.stack([np.asarray(c, dtype=np.int64) for c in key_columns], axis=1)
+        keys, inverse = np.unique(stacked, axis=0, return_inverse=True)
+        return inverse.reshape(-1), keys
+    flat = np.zeros(n_rows, dtype=np.int64)
+    for code, k in zip(codes, radix):
+        flat = flat * k + code
+    combined, inverse = np.unique(flat, return_inverse=True)
+    keys = np.empty((len(combined), len(key_columns)), dtype=np.int64)
+    remainder = combined
+    for i in range(len(key_columns) - 1, -1, -1):
+        keys[:, i] = uniques[i][remainder % radix[i]]
+        remainder = remainder // radix[i]
+    return inverse.reshape(-1), keys
+
+
+def grouped_quantile(index: np.ndarray, values: np.ndarray, size: int, q: float) -> np.ndarray:
+    """每组的分位数 (线性插值), 按 (组, 值) 排序后直接取位置, 不逐组循环。"""
+    valid = ~np.isnan(values)
+    index, values = index[valid], values[valid]
+    counts = np.bincount(index, minlength=size)
+    order = np.lexsort((values, index))
+    values = values[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    result = np.full(size, np.nan)
+    present = counts > 0
+    position = starts[present] + q * (counts[present] - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    fraction = position - lower
+    result[present] = values[lower] * (1 - fraction) + values[upper] * fraction
+    return result
+
+
+def grouped_distinct(index: np.ndarray, codes: np.ndarray, size: int) -> np.ndarray:
+    """每组中不同编码值的个数。"""
+    pairs = np.unique(np.stack([index.astype(np.int64), codes.astype(np.int64)], axis=1), axis=0)
+    return np.bincount(pairs[:, 0], minlength=size).astype(float)
+
+
+def grouped_aggregate(index: np.ndarray, values: np.ndarray | None, size: int, how: str) -> np.ndarray:
+    """
+    按组号聚合 (bincount / ufunc.at / 排序取位置), 不存在的组为 0 (count/sum) 或 NaN。
+
+    how: count / sum / mean / min / max / median / pNN (如 p90)。
+    """
+    if how == "count":
+        return np.bincount(index, minlength=size).astype(float)
+    if how == "median":
+        return grouped_quantile(index, values, size, 0.5)
+    if how.startswith("p") and how[1:].replace(".", "", 1).isdigit():
+        return grouped_quantile(index, values, size, float(how[1:]) / 100)
+    valid = ~np.isnan(values)
+    index, values = index[valid], values[valid]
+    if how == "sum":
+        return np.bincount(index, weights=values, minlength=size)
+    if how == "mean":
+        sums = np.bincount(index, weights=values, minlength=size)
+        counts = np.bincount(index, minlength=size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    if how in ("min", "max"):
+        result = np.full(size, np.nan)
+        (np.fmin if how == "min" else np.fmax).at(result, index, values)
+        return result
+    raise ValueError(f"Unknown aggregation: {how!r}")
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# compass_deadline.py
+# 工具调用的时间预算: 每次工具调用开始时确定一个截止时间, 经 contextvars 传递到其中的上游请求、
+# 重试退避与渲染任务。预算用完 (或调用方离开) 时其中的工作会被取消, 不再占用连接、并发名额与渲染进程。
+#
+# 被多个调用合并共享的底层任务 (见 compass_client.SingleFlight) 使用共享的 Deadline:
+# 取所有等待者中最晚的截止时间, 某个等待者超时离开不会缩短其他等待者的预算。
+
+import os
+import time
+import asyncio
+import contextlib
+import contextvars
+from typing import AsyncIterator, Optional
+from dotenv import load_dotenv
+
+# --- 初始化 ---
+
+# 加载 .env 文件 (预算配置在模块导入时读取)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+dotenv_path = os.path.join(script_dir, '.env')
+load_dotenv(dotenv_path=dotenv_path)
+
+# --- 配置 ---
+# 单次工具调用的默认时间预算 (秒), 0 表示不限制; 客户端可以要求更短的预算 (见 compass_metrics.InstrumentedFastMCP)
+TOOL_DEADLINE = float(os.getenv("COMPASS_TOOL_DEADLINE", "120"))
+
+
+class DeadlineExceeded(Exception):
+    """调用的时间预算已用完。"""
+
+
+class Deadline:
+    """一个截止时间 (time.monotonic() 时刻, None 表示不限制), 可被多个等待者共享。"""
+
+    __slots__ = ("at",)
+
+    def __init__(self, at: Optional[float]):
+        self.at = at
+
+    def extend(self, at: Optional[float]) -> None:
+        """并入另一个等待者的截止时间: 取较晚的一个, 任一方不限制则不限制。"""
+        if self.at is not None:
+            self.at = None if at is None else max(self.at, at)
+
+    def remaining(self) -> Optional[float]:
+        return None if self.at is None else self.at - time.monotonic()
+
+
+_current: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("compass_deadline", default=None)
+
+
+def deadline_at() -> Optional[float]:
+    """当前上下文的截止时刻 (time.monotonic()), 没有预算时为 None。"""
+    deadline = _current.get()
+    return None if deadline is None else deadline.at
+
+
+def remaining() -> Optional[float]:
+    """当前上下文剩余的预算 (秒, 可能为负), 没有预算时为 None。"""
+    deadline = _current.get()
+    return None if deadline is None else deadline.remaining()
+
+
+def budget(timeout: float) -> float:
+    """单个操作可用的超时: 不超过剩余预算; 预算已用完时抛出 DeadlineExceeded。"""
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("Deadline exceeded before the operation started.")
+    return min(timeout, left)
+
+
+def shared_context(deadline: Deadline) -> contextvars.Context:
+    """复制当前上下文并换上给定的 (共享) 截止时间, 用于创建多个调用共享的底层任务。"""
+    context = contextvars.copy_context()
+    context.run(_current.set, deadline)
+    return context
+
+
+@contextlib.asynccontextmanager
+async def _scope_until(at: Optional[float]):
+    now = time.monotonic()
+    token = _current.set(Deadline(at))
+    try:
+        async with asyncio.timeout(None if at is None else max(at - now, 0.0)) as scope:
+            yield
+    except TimeoutError:
+        if scope.expired():
+            raise DeadlineExceeded("Call ran out of its time budget; pending upstream work was cancelled.") from None
+        raise
+    finally:
+        _current.reset(token)
+
+
+def _until(seconds: Optional[float]) -> Optional[float]:
+    """seconds 秒后的截止时刻, 不晚于外层的截止时间; seconds 为 None 或不大于 0 时只继承外层。"""
+    at = time.monotonic() + seconds if seconds and seconds > 0 else None
+    outer = deadline_at()
+    if outer is not None:
+        at = outer if at is None else min(at, outer)
+    return at
+
+
+@contextlib.asynccontextmanager
+async def deadline_scope(seconds: Optional[float]):
+    """
+    在时间预算内运行代码块: 到期时取消块内正在等待的操作并抛出 DeadlineExceeded。
+
+    嵌套时取较早的截止时间; seconds 为 None 或不大于 0 时只继承外层的截止时间。
+    计时依赖取消当前任务, 不能跨越异步生成器的 yield, 生成器中请使用 iterate_within。
+    """
+    async with _scope_until(_until(seconds)):
+        yield
+
+
+async def iterate_within(iterator: AsyncIterator, seconds: Optional[float]) -> AsyncIterator:
+    """
+    在时间预算内逐项迭代异步迭代器, 到期时关闭它并抛出 DeadlineExceeded。
+
+    只在等待下一项时计时 (截止时刻固定, 消费方处理每一项的耗时同样计入预算), 可以在 SSE 生成器中使用。
+    """
+    at = _until(seconds)
+    try:
+        while True:
+            async with _scope_until(at):
+                try:
+                    item = await anext(iterator)
+                except StopAsyncIteration:
+                    return
+            yield item
+    finally:
+        await iterator.aclose()
@@ -0,0 +1,124 @@
+# compass_index.py
+# 同步库的按日统计索引: 每条记录写入时把它对各指标的贡献 (计数或字段值) 累加到所在日期的桶里,
+# 查询时把按日的值做成前缀和数组, 任意 [begin_date, end_date] 窗口只需两次二分查找与一次相减。
+
+import json
+from typing import Optional
+import numpy as np
+from compass_bulk import CompassDataError
+
+# 每个数据集的索引指标: (指标名, 日期字段, 数值字段)
+#   日期字段为 None 时使用记录的事件日期 (见 compass_sync.record_date);
+#   数值字段为 None 时每条记录计 1, 否则累加该字段的数值。
+INDEX_METRICS = {
+    "git_commit": (
+        ("commits", None, None),
+        ("lines_added", None, "lines_added"),
+        ("lines_removed", None, "lines_removed"),
+    ),
+    "issue": (
+        ("opened", None, None),
+        ("closed", "closed_at", None),
+    ),
+    "pull_request": (
+        ("opened", None, None),
+        ("closed", "closed_at", None),
+        ("merged", "merged_at", None),
+    ),
+}
+DEFAULT_METRICS = (("count", None, None),)
+
+
+def metric_definitions(dataset: str) -> tuple:
+    return INDEX_METRICS.get(dataset, DEFAULT_METRICS)
+
+
+def contributions(dataset: str, item, event_date: Optional[str]) -> dict[tuple[str, str], float]:
+    """一条记录对各 (指标, 日期) 桶的贡献; 日期缺失或数值字段不是数字时不计入。"""
+    result: dict[tuple[str, str], float] = {}
+    if not isinstance(item, dict):
+        return result
+    for metric, date_field, value_field in metric_definitions(dataset):
+        if date_field is None:
+            day = event_date
+        else:
+            value = item.get(date_field)
+            day = value[:10] if isinstance(value, str) and len(value) >= 10 else None
+        if day is None:
+            continue
+        if value_field is None:
+            amount = 1.0
+        else:
+            amount = item.get(value_field)
+            if not isinstance(amount, (int, float)) or isinstance(amount, bool):
+                continue
+        key = (metric, day)
+        result[key] = result.get(key, 0.0) + float(amount)
+    return result
+
+
+def parse_day(value: str, name: str) -> np.datetime64:
+    """把 YYYY-MM-DD 解析为 datetime64[D], 格式不正确时抛出 CompassDataError (400)。"""
+    try:
+        if not isinstance(value, str) or len(value) != 10:
+            raise ValueError
+        return np.datetime64(value, "D")
+    except ValueError:
+        raise CompassDataError(json.dumps({
+            "status": 400, "error": "Invalid Date", "details": f"{name} must be a date in YYYY-MM-DD format, got {value!r}.",
+        })) from None
+
+
+def validate_range(begin_date: str, end_date: str) -> tuple[np.datetime64, np.datetime64]:
+    """校验日期闭区间, 返回 (起, 止); 日期格式不正确或起点晚于终点时抛出 CompassDataError (400)。"""
+    begin, end = parse_day(begin_date, "begin_date"), parse_day(end_date, "end_date")
+    if begin > end:
+        raise CompassDataError(json.dumps({
+            "status": 400, "error": "Invalid Date", "details": f"begin_date {begin_date} is after end_date {end_date}.",
+        }))
+    return begin, end
+
+
+class PrefixIndex:
+    """按日期排序的前缀和数组; range_sum 在 O(log n) 内求出任意日期闭区间内各指标的总和。"""
+
+    def __init__(self, metrics: tuple[str, ...], days: np.ndarray, values: dict[str, np.ndarray]):
+        self.metrics = metrics
+        self.days = days
+        self.cumulative = {
+            metric: np.concatenate(([0.0], np.cumsum(values[metric]))) for metric in metrics
+        }
+
+    @classmethod
+    def from_rows(cls, metrics: tuple[str, ...], rows: list[tuple[str, str, float]]) -> "PrefixIndex":
+        """由 (指标, 日期, 值) 行构建; 各指标共享同一条日期轴, 某指标在某天没有值时记 0。"""
+        if not rows:
+            return cls(metrics, np.array([], dtype="datetime64[D]"), {m: np.zeros(0) for m in metrics})
+        names = np.array([r[0] for r in rows], dtype=object)
+        days = np.array([r[1] for r in rows], dtype="datetime64[D]")
+        amounts = np.array([r[2] for r in rows], dtype=float)
+        axis, day_index = np.unique(days, return_inverse=True)
+        values = {}
+        for metric in metrics:
+            mask = names == metric
+            values[metric] = np.bincount(day_index[mask], weights=amounts[mask], minlength=len(axis))
+        return cls(metrics, axis, values)
+
+    def range_sum(self, begin_date: str, end_date: str) -> dict[str, float]:
+        """日期闭区间内各指标的总和; 日期不合法时抛出 CompassDataError。"""
+        begin, end = validate_range(begin_date, end_date)
+        lo = np.searchsorted(self.days, begin, side="left")
+        hi = np.searchsorted(self.days, end, side="right")
+        totals = {}
+        for metric in self.metrics:
+            value = float(self.cumulative[metric][hi] - self.cumulative[metric][lo])
+            totals[metric] = int(value) if value.is_integer() else round(value, 4)
+        return totals
+
+    @property
+    def first_day(self) -> Optional[str]:
+        return str(self.days[0]) if len(self.days) else None
+
+    @property
+    def last_day(self) -> Optional[str]:
+        return str(self.days[-1]) if len(self.days) else None
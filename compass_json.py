@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# compass_json.py
+# 工具结果的 JSON 编解码: 已安装 orjson 时使用 orjson (pip install orjson), 否则回退到标准库 json。
+# 输出统一为紧凑格式且保留非 ASCII 字符; RawJSON 包装的上游响应原文会被原样嵌入输出, 不做解析再序列化。
+
+import re
+import json
+import uuid
+import contextlib
+from typing import Any, Callable, ContextManager
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 解析/序列化阶段的计时器, 默认不计时; 服务进程中由 compass_metrics 导入时注册 (见 set_phase_timer),
+# 本模块因此不依赖 MCP 与 Starlette
+_phase_timer: Callable[[str], ContextManager] = lambda phase: contextlib.nullcontext()
+
+
+def set_phase_timer(timer: Callable[[str], ContextManager]) -> None:
+    """注册阶段计时器: timer(phase) 返回计时 with 块耗时的上下文管理器。"""
+    global _phase_timer
+    _phase_timer = timer
+
+
+# 标准库回退路径中 RawJSON 的占位符前缀 (每个进程随机, 不会与真实数据冲突)
+_PLACEHOLDER = f"__compass_raw_{uuid.uuid4().hex}_"
+_PLACEHOLDER_RE = re.compile(f'"{_PLACEHOLDER}(\\d+)"')
+
+
+class RawJSON:
+    """已经是合法 JSON 的文本 (通常是上游响应原文), 序列化时原样嵌入。"""
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+def loads(data: str | bytes) -> Any:
+    """解析 JSON, 格式错误时抛出 ValueError (orjson.JSONDecodeError 与 json.JSONDecodeError 都是其子类)。"""
+    with _phase_timer("parse"):
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+
+def _orjson_default(obj):
+    if isinstance(obj, RawJSON):
+        return orjson.Fragment(obj.text)
+    raise TypeError
+
+
+def dumps(obj: Any) -> str:
+    """序列化为紧凑 JSON 字符串; obj 中的 RawJSON 原样嵌入。"""
+    with _phase_timer("serialize"):
+        return _dumps(obj)
+
+
+def _dumps(obj: Any) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            # orjson 不支持的类型 (如超出 64 位的整数) 回退到标准库
+            pass
+    raw: list[str] = []
+
+    def default(o):
+        if isinstance(o, RawJSON):
+            raw.append(o.text)
+            return f"{_PLACEHOLDER}{len(raw) - 1}"
+        raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+    text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=default)
+    if not raw:
+        return text
+    return _PLACEHOLDER_RE.sub(lambda m: raw[int(m.group(1))], text)
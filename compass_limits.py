@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# compass_limits.py
+# 调用 Compass API 时的客户端限流与重试策略:
+#   - TokenBucket: 令牌桶限速 (按上游主机、按访问令牌各一个), 可被 Retry-After 暂停;
+#   - AdaptiveLimiter: AIMD 自适应并发上限, 成功时缓慢加一, 遇到 429/5xx/超时减半;
+#   - RetryBudget: 滑动窗口内重试次数不超过请求数的一定比例, 防止故障时重试风暴放大负载;
+#   - backoff_delay / parse_retry_after: 带抖动的指数退避与 Retry-After 解析。
+
+import time
+import random
+import asyncio
+import collections
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+class TokenBucket:
+    """令牌桶: 平均每秒 rate 个请求, 最多积攒 burst 个; rate <= 0 表示不限速。"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds: float) -> None:
+        """上游返回 Retry-After 时暂停发放令牌, 并清空积攒的令牌, 恢复后不会立即突发。"""
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = max(self.updated, self.paused_until)
+
+    async def acquire(self) -> None:
+        if self.rate <= 0 and self.paused_until <= time.monotonic():
+            return
+        # 持锁等待, 保证令牌按到达顺序发放
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                if self.rate <= 0:
+                    return
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD 自适应并发上限: 每次成功把上限增加 1/limit (约每轮往返加一),
+    过载信号 (429/5xx/超时) 把上限乘以 decrease_factor。只有在上次减少之后才发出的请求
+    能再次触发减少, 同一轮往返中同时失败的多个请求只减一次。
+
+    release 是同步方法, 在 finally 中调用时不会因为再次被取消而漏掉释放、永久占用名额;
+    等待者各自持有一个 future, 释放时直接唤醒, 不需要获取锁。
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 64, decrease_factor: float = 0.5):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.decrease_factor = decrease_factor
+        self.inflight = 0
+        self._last_decrease = 0.0
+        self._waiters: collections.deque[asyncio.Future] = collections.deque()
+
+    async def acquire(self) -> float:
+        """等待空闲名额, 返回请求的开始时刻 (释放时传回)。"""
+        while self.inflight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif not waiter.cancelled():
+                    # 已被唤醒但随即被取消: 把这次唤醒让给下一个等待者
+                    self._wake()
+                raise
+        self.inflight += 1
+        return time.monotonic()
+
+    def release(self, started: float, outcome: str) -> None:
+        """outcome: success (加性增加) / overload (乘性减少) / ignore (不调整, 如 4xx 客户端错误)。"""
+        self.inflight -= 1
+        if outcome == "success":
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        elif outcome == "overload" and started >= self._last_decrease:
+            self.limit = max(self.minimum, self.limit * self.decrease_factor)
+            self._last_decrease = time.monotonic()
+        self._wake()
+
+    def _wake(self) -> None:
+        """按到达顺序唤醒不超过空闲名额数的等待者, 被唤醒者重新检查是否有名额。"""
+        free = int(self.limit) - self.inflight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def snapshot(self) -> dict:
+        return {"limit": round(self.limit, 2), "inflight": self.inflight}
+
+
+class RetryBudget:
+    """滑动窗口 (window 秒) 内, 重试次数不超过 minimum + ratio x 首次请求数。"""
+
+    def __init__(self, ratio: float, minimum: int, window: float = 10.0):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+        self._requests: collections.deque = collections.deque()
+        self._retries: collections.deque = collections.deque()
+
+    def _trim(self, now: float) -> None:
+        for events in (self._requests, self._retries):
+            while events and now - events[0] > self.window:
+                events.popleft()
+
+    def record_request(self) -> None:
+        now = time.monotonic()
+        self._trim(now)
+        self._requests.append(now)
+
+    def try_spend(self) -> bool:
+        """预算允许时记一次重试并返回 True。"""
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._retries) >= self.minimum + self.ratio * len(self._requests):
+            return False
+        self._retries.append(now)
+        return True
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """第 attempt 次重试 (从 1 开始) 前的等待秒数: full jitter 指数退避, 即 [0, min(cap, base*2^(attempt-1))] 内均匀随机。"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头 (秒数或 HTTP 日期), 返回需要等待的秒数; 无法解析时返回 None。"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment is None:
+        return None
+    return max(0.0, moment.timestamp() - time.time())
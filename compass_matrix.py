@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# compass_matrix.py
+# 多仓库 x 多指标模型的扇出获取: 所有 (仓库, 指标) 单元格并发请求, 受全局并发上限与
+# compass_client 中按主机的并发上限共同约束; 单元格完成时立即回调, 单个单元格失败不影响其他单元格。
+
+import os
+import json
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+from compass_client import post_to_compass
+from compass_bulk import DATASETS, MODEL_DATASETS, CompassDataError, fetch_range_data
+import compass_json
+from compass_json import RawJSON
+
+# --- 配置 ---
+# 同时进行中的单元格数 (每个单元格在 fetch_all 模式下还会并发翻页, 实际请求数另受 COMPASS_HOST_CONCURRENCY 约束)
+MATRIX_CONCURRENCY = int(os.getenv("COMPASS_MATRIX_CONCURRENCY", "16"))
+# 单次调用的最大单元格数 (仓库数 x 指标数)
+MATRIX_MAX_CELLS = int(os.getenv("COMPASS_MATRIX_MAX_CELLS", "200"))
+
+# 可用于矩阵的指标模型: 指标模型服务上的数据集
+MODEL_METRICS = tuple(MODEL_DATASETS)
+
+CellCallback = Callable[[dict, int, int], Awaitable[None]]
+
+
+class MatrixRequestError(ValueError):
+    """仓库或指标参数不合法。"""
+
+
+def validate_matrix(labels: list[str], metrics: list[str]) -> tuple[list[str], list[str]]:
+    """去掉重复与空白项 (保持顺序), 检查指标名与单元格数上限。"""
+    labels = list(dict.fromkeys(label.strip() for label in labels or [] if label and label.strip()))
+    metrics = list(dict.fromkeys(metric.strip() for metric in metrics or MODEL_METRICS if metric and metric.strip()))
+    if not labels:
+        raise MatrixRequestError("labels must contain at least one repository URL.")
+    unknown = [metric for metric in metrics if metric not in MODEL_METRICS]
+    if unknown:
+        raise MatrixRequestError(f"Unknown metric models {unknown}; available: {', '.join(MODEL_METRICS)}.")
+    if len(labels) * len(metrics) > MATRIX_MAX_CELLS:
+        raise MatrixRequestError(
+            f"{len(labels)} labels x {len(metrics)} metrics exceeds the limit of {MATRIX_MAX_CELLS} cells."
+        )
+    return labels, metrics
+
+
+def _error_payload(details: str) -> dict:
+    """把上游错误信息 (通常是 JSON 字符串) 转成单元格中的 error 字段。"""
+    try:
+        error = json.loads(details)
+    except ValueError:
+        return {"status": 500, "error": "Invalid Response", "details": details[:500]}
+    if isinstance(error, dict):
+        return error
+    return {"status": 500, "error": "Invalid Response", "details": details[:500]}
+
+
+async def fetch_cell(
+    metric: str,
+    label: str,
+    begin_date: str,
+    end_date: str,
+    page: int = 1,
+    size: int = 10,
+    fetch_all: bool = False,
+) -> tuple[Any, Optional[int]]:
+    """
+    获取一个单元格的数据 (单页或窗口内全部数据), 返回 (数据, 条目数), 失败时抛出 CompassDataError。
+
+    单页结果只解析用于校验与计数, 返回的是上游响应原文 (RawJSON), 输出时原样嵌入而不重新序列化。
+    """
+    base_url, endpoint = DATASETS[metric]
+    if fetch_all:
+        data = await fetch_range_data(base_url, endpoint, label, begin_date, end_date, page_size=size)
+        return data, len(data["items"])
+    text = await post_to_compass(base_url, endpoint, label, begin_date, end_date, page=page, size=size)
+    try:
+        data = compass_json.loads(text)
+    except ValueError:
+        raise CompassDataError(json.dumps({"status": 502, "error": "Invalid JSON", "details": text[:500]}))
+    if isinstance(data, dict) and "error" in data and "items" not in data:
+        raise CompassDataError(text)
+    items = data.get("items") if isinstance(data, dict) else None
+    return RawJSON(text), len(items) if isinstance(items, list) else None
+
+
+async def fetch_matrix(
+    labels: list[str],
+    metrics: list[str],
+    begin_date: str,
+    end_date: str,
+    page: int = 1,
+    size: int = 10,
+    fetch_all: bool = False,
+    on_cell: Optional[CellCallback] = None,
+) -> dict:
+    """
+    并发获取全部 (仓库, 指标) 单元格, 返回 {labels, metrics, matrix, succeeded, failed, errors, elapsed_seconds}。
+
+    matrix[label][metric] 为该单元格的数据; 失败的单元格为 None, 错误详情记录在 errors 中。
+    on_cell(cell, completed, total) 在每个单元格完成时按完成顺序调用, 可用于流式上报进度。
+    """
+    semaphore = asyncio.Semaphore(MATRIX_CONCURRENCY)
+    started = time.perf_counter()
+
+    async def run(label: str, metric: str) -> dict:
+        async with semaphore:
+            cell_started = time.perf_counter()
+            try:
+                data, items = await fetch_cell(metric, label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all)
+                cell = {"label": label, "metric": metric, "status": "success", "data": data, "items": items}
+            except CompassDataError as e:
+                cell = {"label": label, "metric": metric, "status": "error", "error": _error_payload(e.details)}
+            except Exception as e:
+                # 其他异常 (缓存中的坏数据、重试后仍未处理的传输错误等) 同样只算这个单元格失败, 不丢弃其余单元格
+                error = {"status": 500, "error": "Cell Failed", "details": f"{type(e).__name__}: {e}"}
+                cell = {"label": label, "metric": metric, "status": "error", "error": error}
+            cell["elapsed_seconds"] = round(time.perf_counter() - cell_started, 3)
+            return cell
+
+    tasks = [asyncio.create_task(run(label, metric)) for label in labels for metric in metrics]
+    matrix = {label: {metric: None for metric in metrics} for label in labels}
+    errors = []
+    try:
+        for completed, next_cell in enumerate(asyncio.as_completed(tasks), start=1):
+            cell = await next_cell
+            if cell["status"] == "success":
+                matrix[cell["label"]][cell["metric"]] = cell["data"]
+            else:
+                errors.append({"label": cell["label"], "metric": cell["metric"], **cell["error"]})
+            if on_cell is not None:
+                await on_cell(cell, completed, len(tasks))
+    finally:
+        # 调用方被取消时不再继续请求剩余单元格
+        for task in tasks:
+            task.cancel()
+
+    return {
+        "labels": labels,
+        "metrics": metrics,
+        "begin_date": begin_date,
+        "end_date": end_date,
+        "succeeded": len(tasks) - len(errors),
+        "failed": len(errors),
+        "matrix": matrix,
+        "errors": errors,
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def cell_progress_message(cell: dict) -> str:
+    """进度通知中的单元格摘要 (不含数据本身, 数据在最终结果中返回)。"""
+    summary = {"label": cell["label"], "metric": cell["metric"], "status": cell["status"]}
+    if cell["status"] == "success":
+        if cell["items"] is not None:
+            summary["items"] = cell["items"]
+    else:
+        summary["error"] = cell["error"].get("error")
+    return json.dumps(summary, ensure_ascii=False)
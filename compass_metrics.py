@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+# compass_metrics.py
+# 所有工具服务共享的轻量指标层, 以 Prometheus 文本格式在 /metrics 上暴露:
+#   - 每个工具的调用次数 (按结果分类)、总耗时直方图与响应字节数直方图;
+#   - 分阶段耗时直方图 (upstream / parse / serialize / render / publish), 按当前工具归属;
+#   - 上游请求按状态分类的计数、重试次数;
+#   - 缓存命中率、连接池与并发限制器使用情况等在抓取时通过回调读取, 热路径上没有额外开销。
+# 热路径上的每次记录只是一次 perf_counter、一次二分查找和几次整数加法。
+
+import json
+import time
+import bisect
+import asyncio
+import threading
+import contextlib
+import contextvars
+from typing import Callable, Iterable, Optional
+from mcp.server import FastMCP
+from mcp.types import TextContent
+from starlette.requests import Request
+from starlette.responses import Response
+import compass_json
+from compass_tracing import span, trace_call, tracing_endpoint
+from compass_deadline import TOOL_DEADLINE, DeadlineExceeded, deadline_scope
+
+# --- 配置 ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 当前正在执行的工具名, 上游请求、解析、渲染等阶段的耗时按它归属; 不在工具调用中时为 "-"
+current_tool: contextvars.ContextVar[str] = contextvars.ContextVar("compass_current_tool", default="-")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+# --- 指标类型 ---
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name, self.help, self.labelnames = name, help_text, labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value:g}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help_text, labelnames
+        self.buckets = buckets
+        # 标签值 -> [各桶计数 (非累积, 最后一个为 +Inf), 总和]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total:.6f}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+# 抓取时回调: 返回 [(指标名, 类型, 说明, 标签名, [(标签值, 数值)])]
+Collector = Callable[[], list[tuple[str, str, str, tuple, list[tuple[tuple, float]]]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+        self._collectors: list[Collector] = []
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Collector) -> Collector:
+        """注册抓取时调用的回调 (可作为装饰器使用), 用于读取已有的计数或瞬时状态。"""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        # 不同回调可以上报同名指标 (如各模块的缓存命中数), 同名样本合并到一个指标族下输出
+        families: dict[str, tuple[str, str, list[str]]] = {}
+        for collect in self._collectors:
+            try:
+                collected = collect()
+            except Exception as e:
+                # 某个回调失败不影响其余指标的输出
+                lines.append(f"# collector {getattr(collect, '__name__', collect)} failed: {type(e).__name__}")
+                continue
+            for name, kind, help_text, labelnames, samples in collected:
+                family = families.setdefault(name, (kind, help_text, []))
+                family[2].extend(f"{name}{_format_labels(labelnames, labels)} {value:g}" for labels, value in samples)
+        for name, (kind, help_text, samples) in families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+# 进程内共享的指标注册表
+registry = Registry()
+
+TOOL_CALLS = registry.counter("compass_tool_calls_total", "Tool calls by outcome.", ("tool", "outcome"))
+TOOL_DURATION = registry.histogram("compass_tool_duration_seconds", "End-to-end tool call latency.", ("tool",))
+TOOL_RESPONSE_BYTES = registry.histogram(
+    "compass_tool_response_bytes", "UTF-8 size of tool results.", ("tool",), BYTE_BUCKETS
+)
+PHASE_DURATION = registry.histogram(
+    "compass_phase_duration_seconds", "Time spent per phase (upstream/parse/serialize/render/publish).", ("tool", "phase")
+)
+UPSTREAM_REQUESTS = registry.counter(
+    "compass_upstream_requests_total", "Upstream HTTP attempts by host and outcome.", ("host", "outcome")
+)
+UPSTREAM_RETRIES = registry.counter("compass_upstream_retries_total", "Upstream retries by host.", ("host",))
+
+
+# --- 记录辅助函数 ---
+
+def observe_phase(phase: str, seconds: float) -> None:
+    PHASE_DURATION.observe((current_tool.get(), phase), seconds)
+
+
+@contextlib.contextmanager
+def timed(phase: str):
+    """记录 with 块的耗时到当前工具的 phase 阶段 (追踪开启时同时记录为一个 span)。"""
+    start = time.perf_counter()
+    try:
+        with span(phase):
+            yield
+    finally:
+        PHASE_DURATION.observe((current_tool.get(), phase), time.perf_counter() - start)
+
+
+compass_json.set_phase_timer(timed)
+
+
+def upstream_outcome(status_code: Optional[int] = None, error: Optional[BaseException] = None) -> str:
+    """上游请求的结果分类: 2xx / 4xx / 429 / 5xx / timeout / transport_error。"""
+    if error is not None:
+        return "timeout" if "Timeout" in type(error).__name__ else "transport_error"
+    if status_code == 429:
+        return "429"
+    return f"{status_code // 100}xx"
+
+
+def classify_result(text: str) -> str:
+    """
+    工具返回值的结果分类: ok / client_error / rate_limited / upstream_error / error
+    (异常、取消与超出时间预算另记为 exception / cancelled / deadline_exceeded)。
+
+    工具以 {"status", "error", ...} 形式返回错误, 这类结果都很短, 只解析短结果的开头即可判断, 大结果直接视为成功。
+    """
+    if len(text) > 4096 or '"error"' not in text[:200]:
+        return "ok"
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return "ok"
+    if not isinstance(data, dict) or "error" not in data:
+        return "ok"
+    status = data.get("status") or data.get("status_code")
+    if status == 429:
+        return "rate_limited"
+    if isinstance(status, int) and 400 <= status < 500:
+        return "client_error"
+    if isinstance(status, int) and status >= 500:
+        return "upstream_error"
+    return "error"
+
+
+def record_tool_call(tool: str, seconds: float, outcome: str, response_bytes: Optional[int] = None) -> None:
+    TOOL_CALLS.inc((tool, outcome))
+    TOOL_DURATION.observe((tool,), seconds)
+    if response_bytes is not None:
+        TOOL_RESPONSE_BYTES.observe((tool,), response_bytes)
+
+
+def _result_text(result) -> str:
+    """FastMCP call_tool 的返回值 (内容块列表, 或 (内容块, 结构化结果)) 中的文本。"""
+    if isinstance(result, tuple):
+        result = result[0]
+    if isinstance(result, dict):
+        return ""
+    return "".join(getattr(block, "text", "") for block in result)
+
+
+# --- 抓取端点 ---
+
+async def metrics_endpoint(_request: Request) -> Response:
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
+# 当前 HTTP 请求 (SSE 连接或无状态流式 HTTP 请求) 断开时置位的事件; stdio 等不经过 HTTP 请求的会话中为 None。
+# MCP 会话循环在请求处理函数中启动 (SSE) 或由它启动 (无状态流式 HTTP), 其中的工具调用都继承请求的上下文
+_connection_closed: contextvars.ContextVar[Optional[asyncio.Event]] = contextvars.ContextVar("compass_connection_closed", default=None)
+
+
+class CancelOnDisconnect:
+    """
+    ASGI 中间件: 为 paths 上的每个请求创建断开事件, 收到 http.disconnect 或请求处理结束时置位,
+    该请求所承载的会话中仍在执行的工具调用随之取消 (见 InstrumentedFastMCP.call_tool)。
+
+    MCP 的会话循环在传输断开后仍会等进行中的请求自然完成, 而它们的结果已经无处发送;
+    提前取消可以释放上游连接、并发名额与渲染进程。
+    """
+
+    def __init__(self, app, paths: tuple[str, ...]):
+        self.app = app
+        self.paths = {path.rstrip("/") for path in paths}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].rstrip("/") not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        closed = asyncio.Event()
+        token = _connection_closed.set(closed)
+
+        async def watched_receive():
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                closed.set()
+            return message
+
+        try:
+            await self.app(scope, watched_receive, send)
+        finally:
+            closed.set()
+            _connection_closed.reset(token)
+
+
+async def _cancel_when_set(event: asyncio.Event, task: asyncio.Task) -> None:
+    await event.wait()
+    task.cancel()
+
+
+@contextlib.contextmanager
+def _cancel_on_disconnect():
+    """承载当前会话的 HTTP 请求断开时取消当前任务 (工具调用); 不在 HTTP 请求中时什么都不做。"""
+    closed = _connection_closed.get()
+    if closed is None:
+        yield
+        return
+    watcher = asyncio.get_running_loop().create_task(_cancel_when_set(closed, asyncio.current_task()))
+    try:
+        yield
+    finally:
+        watcher.cancel()
+
+
+def _deadline_error(error: BaseException) -> Optional[DeadlineExceeded]:
+    # FastMCP 把工具函数内抛出的异常包装为 ToolError, 原异常在 __cause__ 中
+    for candidate in (error, error.__cause__):
+        if isinstance(candidate, DeadlineExceeded):
+            return candidate
+    return None
+
+
+class InstrumentedFastMCP(FastMCP):
+    """
+    记录每次工具调用指标的 FastMCP, 并在 /metrics 上提供抓取端点、在 /debug/tracing 上提供追踪开关。
+
+    FastMCP 在初始化时把 self.call_tool 注册为 MCP 的 tools/call 处理函数, 因此在子类中覆盖即可拦截全部工具调用;
+    调用期间 current_tool 指向该工具, 上游请求与各阶段的耗时都会归属到它。
+
+    每次调用都在时间预算 (COMPASS_TOOL_DEADLINE, 客户端可在请求的 _meta.timeout 中要求更短的秒数) 内运行,
+    超出预算时取消其中的全部上游请求与渲染任务并返回 504 错误; 经 SSE 或无状态流式 HTTP 连接的客户端断开时
+    同样取消进行中的调用 (见 CancelOnDisconnect), stdio 会话不受影响。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.custom_route("/metrics", methods=["GET"], include_in_schema=False)(metrics_endpoint)
+        self.custom_route("/debug/tracing", methods=["GET", "POST"], include_in_schema=False)(tracing_endpoint)
+
+    def sse_app(self, mount_path: Optional[str] = None):
+        app = super().sse_app(mount_path)
+        # 每个 SSE 连接承载一个会话, 连接断开即取消其中的调用
+        app.add_middleware(CancelOnDisconnect, paths=(self.settings.sse_path,))
+        return app
+
+    def streamable_http_app(self):
+        app = super().streamable_http_app()
+        # 只有无状态模式下一个请求对应一个会话; 有状态会话跨越多个请求, 不随单个请求结束而取消
+        if self.settings.stateless_http:
+            app.add_middleware(CancelOnDisconnect, paths=(self.settings.streamable_http_path,))
+        return app
+
+    def _call_budget(self) -> float:
+        """本次调用的时间预算 (秒): 默认 TOOL_DEADLINE, 客户端给出的 _meta.timeout 更短时以它为准。"""
+        try:
+            meta = self._mcp_server.request_context.meta
+        except LookupError:
+            return TOOL_DEADLINE
+        requested = getattr(meta, "timeout", None) if meta is not None else None
+        if isinstance(requested, bool) or not isinstance(requested, (int, float)) or requested <= 0:
+            return TOOL_DEADLINE
+        return min(TOOL_DEADLINE, requested) if TOOL_DEADLINE > 0 else requested
+
+    async def call_tool(self, name: str, arguments: dict):
+        token = current_tool.set(name)
+        start = time.perf_counter()
+        try:
+            with trace_call(name, arguments), _cancel_on_disconnect():
+                async with deadline_scope(self._call_budget()):
+                    result = await super().call_tool(name, arguments)
+        except asyncio.CancelledError:
+            record_tool_call(name, time.perf_counter() - start, "cancelled")
+            raise
+        except Exception as e:
+            deadline = _deadline_error(e)
+            if deadline is None:
+                record_tool_call(name, time.perf_counter() - start, "exception")
+                raise
+            text = json.dumps({"status": 504, "error": "Deadline Exceeded", "details": str(deadline)})
+            record_tool_call(name, time.perf_counter() - start, "deadline_exceeded", len(text.encode()))
+            return [TextContent(type="text", text=text)]
+        finally:
+            current_tool.reset(token)
+        text = _result_text(result)
+        record_tool_call(name, time.perf_counter() - start, classify_result(text), len(text.encode()))
+        return result
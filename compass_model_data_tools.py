@@ -2,15 +2,20 @@
 
 import os
 import json
-import httpx
 from typing import Optional
-from mcp.server import FastMCP
+from mcp.server.fastmcp import Context
 from dotenv import load_dotenv
+from compass_client import post_to_compass, serve_sse, MODEL_BASE_URL
+from compass_bulk import fetch_range
+import compass_json
+from compass_metrics import InstrumentedFastMCP
+from compass_prefetch import prefetcher
+from compass_matrix import MODEL_METRICS, MatrixRequestError, validate_matrix, fetch_matrix, cell_progress_message
 
 # --- 配置 ---
 # Gitee Compass API 的基础 URL
 # 注意：请根据您的实际情况确认此 URL 是否正确
-BASE_URL = "https://compass.gitee.com/"
+BASE_URL = MODEL_BASE_URL
 
 # --- 初始化 ---
 
@@ -20,12 +25,15 @@ dotenv_path = os.path.join(script_dir, '.env')
 load_dotenv(dotenv_path=dotenv_path)
 
 # 初始化 FastMCP 服务器为 SSE 模式
-app = FastMCP(
+app = InstrumentedFastMCP(
     'compass_model_data_tools',
     host='0.0.0.0',
     port=8000
 )
 
+# 进程级钩子: 配置了关注列表 (COMPASS_PREFETCH_WATCHLIST) 时在后台预取
+lifespans = [prefetcher.lifespan]
+
 # --- 内部辅助函数 ---
 
 async def _fetch_metric_model(
@@ -36,39 +44,18 @@ async def _fetch_metric_model(
     direction: str = "desc",
     page: int = 1,
     size: int = 10,
+    fetch_all: bool = False,
 ) -> str:
     """一个通用的辅助函数，用于调用 Gitee Compass 的指标模型 API"""
-    full_url = os.path.join(BASE_URL, endpoint)
-    token = os.getenv("GITEE_ACCESS_TOKEN")
-
-    if not token:
-        return json.dumps({"status": 401, "error": "Access token not found in .env file."})
-
-    payload = {
-        "access_token": token,
-        "label": label,
-        "direction": direction,
-        "begin_date": begin_date,
-        "end_date": end_date,
-        "page": page,
-        "size": size,
-    }
-    headers = {"Content-Type": "application/json"}
-
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url=full_url, headers=headers, json=payload, timeout=30.0)
-            response.raise_for_status()
-            return response.text
-        except httpx.HTTPStatusError as e:
-            return json.dumps({"status": e.response.status_code, "error": "HTTP Error", "details": e.response.text})
-        except httpx.RequestError as e:
-            return json.dumps({"status": 500, "error": "Request Failed", "details": str(e)})
+    if fetch_all:
+        return await fetch_range(BASE_URL, endpoint, label, begin_date, end_date, direction=direction, page_size=size)
+    # 单页查询不分片: 整个窗口的第 page 页无法映射到各分片的页 (分片共享边界日期, 偏移会错位)
+    return await post_to_compass(BASE_URL, endpoint, label, begin_date, end_date, direction=direction, page=page, size=size)
 
 # --- MCP 工具定义 ---
 
-@app.tool()
-async def get_contributor_milestone_persona(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_contributor_milestone_persona(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False) -> str:
     """
     获取项目贡献者里程画像。此画像根据贡献者的长期参与度将其分为临时、常规和核心贡献者。
     Args:
@@ -77,13 +64,14 @@ async def get_contributor_milestone_persona(label: str, begin_date: str, end_dat
         end_date: 查询结束日期, 格式为 'YYYY-MM-DD'。
         page: 分页页码, 默认为 1。
         size: 每页数量, 默认为 10。
+        fetch_all: 为 True 时获取窗口内的全部数据 (长窗口按月分片并行获取后合并), 此时忽略 page, size 作为每页大小; 按 page 单页查询时不分片, 长窗口建议使用 fetch_all。
     Returns:
         包含贡献者里程画像数据的 JSON 字符串。
     """
-    return await _fetch_metric_model("api/v2/metricModel/contributorMilestonePersona", label, begin_date, end_date, page=page, size=size)
+    return await _fetch_metric_model("api/v2/metricModel/contributorMilestonePersona", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all)
 
-@app.tool()
-async def get_contributor_role_persona(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_contributor_role_persona(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False) -> str:
     """
     获取项目贡献者角色画像。此画像区分了组织贡献者和个人贡献者。
     Args:
@@ -92,13 +80,14 @@ async def get_contributor_role_persona(label: str, begin_date: str, end_date: st
         end_date: 查询结束日期, 格式为 'YYYY-MM-DD'。
         page: 分页页码, 默认为 1。
         size: 每页数量, 默认为 10。
+        fetch_all: 为 True 时获取窗口内的全部数据 (长窗口按月分片并行获取后合并), 此时忽略 page, size 作为每页大小; 按 page 单页查询时不分片, 长窗口建议使用 fetch_all。
     Returns:
         包含贡献者角色画像数据的 JSON 字符串。
     """
-    return await _fetch_metric_model("api/v2/metricModel/contributorRolePersona", label, begin_date, end_date, page=page, size=size)
+    return await _fetch_metric_model("api/v2/metricModel/contributorRolePersona", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all)
 
-@app.tool()
-async def get_contributor_domain_persona(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_contributor_domain_persona(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False) -> str:
     """
     获取项目贡献者领域画像。此画像根据贡献领域（如代码、Issue、文档等）对贡献者进行分类。
     Args:
@@ -107,13 +96,14 @@ async def get_contributor_domain_persona(label: str, begin_date: str, end_date:
         end_date: 查询结束日期, 格式为 'YYYY-MM-DD'。
         page: 分页页码, 默认为 1。
         size: 每页数量, 默认为 10。
+        fetch_all: 为 True 时获取窗口内的全部数据 (长窗口按月分片并行获取后合并), 此时忽略 page, size 作为每页大小; 按 page 单页查询时不分片, 长窗口建议使用 fetch_all。
     Returns:
         包含贡献者领域画像数据的 JSON 字符串。
     """
-    return await _fetch_metric_model("api/v2/metricModel/contributorDomainPersona", label, begin_date, end_date, page=page, size=size)
+    return await _fetch_metric_model("api/v2/metricModel/contributorDomainPersona", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all)
 
-@app.tool()
-async def get_organizations_activity(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_organizations_activity(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False) -> str:
     """
     获取项目中的组织活跃度。分析来自不同组织（公司、机构）的贡献情况。
     Args:
@@ -122,13 +112,14 @@ async def get_organizations_activity(label: str, begin_date: str, end_date: str,
         end_date: 查询结束日期, 格式为 'YYYY-MM-DD'。
         page: 分页页码, 默认为 1。
         size: 每页数量, 默认为 10。
+        fetch_all: 为 True 时获取窗口内的全部数据 (长窗口按月分片并行获取后合并), 此时忽略 page, size 作为每页大小; 按 page 单页查询时不分片, 长窗口建议使用 fetch_all。
     Returns:
         包含组织活跃度数据的 JSON 字符串。
     """
-    return await _fetch_metric_model("api/v2/metricModel/organizationsActivity", label, begin_date, end_date, page=page, size=size)
+    return await _fetch_metric_model("api/v2/metricModel/organizationsActivity", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all)
 
-@app.tool()
-async def get_project_activity(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_project_activity(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False) -> str:
     """
     获取项目的整体活跃度指标。包括贡献者数量、提交频率、PR/Issue评论活动等。
     Args:
@@ -137,13 +128,14 @@ async def get_project_activity(label: str, begin_date: str, end_date: str, page:
         end_date: 查询结束日期, 格式为 'YYYY-MM-DD'。
         page: 分页页码, 默认为 1。
         size: 每页数量, 默认为 10。
+        fetch_all: 为 True 时获取窗口内的全部数据 (长窗口按月分片并行获取后合并), 此时忽略 page, size 作为每页大小; 按 page 单页查询时不分片, 长窗口建议使用 fetch_all。
     Returns:
         包含项目活跃度评分和相关指标的 JSON 字符串。
     """
-    return await _fetch_metric_model("api/v2/metricModel/activity", label, begin_date, end_date, page=page, size=size)
+    return await _fetch_metric_model("api/v2/metricModel/activity", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all)
 
-@app.tool()
-async def get_community_service_and_support(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_community_service_and_support(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False) -> str:
     """
     获取项目的社区服务与支撑指标。分析 Issue 和 PR 的响应时间、处理效率等。
     Args:
@@ -152,13 +144,14 @@ async def get_community_service_and_support(label: str, begin_date: str, end_dat
         end_date: 查询结束日期, 格式为 'YYYY-MM-DD'。
         page: 分页页码, 默认为 1。
         size: 每页数量, 默认为 10。
+        fetch_all: 为 True 时获取窗口内的全部数据 (长窗口按月分片并行获取后合并), 此时忽略 page, size 作为每页大小; 按 page 单页查询时不分片, 长窗口建议使用 fetch_all。
     Returns:
         包含社区服务与支撑指标的 JSON 字符串。
     """
-    return await _fetch_metric_model("api/v2/metricModel/communityServiceAndSupport", label, begin_date, end_date, page=page, size=size)
+    return await _fetch_metric_model("api/v2/metricModel/communityServiceAndSupport", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all)
 
-@app.tool()
-async def get_collaboration_development_index(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_collaboration_development_index(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False) -> str:
     """
     获取项目的协作开发指数。衡量代码审查、合并率、PR与Issue的关联度等协作效率。
     Args:
@@ -167,11 +160,53 @@ async def get_collaboration_development_index(label: str, begin_date: str, end_d
         end_date: 查询结束日期, 格式为 'YYYY-MM-DD'。
         page: 分页页码, 默认为 1。
         size: 每页数量, 默认为 10。
+        fetch_all: 为 True 时获取窗口内的全部数据 (长窗口按月分片并行获取后合并), 此时忽略 page, size 作为每页大小; 按 page 单页查询时不分片, 长窗口建议使用 fetch_all。
     Returns:
         包含协作开发指数的 JSON 字符串。
     """
-    return await _fetch_metric_model("api/v2/metricModel/collaborationDevelopmentIndex", label, begin_date, end_date, page=page, size=size)
+    return await _fetch_metric_model("api/v2/metricModel/collaborationDevelopmentIndex", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all)
+
+@app.tool(structured_output=False)
+async def get_metric_model_matrix(
+    labels: list[str],
+    begin_date: str,
+    end_date: str,
+    metrics: Optional[list[str]] = None,
+    page: int = 1,
+    size: int = 10,
+    fetch_all: bool = False,
+    ctx: Context = None,
+) -> str:
+    """
+    一次获取多个仓库 x 多个指标模型的数据矩阵, 所有单元格并发请求 (受全局与按主机的并发上限约束),
+    总耗时约为一次上游请求的延迟, 适合多仓库横向对比。单元格完成时会通过进度通知逐个上报。
+    Args:
+        labels: 要查询的仓库地址列表, 例如 ['https://github.com/oss-compass/compass-web-service']。
+        begin_date: 查询起始日期, 格式为 'YYYY-MM-DD'。
+        end_date: 查询结束日期, 格式为 'YYYY-MM-DD'。
+        metrics: 指标模型名称列表, 默认全部 7 个: contributor_milestone_persona, contributor_role_persona,
+            contributor_domain_persona, organizations_activity, project_activity,
+            community_service_and_support, collaboration_development_index。
+        page: 分页页码, 默认为 1。
+        size: 每页数量, 默认为 10。
+        fetch_all: 为 True 时每个单元格获取窗口内的全部数据, 此时忽略 page, size 作为每页大小。
+    Returns:
+        JSON 字符串: matrix[label][metric] 为对应单元格的数据, 失败的单元格为 null, 其错误详情列在 errors 中;
+        部分单元格失败时其余结果照常返回。
+    """
+    try:
+        labels, metrics = validate_matrix(labels, metrics or list(MODEL_METRICS))
+    except MatrixRequestError as e:
+        return json.dumps({"status": 400, "error": "Invalid Matrix Request", "details": str(e)})
+
+    async def report(cell: dict, completed: int, total: int) -> None:
+        if ctx is not None:
+            await ctx.report_progress(completed, total, cell_progress_message(cell))
+
+    result = await fetch_matrix(labels, metrics, begin_date, end_date, page=page, size=size, fetch_all=fetch_all, on_cell=report)
+    result["status"] = "success" if result["failed"] == 0 else ("partial" if result["succeeded"] else "error")
+    return compass_json.dumps(result)
 
 
 if __name__ == "__main__":
-    app.run(transport='sse')
\ No newline at end of file
+    serve_sse(app, lifespans=lifespans)
\ No newline at end of file
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+# compass_prefetch.py
+# 关注列表的后台预取: 对列表中每个 (仓库, 数据集, 滚动窗口) 查询, 在内存缓存中的结果过期之前
+# 重新请求上游并回填缓存, 热门仓库的首次查询直接命中本地缓存。
+# 关注列表中的查询写入缓存时带较长的 stale 期: 预取来不及时 (如上游变慢) 工具仍先返回旧值并在后台刷新。
+#
+# 关注列表是一个 JSON 文件 (COMPASS_PREFETCH_WATCHLIST), 修改后下一轮自动重新加载, 无需重启:
+#   [
+#     {"labels": ["https://github.com/oss-compass/compass-web-service"],
+#      "metrics": ["project_activity", "community_service_and_support", "collaboration_development_index"],
+#      "windows": [90, 365], "size": 10}
+#   ]
+# 滚动窗口按 end_date = 今天、begin_date = 今天 - N 天计算 (YYYY-MM-DD), 调用方使用相同约定的查询才能命中。
+#
+# 用法:
+#   python compass_prefetch.py check --watchlist watchlist.json   # 校验并列出展开后的查询
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+import contextlib
+from datetime import date, timedelta
+from typing import Optional
+from dotenv import load_dotenv
+import compass_client
+from compass_client import refresh_compass
+from compass_cache import response_cache, make_key, ttl_for
+from compass_bulk import DATASETS
+from compass_metrics import registry
+
+# --- 初始化 ---
+
+# 加载 .env 文件 (预取配置在模块导入时读取)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+dotenv_path = os.path.join(script_dir, '.env')
+load_dotenv(dotenv_path=dotenv_path)
+
+# --- 配置 ---
+# 关注列表文件路径, 留空表示不启用预取
+PREFETCH_WATCHLIST = os.getenv("COMPASS_PREFETCH_WATCHLIST", "")
+# 检查间隔 (秒)
+PREFETCH_INTERVAL = float(os.getenv("COMPASS_PREFETCH_INTERVAL", "60"))
+# 剩余有效期低于 TTL 的该比例时刷新 (0.2 表示在 TTL 用掉 80% 后刷新)
+PREFETCH_REFRESH_AHEAD = float(os.getenv("COMPASS_PREFETCH_REFRESH_AHEAD", "0.2"))
+# 同时进行的预取请求数 (另受 compass_client 的按主机并发上限与限速约束)
+PREFETCH_CONCURRENCY = int(os.getenv("COMPASS_PREFETCH_CONCURRENCY", "4"))
+# 关注列表中的查询过期后仍可返回旧值的时长 (秒)
+PREFETCH_STALE_SECONDS = float(os.getenv("COMPASS_PREFETCH_STALE_SECONDS", "86400"))
+
+DEFAULT_METRICS = ("project_activity", "community_service_and_support", "collaboration_development_index")
+DEFAULT_WINDOWS = (90,)
+
+
+class WatchlistError(ValueError):
+    """关注列表文件格式不正确。"""
+
+
+class WatchQuery:
+    """关注列表中的一个查询: 某仓库某数据集在最近 window_days 天的一页数据。"""
+
+    __slots__ = ("dataset", "label", "window_days", "page", "size", "direction")
+
+    def __init__(self, dataset: str, label: str, window_days: int, page: int = 1, size: int = 10, direction: str = "desc"):
+        self.dataset = dataset
+        self.label = label
+        self.window_days = window_days
+        self.page = page
+        self.size = size
+        self.direction = direction
+
+    def identity(self) -> tuple:
+        return (self.dataset, self.label, self.window_days, self.page, self.size, self.direction)
+
+    def window(self, today: date) -> tuple[str, str]:
+        return (today - timedelta(days=self.window_days)).isoformat(), today.isoformat()
+
+    def cache_key(self, today: date) -> str:
+        base_url, endpoint = DATASETS[self.dataset]
+        begin_date, end_date = self.window(today)
+        full_url = base_url.rstrip("/") + "/" + endpoint.lstrip("/")
+        return make_key(full_url, self.label, begin_date, end_date, self.direction, self.page, self.size)
+
+    def ttl(self, today: date) -> float:
+        return ttl_for(DATASETS[self.dataset][1], today.isoformat())
+
+    async def refresh(self, today: date) -> str:
+        base_url, endpoint = DATASETS[self.dataset]
+        begin_date, end_date = self.window(today)
+        return await refresh_compass(base_url, endpoint, self.label, begin_date, end_date, self.direction, self.page, self.size)
+
+
+def _positive_ints(values, field: str) -> list[int]:
+    if not isinstance(values, list) or not values or not all(isinstance(v, int) and not isinstance(v, bool) and v > 0 for v in values):
+        raise WatchlistError(f"{field} must be a non-empty list of positive integers.")
+    return values
+
+
+def parse_watchlist(data) -> list[WatchQuery]:
+    """把关注列表 (分组列表, 或含 groups 字段的对象) 展开为去重后的查询列表。"""
+    groups = data.get("groups") if isinstance(data, dict) else data
+    if not isinstance(groups, list):
+        raise WatchlistError("Watchlist must be a list of groups or an object with a 'groups' list.")
+    queries: dict[tuple, WatchQuery] = {}
+    for number, group in enumerate(groups, start=1):
+        if not isinstance(group, dict):
+            raise WatchlistError(f"Group {number} must be an object.")
+        labels = group.get("labels")
+        if not isinstance(labels, list) or not labels or not all(isinstance(label, str) and label.strip() for label in labels):
+            raise WatchlistError(f"Group {number}: labels must be a non-empty list of repository URLs.")
+        metrics = group.get("metrics", list(DEFAULT_METRICS))
+        if not isinstance(metrics, list) or not metrics:
+            raise WatchlistError(f"Group {number}: metrics must be a non-empty list.")
+        unknown = [metric for metric in metrics if metric not in DATASETS]
+        if unknown:
+            raise WatchlistError(f"Group {number}: unknown datasets {unknown}; available: {', '.join(DATASETS)}.")
+        windows = _positive_ints(group.get("windows", list(DEFAULT_WINDOWS)), f"Group {number}: windows")
+        size = _positive_ints([group.get("size", 10)], f"Group {number}: size")[0]
+        pages = _positive_ints([group.get("pages", 1)], f"Group {number}: pages")[0]
+        direction = group.get("direction", "desc")
+        if direction not in ("asc", "desc"):
+            raise WatchlistError(f"Group {number}: direction must be 'asc' or 'desc'.")
+        for label in labels:
+            for metric in metrics:
+                for window_days in windows:
+                    for page in range(1, pages + 1):
+                        query = WatchQuery(metric, label.strip(), window_days, page, size, direction)
+                        queries.setdefault(query.identity(), query)
+    return list(queries.values())
+
+
+def load_watchlist(path: str) -> list[WatchQuery]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except ValueError as e:
+        raise WatchlistError(f"{path} is not valid JSON: {e}")
+    return parse_watchlist(data)
+
+
+class Prefetcher:
+    """按固定间隔检查关注列表, 刷新即将过期 (或已被淘汰) 的查询。"""
+
+    def __init__(
+        self,
+        path: str = PREFETCH_WATCHLIST,
+        interval: float = PREFETCH_INTERVAL,
+        refresh_ahead: float = PREFETCH_REFRESH_AHEAD,
+        concurrency: int = PREFETCH_CONCURRENCY,
+        stale_seconds: float = PREFETCH_STALE_SECONDS,
+    ):
+        self.path = path
+        self.interval = interval
+        self.refresh_ahead = refresh_ahead
+        self.concurrency = concurrency
+        self.stale_seconds = stale_seconds
+        self.queries: list[WatchQuery] = []
+        self.refreshed = 0
+        self.failed = 0
+        self._mtime: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def reload(self) -> None:
+        """关注列表文件有修改时重新加载; 新文件有误时保留原列表。"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError as e:
+            print(f"无法读取关注列表: {e}")
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            self.queries = load_watchlist(self.path)
+        except (OSError, WatchlistError) as e:
+            print(f"关注列表加载失败, 继续使用原列表: {e}")
+            return
+        self._mtime = mtime
+        print(f"已加载关注列表 {self.path}: {len(self.queries)} 个查询")
+
+    def due(self, today: date) -> list[WatchQuery]:
+        """缓存中不存在或剩余有效期低于 TTL * refresh_ahead 的查询。"""
+        due = []
+        for query in self.queries:
+            remaining = response_cache.remaining_ttl(query.cache_key(today))
+            if remaining is None or remaining < query.ttl(today) * self.refresh_ahead:
+                due.append(query)
+        return due
+
+    async def run_once(self) -> dict:
+        """执行一轮检查与刷新, 返回本轮的统计。"""
+        self.reload()
+        today = date.today()
+        # 关注的查询写入缓存时使用更长的 stale 期 (滚动窗口跨天后旧日期的键自然移出)
+        compass_client.stale_windows.clear()
+        compass_client.stale_windows.update({query.cache_key(today): self.stale_seconds for query in self.queries})
+
+        due = self.due(today)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        failures = []
+
+        async def refresh(query: WatchQuery) -> None:
+            async with semaphore:
+                text = await query.refresh(today)
+            remaining = response_cache.remaining_ttl(query.cache_key(today))
+            if remaining is None or remaining < query.ttl(today) * self.refresh_ahead:
+                # 错误响应不会写入缓存, 条目没有被续期
+                failures.append(f"{query.dataset} {query.label} {query.window_days}d: {text[:200]}")
+
+        await asyncio.gather(*(refresh(query) for query in due))
+        self.refreshed += len(due) - len(failures)
+        self.failed += len(failures)
+        for failure in failures[:3]:
+            print(f"预取失败: {failure}")
+        return {"queries": len(self.queries), "refreshed": len(due) - len(failures), "failed": len(failures)}
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                result = await self.run_once()
+                if result["refreshed"] or result["failed"]:
+                    print(f"预取: 刷新 {result['refreshed']} 个查询, 失败 {result['failed']} 个")
+            except Exception as e:
+                print(f"预取出错: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self, _app):
+        """进程级钩子: 配置了关注列表时在后台运行预取循环, 关闭时停止。"""
+        if not self.path:
+            yield
+            return
+        self._task = asyncio.create_task(self._loop())
+        try:
+            yield
+        finally:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+            compass_client.stale_windows.clear()
+
+
+prefetcher = Prefetcher()
+
+
+@registry.collector
+def _collect_prefetch_metrics():
+    """抓取时读取预取状态。"""
+    return [
+        ("compass_prefetch_queries", "gauge", "Queries in the prefetch watchlist.", (), [((), len(prefetcher.queries))]),
+        ("compass_prefetch_refreshes_total", "counter", "Background prefetch refreshes by result.", ("result",),
+         [(("ok",), prefetcher.refreshed), (("error",), prefetcher.failed)]),
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="关注列表预取")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    check = subparsers.add_parser("check", help="校验关注列表并列出今天要预取的查询")
+    check.add_argument("--watchlist", default=PREFETCH_WATCHLIST, help="关注列表文件, 默认读取 COMPASS_PREFETCH_WATCHLIST")
+    args = parser.parse_args()
+
+    if not args.watchlist:
+        sys.exit("错误: 未指定关注列表 (--watchlist 或 COMPASS_PREFETCH_WATCHLIST)")
+    try:
+        queries = load_watchlist(args.watchlist)
+    except (OSError, WatchlistError) as e:
+        sys.exit(f"错误: {e}")
+    today = date.today()
+    for query in queries:
+        begin_date, end_date = query.window(today)
+        print(f"{query.dataset:<34} {query.label}  {begin_date} ~ {end_date}  page={query.page} size={query.size}")
+    print(f"共 {len(queries)} 个查询")
+
+
+if __name__ == "__main__":
+    main()
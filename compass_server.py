@@ -0,0 +1,136 @@
+# compass_server.py
+# 单一入口: 在一个进程 (一个 FastMCP/ASGI 应用) 中托管全部 Compass 工具集。
+# 各工具服务模块 (compass_model_data_tools.py 等) 照常用 @app.tool() 注册工具, 这里把它们的工具与
+# HTTP 路由合并到同一个应用中, 所有工具共享同一个连接池、限流器与缓存, 只需启动一个解释器。
+
+import os
+import sys
+import argparse
+import importlib
+import uvicorn
+from mcp.server import FastMCP
+from compass_metrics import InstrumentedFastMCP
+from dotenv import load_dotenv
+from compass_client import with_lifespans
+
+# --- 初始化 ---
+
+# 加载 .env 文件
+script_dir = os.path.dirname(os.path.abspath(__file__))
+dotenv_path = os.path.join(script_dir, '.env')
+load_dotenv(dotenv_path=dotenv_path)
+
+# --- 配置 ---
+# 工具集名称 -> 定义工具的模块 (模块中的 FastMCP 实例名为 app, 可选的进程级钩子列表名为 lifespans)
+TOOLSETS = {
+    "model": "compass_model_data_tools",
+    "enriched": "enriched_data_server",
+    "plot": "img_upload_server",
+    "gitee_pr": "gitee_pr_server",
+}
+# 要加载的工具集, 逗号分隔; 未选中的模块不会被导入 (例如不加载 plot 时不会导入 numpy 与绘图进程池)
+SERVER_TOOLSETS = os.getenv("COMPASS_TOOLSETS", "model,enriched,plot")
+SERVER_HOST = os.getenv("COMPASS_SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("COMPASS_SERVER_PORT", "8000"))
+# uvicorn worker 进程数; 每个 worker 各有一份连接池与进程内缓存 (磁盘缓存与同步库在 worker 之间共享)
+SERVER_WORKERS = int(os.getenv("COMPASS_SERVER_WORKERS", "1"))
+# 传输方式: sse 或 streamable-http; 默认单 worker 用 sse, 多 worker 用无状态的 streamable-http
+# (SSE 会话与消息请求必须落在同一个 worker 上, 多 worker 时无法使用)
+SERVER_TRANSPORT = os.getenv("COMPASS_SERVER_TRANSPORT", "")
+TRANSPORTS = ("sse", "streamable-http")
+
+
+def parse_toolsets(value: str) -> list[str]:
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in TOOLSETS]
+    if unknown:
+        raise ValueError(f"Unknown toolsets {unknown}; available: {', '.join(TOOLSETS)}.")
+    if not names:
+        raise ValueError("COMPASS_TOOLSETS must name at least one toolset.")
+    return list(dict.fromkeys(names))
+
+
+def resolve_transport(transport: str, workers: int) -> str:
+    transport = transport or ("streamable-http" if workers > 1 else "sse")
+    if transport not in TRANSPORTS:
+        raise ValueError(f"Unknown transport {transport!r}; use one of {', '.join(TRANSPORTS)}.")
+    if transport == "sse" and workers > 1:
+        raise ValueError("The sse transport keeps sessions in one process; use streamable-http with multiple workers.")
+    return transport
+
+
+def build_app(toolsets: list[str], transport: str = "sse") -> tuple[FastMCP, list]:
+    """
+    导入选中的工具集模块, 把它们注册的工具与自定义路由合并到一个新的 FastMCP 应用。
+
+    返回 (应用, 进程级钩子列表)。工具对象直接复用, 不会重新解析函数签名; 工具重名时抛出 ValueError。
+    """
+    # 本地图片的访问地址默认指向合并后的服务端口 (需在导入绘图工具集之前设置)
+    os.environ.setdefault("IMAGE_PUBLIC_BASE_URL", f"http://{'127.0.0.1' if SERVER_HOST == '0.0.0.0' else SERVER_HOST}:{SERVER_PORT}")
+
+    app = InstrumentedFastMCP(
+        'compass',
+        host=SERVER_HOST,
+        port=SERVER_PORT,
+        stateless_http=transport == "streamable-http",
+    )
+    lifespans = []
+    for name in toolsets:
+        module = importlib.import_module(TOOLSETS[name])
+        for tool in module.app._tool_manager.list_tools():
+            if app._tool_manager.get_tool(tool.name) is not None:
+                raise ValueError(f"Tool {tool.name!r} from toolset {name!r} is already registered by another toolset.")
+            app._tool_manager._tools[tool.name] = tool
+        # 每个工具集都注册了 /metrics 等公共路由 (指向同一个进程级注册表), 同一路径只保留一个
+        paths = {route.path for route in app._custom_starlette_routes}
+        app._custom_starlette_routes.extend(
+            route for route in module.app._custom_starlette_routes if route.path not in paths
+        )
+        # 多个工具集可能共用同一个进程级钩子 (如关注列表预取), 只启动一次
+        lifespans.extend(hook for hook in getattr(module, "lifespans", ()) if hook not in lifespans)
+    return app, lifespans
+
+
+def create_asgi_app():
+    """uvicorn 的应用工厂 (多 worker 时每个 worker 进程各调用一次), 配置均从环境变量读取。"""
+    transport = resolve_transport(SERVER_TRANSPORT, SERVER_WORKERS)
+    app, lifespans = build_app(parse_toolsets(SERVER_TOOLSETS), transport)
+    starlette_app = app.sse_app() if transport == "sse" else app.streamable_http_app()
+    return with_lifespans(starlette_app, lifespans)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="在单个进程中托管全部 Compass 工具集")
+    parser.add_argument("--toolsets", help=f"逗号分隔的工具集 ({', '.join(TOOLSETS)}), 默认 {SERVER_TOOLSETS}")
+    parser.add_argument("--host", help=f"监听地址, 默认 {SERVER_HOST}")
+    parser.add_argument("--port", type=int, help=f"监听端口, 默认 {SERVER_PORT}")
+    parser.add_argument("--workers", type=int, help=f"worker 进程数, 默认 {SERVER_WORKERS}")
+    parser.add_argument("--transport", choices=TRANSPORTS, help="传输方式, 默认单 worker 为 sse, 多 worker 为 streamable-http")
+    args = parser.parse_args()
+
+    # 命令行参数写回环境变量后重新加载本模块的配置, worker 进程 (spawn) 也会继承这些值
+    overrides = {
+        "COMPASS_TOOLSETS": args.toolsets,
+        "COMPASS_SERVER_HOST": args.host,
+        "COMPASS_SERVER_PORT": str(args.port) if args.port else None,
+        "COMPASS_SERVER_WORKERS": str(args.workers) if args.workers else None,
+        "COMPASS_SERVER_TRANSPORT": args.transport,
+    }
+    os.environ.update({key: value for key, value in overrides.items() if value})
+    host = os.getenv("COMPASS_SERVER_HOST", SERVER_HOST)
+    port = int(os.getenv("COMPASS_SERVER_PORT", SERVER_PORT))
+    workers = int(os.getenv("COMPASS_SERVER_WORKERS", SERVER_WORKERS))
+    try:
+        toolsets = parse_toolsets(os.getenv("COMPASS_TOOLSETS", SERVER_TOOLSETS))
+        transport = resolve_transport(os.getenv("COMPASS_SERVER_TRANSPORT", SERVER_TRANSPORT), workers)
+    except ValueError as e:
+        sys.exit(f"错误: {e}")
+
+    path = "/sse" if transport == "sse" else "/mcp"
+    print(f"Compass MCP server: toolsets={','.join(toolsets)} transport={transport} workers={workers}")
+    print(f"Listening on http://{host}:{port}{path}")
+    uvicorn.run("compass_server:create_asgi_app", factory=True, host=host, port=port, workers=workers)
+
+
+if __name__ == "__main__":
+    main()
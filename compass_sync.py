@@ -0,0 +1,545 @@
+# compass_sync.py
+# 丰富化数据的增量同步: 本地 SQLite 中按 (数据集, 仓库) 记录已同步到的日期 (高水位),
+# 每次同步只请求水位之后的新数据并追加写入, 范围查询直接读本地库, 日常刷新的开销只与新增活动量相关。
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import argparse
+import threading
+from datetime import date, timedelta
+from typing import Optional
+from dotenv import load_dotenv
+from compass_client import SingleFlight, close_client
+from compass_bulk import (
+    DATASETS, SHARD_CONCURRENCY, SHARD_THRESHOLD_DAYS, CompassDataError, fetch_all_pages_data, item_identity, split_date_range,
+)
+from compass_index import PrefixIndex, contributions, metric_definitions, validate_range
+import compass_json
+from compass_json import RawJSON
+
+# --- 初始化 ---
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+dotenv_path = os.path.join(script_dir, '.env')
+load_dotenv(dotenv_path=dotenv_path)
+
+# --- 配置 ---
+# 同步库的文件路径
+SYNC_DB_PATH = os.getenv("COMPASS_SYNC_DB_PATH", os.path.join(script_dir, ".compass_sync.sqlite3"))
+# 首次同步时回溯的天数
+SYNC_INITIAL_DAYS = int(os.getenv("COMPASS_SYNC_INITIAL_DAYS", "365"))
+# 每次增量同步从水位往前重叠的天数, 覆盖上游延迟入库的记录 (重复记录按 ID 去重)
+SYNC_OVERLAP_DAYS = int(os.getenv("COMPASS_SYNC_OVERLAP_DAYS", "1"))
+# 同时同步的数据集数
+SYNC_CONCURRENCY = int(os.getenv("COMPASS_SYNC_CONCURRENCY", "4"))
+
+# 记录的日期字段, 按顺序取第一个存在的字段, 用于范围查询与推进水位
+DATE_FIELDS = ("grimoire_creation_date", "created_at", "metadata__updated_on", "date")
+
+
+def record_date(item) -> Optional[str]:
+    """取记录的日期 (YYYY-MM-DD), 没有可识别的日期字段时返回 None。"""
+    if isinstance(item, dict):
+        for field in DATE_FIELDS:
+            value = item.get(field)
+            if isinstance(value, str) and len(value) >= 10:
+                return value[:10]
+    return None
+
+
+class SyncStore:
+    """
+    基于 SQLite 的本地同步库: records 表保存记录原文, watermarks 表保存每个 (数据集, 仓库) 的同步进度。
+
+    day_stats 表是按日统计索引 (见 compass_index.py), 与 records 在同一事务中增量维护。
+    所有方法都是同步的, 在事件循环中请通过 asyncio.to_thread 调用。
+    """
+
+    def __init__(self, path: str = SYNC_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # (数据集, 仓库) -> 前缀和索引, 写入新记录时失效
+        self._indexes: dict[tuple[str, str], PrefixIndex] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                dataset TEXT NOT NULL,
+                label TEXT NOT NULL,
+                record_id TEXT NOT NULL,
+                event_date TEXT,
+                body TEXT NOT NULL,
+                PRIMARY KEY (dataset, label, record_id)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_records_date ON records (dataset, label, event_date)")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS watermarks (
+                dataset TEXT NOT NULL,
+                label TEXT NOT NULL,
+                first_date TEXT NOT NULL,
+                synced_through TEXT NOT NULL,
+                records INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (dataset, label)
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS day_stats (
+                dataset TEXT NOT NULL,
+                label TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                day TEXT NOT NULL,
+                value REAL NOT NULL,
+                PRIMARY KEY (dataset, label, metric, day)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def watermark(self, dataset: str, label: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT first_date, synced_through, records, updated_at FROM watermarks WHERE dataset = ? AND label = ?",
+                (dataset, label),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("first_date", "synced_through", "records", "updated_at"), row))
+
+    def append(self, dataset: str, label: str, items: list, first_date: Optional[str], synced_through: Optional[str]) -> int:
+        """
+        追加 (或按 ID 覆盖) 记录并更新同步范围, 返回新增的记录数。
+
+        first_date 只会前移、synced_through 只会后移; 传入 None 表示这一侧没有进展。
+        还没有同步范围时, 两者都给出才会建立。
+        """
+        rows = [
+            (dataset, label, item_identity(item), record_date(item), compass_json.dumps(item))
+            for item in items
+        ]
+        with self._lock:
+            before = self._count_locked(dataset, label)
+            # 按日统计只按差量更新: 新记录的贡献减去同 ID 旧记录的贡献 (例如 Issue 关闭后 closed_at 出现)
+            delta: dict[tuple[str, str], float] = {}
+            old_bodies = self._bodies_locked(dataset, label, [row[2] for row in rows])
+            for item, row in zip(items, rows):
+                for key, amount in contributions(dataset, item, row[3]).items():
+                    delta[key] = delta.get(key, 0.0) + amount
+                old = old_bodies.get(row[2])
+                if old is not None:
+                    old_item = compass_json.loads(old)
+                    for key, amount in contributions(dataset, old_item, record_date(old_item)).items():
+                        delta[key] = delta.get(key, 0.0) - amount
+            self._conn.executemany(
+                "INSERT INTO records VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (dataset, label, record_id) DO UPDATE SET event_date = excluded.event_date, body = excluded.body",
+                rows,
+            )
+            self._apply_stats_locked(dataset, label, delta)
+            after = self._count_locked(dataset, label)
+            old = self._conn.execute(
+                "SELECT first_date, synced_through FROM watermarks WHERE dataset = ? AND label = ?", (dataset, label)
+            ).fetchone()
+            if old is not None:
+                first_date = min(first_date, old[0]) if first_date else old[0]
+                synced_through = max(synced_through, old[1]) if synced_through else old[1]
+            if first_date is not None and synced_through is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?, ?, ?)",
+                    (dataset, label, first_date, synced_through, after, time.time()),
+                )
+            self._conn.commit()
+        return after - before
+
+    def _bodies_locked(self, dataset: str, label: str, record_ids: list[str]) -> dict[str, str]:
+        bodies = {}
+        for i in range(0, len(record_ids), 500):
+            chunk = record_ids[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            bodies.update(self._conn.execute(
+                f"SELECT record_id, body FROM records WHERE dataset = ? AND label = ? AND record_id IN ({placeholders})",
+                (dataset, label, *chunk),
+            ).fetchall())
+        return bodies
+
+    def _apply_stats_locked(self, dataset: str, label: str, delta: dict[tuple[str, str], float]) -> None:
+        self._conn.executemany(
+            "INSERT INTO day_stats VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (dataset, label, metric, day) DO UPDATE SET value = value + excluded.value",
+            [(dataset, label, metric, day, amount) for (metric, day), amount in delta.items() if amount],
+        )
+        self._indexes.pop((dataset, label), None)
+
+    def rebuild_stats(self, dataset: str, label: str) -> None:
+        """由 records 全量重建一个 (数据集, 仓库) 的按日统计 (用于索引定义变化或旧库升级)。"""
+        with self._lock:
+            self._rebuild_stats_locked(dataset, label)
+            self._conn.commit()
+
+    def _rebuild_stats_locked(self, dataset: str, label: str) -> None:
+        self._conn.execute("DELETE FROM day_stats WHERE dataset = ? AND label = ?", (dataset, label))
+        totals: dict[tuple[str, str], float] = {}
+        cursor = self._conn.execute(
+            "SELECT event_date, body FROM records WHERE dataset = ? AND label = ?", (dataset, label)
+        )
+        for event_date, body in cursor:
+            for key, amount in contributions(dataset, compass_json.loads(body), event_date).items():
+                totals[key] = totals.get(key, 0.0) + amount
+        self._apply_stats_locked(dataset, label, totals)
+
+    def prefix_index(self, dataset: str, label: str) -> PrefixIndex:
+        """返回 (数据集, 仓库) 的前缀和索引, 首次使用时从 day_stats 加载 (旧库缺少统计时先重建)。"""
+        key = (dataset, label)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                return index
+            rows = self._conn.execute(
+                "SELECT metric, day, value FROM day_stats WHERE dataset = ? AND label = ?", key
+            ).fetchall()
+            if not rows and self._count_locked(dataset, label):
+                self._rebuild_stats_locked(dataset, label)
+                self._conn.commit()
+                rows = self._conn.execute(
+                    "SELECT metric, day, value FROM day_stats WHERE dataset = ? AND label = ?", key
+                ).fetchall()
+            metrics = tuple(metric for metric, _, _ in metric_definitions(dataset))
+            index = PrefixIndex.from_rows(metrics, rows)
+            self._indexes[key] = index
+        return index
+
+    def _count_locked(self, dataset: str, label: str) -> int:
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM records WHERE dataset = ? AND label = ?", (dataset, label)
+        ).fetchone()[0]
+
+    def query(self, dataset: str, label: str, begin_date: str, end_date: str, offset: int = 0, limit: int = 100) -> tuple[int, list]:
+        """按日期闭区间查询本地记录 (按日期升序), 返回 (总数, 当前页的记录); 记录为存储的 JSON 原文, 不做解析。"""
+        params = (dataset, label, begin_date, end_date)
+        where = "dataset = ? AND label = ? AND event_date >= ? AND event_date <= ?"
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM records WHERE {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT body FROM records WHERE {where} ORDER BY event_date, record_id LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+        return total, [RawJSON(body) for (body,) in rows]
+
+    def status(self, label: Optional[str] = None) -> list[dict]:
+        sql = "SELECT dataset, label, first_date, synced_through, records, updated_at FROM watermarks"
+        params: tuple = ()
+        if label is not None:
+            sql += " WHERE label = ?"
+            params = (label,)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY label, dataset", params).fetchall()
+        columns = ("dataset", "label", "first_date", "synced_through", "records", "updated_at")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# --- 同步 ---
+
+_store: Optional[SyncStore] = None
+# 同一 (数据集, 仓库) 的并发同步请求只执行一次
+_inflight_syncs = SingleFlight()
+
+
+def get_store() -> SyncStore:
+    """返回进程内共享的同步库, 首次调用时打开。"""
+    global _store
+    if _store is None:
+        _store = SyncStore()
+    return _store
+
+
+async def sync_dataset(
+    dataset: str,
+    label: str,
+    begin_date: Optional[str] = None,
+    today: Optional[date] = None,
+    end_date: Optional[str] = None,
+) -> dict:
+    """
+    增量同步一个 (数据集, 仓库)。
+
+    已有水位时从 (水位 - SYNC_OVERLAP_DAYS) 同步到今天, begin_date 早于已同步范围时另外只回填
+    [begin_date, first_date]; 首次同步从 begin_date (默认今天往前 SYNC_INITIAL_DAYS 天) 开始。
+    数据按分片获取并逐片写入, 同步进度只推进到连续获取完整的部分 (见 _sync_window)。
+
+    给出 end_date 时只获取 [begin_date, end_date] 中尚未同步的部分; 与已同步范围不相连的窗口
+    只写入记录, 不移动同步范围 (范围必须连续), 也不会为了相连而补齐中间的空档。
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset {dataset!r}; available: {', '.join(DATASETS)}.")
+    key = json.dumps([dataset, label, begin_date, end_date])
+    return await _inflight_syncs.do(key, lambda: _sync_uncached(dataset, label, begin_date, today or date.today(), end_date))
+
+
+def _shard_progress(data: dict, shard_begin: str, shard_end: str, backfill: bool) -> tuple[Optional[str], bool]:
+    """
+    一个分片能把同步进度推进到的日期, 以及它是否完整 (完整时进度可以继续延伸到下一个分片)。
+
+    向前同步时, 被页数上限截断的分片 (按时间升序获取) 从分片开头起是连续的, 进度推进到其中最新记录的日期;
+    回填从分片末尾往前推进, 截断的分片缺的恰好是末尾, 不能推进。有失败页的分片都不能推进。
+    """
+    if data.get("errors"):
+        return None, False
+    if not data.get("truncated"):
+        return (shard_begin if backfill else shard_end), True
+    if backfill:
+        return None, False
+    dates = [d for d in map(record_date, data["items"]) if d and d >= shard_begin]
+    return (max(dates) if dates else None), False
+
+
+async def _sync_window(
+    store: SyncStore,
+    dataset: str,
+    label: str,
+    begin: str,
+    end: str,
+    backfill: bool = False,
+    standalone: bool = False,
+) -> dict:
+    """
+    按分片获取 [begin, end] (时间升序) 并逐片写入本地库, 返回本窗口的统计。
+
+    分片并发获取, 完成一片就写入一片, 中途超时或失败时已写入的记录与进度都会保留。同步进度只沿连续完整的分片推进:
+    向前同步从 begin 往后推进水位 synced_through, 回填从 end 往前推进已同步范围的起点 first_date;
+    中间某一片失败或被截断时, 之后的分片仍写入记录, 但进度停在那里, 下次同步会重新覆盖。
+    standalone 的窗口与已同步范围不相连, 只写入记录, 不推进任何一侧。
+    """
+    base_url, endpoint = DATASETS[dataset]
+    days = (date.fromisoformat(end) - date.fromisoformat(begin)).days
+    shards = split_date_range(begin, end) if days > SHARD_THRESHOLD_DAYS else [(begin, end)]
+    if backfill:
+        shards.reverse()
+    semaphore = asyncio.Semaphore(SHARD_CONCURRENCY)
+
+    async def fetch(index: int) -> tuple[int, dict]:
+        shard_begin, shard_end = shards[index]
+        async with semaphore:
+            try:
+                data = await fetch_all_pages_data(base_url, endpoint, label, shard_begin, shard_end, direction="asc")
+            except CompassDataError as e:
+                data = {"items": [], "errors": [{"details": e.details}]}
+        return index, data
+
+    outcomes: dict[int, tuple[Optional[str], bool]] = {}
+    frontier, blocked = 0, False
+    fetched = inserted = 0
+    errors = []
+    tasks = [asyncio.ensure_future(fetch(index)) for index in range(len(shards))]
+    try:
+        for next_shard in asyncio.as_completed(tasks):
+            index, data = await next_shard
+            shard_begin, shard_end = shards[index]
+            outcomes[index] = _shard_progress(data, shard_begin, shard_end, backfill)
+            progress = None
+            while not blocked and frontier in outcomes:
+                reach, complete = outcomes[frontier]
+                progress = reach or progress
+                blocked = not complete
+                frontier += 1
+            for error in data.get("errors", []):
+                errors.append({"begin_date": shard_begin, "end_date": shard_end, **error})
+            fetched += len(data["items"])
+            if standalone:
+                inserted += await asyncio.to_thread(store.append, dataset, label, data["items"], None, None)
+            elif backfill:
+                inserted += await asyncio.to_thread(store.append, dataset, label, data["items"], progress, None)
+            else:
+                inserted += await asyncio.to_thread(store.append, dataset, label, data["items"], begin, progress)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return {"fetched": fetched, "inserted": inserted, "complete": not blocked, "errors": errors}
+
+
+async def _sync_uncached(dataset: str, label: str, begin_date: Optional[str], today: date, end_date: Optional[str] = None) -> dict:
+    store = get_store()
+    mark = await asyncio.to_thread(store.watermark, dataset, label)
+    end = end_date or today.isoformat()
+    forward = backfill = standalone = None
+    if mark is None:
+        forward = (begin_date or (today - timedelta(days=SYNC_INITIAL_DAYS)).isoformat(), end)
+    else:
+        first_date, synced_through = mark["first_date"], mark["synced_through"]
+        start = (date.fromisoformat(synced_through) - timedelta(days=SYNC_OVERLAP_DAYS)).isoformat()
+        if end_date is None or end > synced_through:
+            if end_date is not None and begin_date and begin_date > synced_through:
+                # 窗口整体晚于水位: 只获取窗口本身, 中间的空档留给之后的增量同步
+                standalone = (begin_date, end)
+            else:
+                forward = (max(start, begin_date) if end_date is not None and begin_date else start, end)
+        if begin_date and begin_date < first_date:
+            if end < first_date:
+                # 窗口整体早于已同步范围: 只获取窗口本身, 不回填中间的空档
+                standalone = (begin_date, end)
+            else:
+                # 要求的起点早于已同步范围时, 只补齐更早的这一段
+                backfill = (begin_date, first_date)
+
+    windows = []
+    if forward is not None:
+        windows.append(await _sync_window(store, dataset, label, *forward))
+    if backfill is not None:
+        windows.append(await _sync_window(store, dataset, label, *backfill, backfill=True))
+    if standalone is not None:
+        windows.append(await _sync_window(store, dataset, label, *standalone, standalone=True))
+
+    mark = await asyncio.to_thread(store.watermark, dataset, label)
+    errors = [error for window in windows for error in window["errors"]]
+    result = {
+        "dataset": dataset,
+        "label": label,
+        "window": list(forward) if forward is not None else None,
+        "fetched": sum(window["fetched"] for window in windows),
+        "inserted": sum(window["inserted"] for window in windows),
+        "complete": all(window["complete"] for window in windows),
+        "synced_from": mark["first_date"] if mark else None,
+        "synced_through": mark["synced_through"] if mark else None,
+        "records": mark["records"] if mark else 0,
+    }
+    if backfill is not None:
+        result["backfill"] = list(backfill)
+    if standalone is not None:
+        result["standalone"] = list(standalone)
+    if errors:
+        result["errors"] = errors
+    return result
+
+
+async def sync_label(label: str, datasets: list[str], begin_date: Optional[str] = None) -> list[dict]:
+    """并发同步一个仓库的多个数据集, 单个数据集失败不影响其他数据集。"""
+    semaphore = asyncio.Semaphore(SYNC_CONCURRENCY)
+
+    async def sync_one(dataset: str) -> dict:
+        async with semaphore:
+            try:
+                return await sync_dataset(dataset, label, begin_date)
+            except CompassDataError as e:
+                return {"dataset": dataset, "label": label, "error": "Sync Failed", "details": e.details}
+            except ValueError as e:
+                return {"dataset": dataset, "label": label, "error": "Invalid Dataset", "details": str(e)}
+
+    return list(await asyncio.gather(*(sync_one(dataset) for dataset in datasets)))
+
+
+async def query_synced(dataset: str, label: str, begin_date: str, end_date: str, page: int = 1, size: int = 100) -> dict:
+    """从本地同步库按日期范围分页查询; 附带同步水位, 便于调用方判断数据是否覆盖所需范围。items 为 RawJSON 原文。"""
+    store = get_store()
+    total, items = await asyncio.to_thread(
+        store.query, dataset, label, begin_date, end_date, (page - 1) * size, size
+    )
+    mark = await asyncio.to_thread(store.watermark, dataset, label)
+    return {
+        "count": total,
+        "page": page,
+        "total_page": -(-total // size) if size else 0,
+        "synced_from": mark["first_date"] if mark else None,
+        "synced_through": mark["synced_through"] if mark else None,
+        "items": items,
+    }
+
+
+def _covers(mark: Optional[dict], begin_date: str, end_date: str) -> bool:
+    return mark is not None and mark["first_date"] <= begin_date and mark["synced_through"] >= end_date
+
+
+async def range_summary(dataset: str, label: str, begin_date: str, end_date: str) -> dict:
+    """
+    用按日统计的前缀和回答任意日期闭区间内的汇总 (提交数、增删行数、Issue/PR 打开与关闭数等)。
+
+    窗口超出本地已同步的范围时先同步窗口中缺少的部分 (只获取 [begin_date, end_date] 以内的数据),
+    之后同一仓库的任意子区间都只需在内存中做两次二分查找。日期不合法时抛出 CompassDataError。
+    同步未能覆盖整个窗口时 complete 为 false, 附带同步错误, 不返回不完整的汇总。
+    """
+    # 先校验日期, 避免用不合法的窗口触发同步
+    validate_range(begin_date, end_date)
+    store = get_store()
+    mark = await asyncio.to_thread(store.watermark, dataset, label)
+    needed_end = min(end_date, date.today().isoformat())
+    complete, errors = True, []
+    if needed_end >= begin_date and not _covers(mark, begin_date, needed_end):
+        synced = await sync_dataset(dataset, label, begin_date, end_date=needed_end)
+        mark = await asyncio.to_thread(store.watermark, dataset, label)
+        # 与已同步范围不相连的窗口不移动水位, 此时以本次同步是否完整为准
+        complete = _covers(mark, begin_date, needed_end) or synced["complete"]
+        errors = synced.get("errors", [])
+    result = {
+        "dataset": dataset,
+        "label": label,
+        "begin_date": begin_date,
+        "end_date": end_date,
+        "complete": complete,
+        "summary": None,
+        "synced_from": mark["first_date"] if mark else None,
+        "synced_through": mark["synced_through"] if mark else None,
+        "source": "local_index",
+    }
+    if complete:
+        index = await asyncio.to_thread(store.prefix_index, dataset, label)
+        result["summary"] = index.range_sum(begin_date, end_date)
+    else:
+        result["errors"] = errors
+    return result
+
+
+# --- 命令行 ---
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="增量同步 Compass 丰富化数据到本地 SQLite")
+    parser.add_argument("--path", default=SYNC_DB_PATH, help="同步库路径, 默认读取 COMPASS_SYNC_DB_PATH")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="同步指定仓库的数据集 (适合放进每日定时任务)")
+    sync_parser.add_argument("--label", required=True, action="append", help="仓库地址, 可重复指定")
+    sync_parser.add_argument("--dataset", action="append", help="数据集名称, 可重复指定, 默认 fork/stargazer/git_commit/issue")
+    sync_parser.add_argument("--begin-date", help="首次同步的起始日期 (YYYY-MM-DD)")
+    status_parser = subparsers.add_parser("status", help="显示各 (数据集, 仓库) 的同步水位")
+    status_parser.add_argument("--label", help="只显示指定仓库")
+    reindex_parser = subparsers.add_parser("reindex", help="由本地记录重建按日统计索引")
+    reindex_parser.add_argument("--label", help="只重建指定仓库")
+    args = parser.parse_args()
+
+    global _store
+    _store = SyncStore(args.path)
+    try:
+        if args.command == "sync":
+            datasets = args.dataset or ["fork", "stargazer", "git_commit", "issue"]
+
+            async def run() -> list[dict]:
+                results = []
+                try:
+                    for label in args.label:
+                        results.extend(await sync_label(label, datasets, args.begin_date))
+                finally:
+                    await close_client()
+                return results
+
+            print(json.dumps(asyncio.run(run()), indent=2, ensure_ascii=False))
+        elif args.command == "status":
+            print(json.dumps(_store.status(args.label), indent=2, ensure_ascii=False))
+        elif args.command == "reindex":
+            for mark in _store.status(args.label):
+                _store.rebuild_stats(mark["dataset"], mark["label"])
+                print(f"已重建 {mark['dataset']} {mark['label']}")
+    finally:
+        _store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+# compass_tracing.py
+# 慢调用的按需追踪与剖析 (默认关闭, 可在运行时通过 /debug/tracing 开关, 无需重启):
+#   - 追踪: 每次工具调用是一棵 span 树, 经 contextvar 在 Compass 辅助函数、HTTP 客户端与渲染路径间传递;
+#   - 栈采样: 追踪开启时, 后台线程按固定间隔采样事件循环线程的调用栈, 开销与调用数无关;
+#   - cProfile: 按比例抽样的调用额外开启确定性剖析。
+# 只有耗时超过阈值的调用才落盘 (span 树 JSON、可用 speedscope / flamegraph.pl 打开的折叠栈、
+# 可用 pstats / snakeviz 打开的 .prof), 其余调用的数据直接丢弃。
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import cProfile
+import threading
+import contextlib
+import contextvars
+from collections import Counter
+from datetime import datetime
+from typing import Any, Optional
+from dotenv import load_dotenv
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+# --- 初始化 ---
+
+# 加载 .env 文件 (追踪配置在模块导入时读取, 之后可在运行时修改)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+dotenv_path = os.path.join(script_dir, '.env')
+load_dotenv(dotenv_path=dotenv_path)
+
+# --- 配置 ---
+# 启动时是否开启追踪
+TRACE_ENABLED = os.getenv("COMPASS_TRACE_ENABLED", "0").lower() in ("1", "true", "yes")
+# 耗时超过该秒数的调用会落盘
+TRACE_SLOW_SECONDS = float(os.getenv("COMPASS_TRACE_SLOW_SECONDS", "5"))
+# 额外开启 cProfile 的调用比例 (0~1); 同一时刻只有一个调用会被 cProfile 剖析
+TRACE_PROFILE_RATE = float(os.getenv("COMPASS_TRACE_PROFILE_RATE", "0"))
+# 栈采样间隔 (毫秒), 设为 0 关闭栈采样
+TRACE_SAMPLE_INTERVAL_MS = float(os.getenv("COMPASS_TRACE_SAMPLE_INTERVAL_MS", "10"))
+# 追踪文件目录与保留的最大追踪数 (超出后删除最旧的)
+TRACE_DIR = os.getenv("COMPASS_TRACE_DIR", os.path.join(script_dir, ".compass_traces"))
+TRACE_MAX_FILES = int(os.getenv("COMPASS_TRACE_MAX_FILES", "200"))
+# 访问 /debug/tracing 所需的令牌 (请求头 Authorization: Bearer <令牌>); 未设置时只接受本机请求
+TRACE_ADMIN_TOKEN = os.getenv("COMPASS_TRACE_ADMIN_TOKEN", "")
+
+# 单个追踪最多记录的 span 数 (扇出很大的调用只保留前面的部分)
+MAX_SPANS = 5000
+# 落盘时参数值的最大长度
+MAX_ARGUMENT_CHARS = 2000
+# 名称匹配时不落盘参数值 (如 gitee_pr 的 access_token), 嵌套对象中的同名键同样处理
+SENSITIVE_ARGUMENT = re.compile(r"token|secret|passw|credential|auth|cookie|(^|_)key$|api_?key", re.IGNORECASE)
+REDACTED = "[REDACTED]"
+
+
+class TraceSettings:
+    """可在运行时修改的追踪设置 (进程级; 多 worker 时每个 worker 各自一份)。"""
+
+    FIELDS = {"enabled": bool, "slow_seconds": float, "profile_rate": float, "sample_interval_ms": float}
+
+    def __init__(self):
+        self.enabled = TRACE_ENABLED
+        self.slow_seconds = TRACE_SLOW_SECONDS
+        self.profile_rate = TRACE_PROFILE_RATE
+        self.sample_interval_ms = TRACE_SAMPLE_INTERVAL_MS
+
+    def update(self, changes: dict) -> None:
+        """校验并应用修改, 未知字段或类型不符时抛出 ValueError (不做部分修改)。"""
+        values = {}
+        for name, value in changes.items():
+            kind = self.FIELDS.get(name)
+            if kind is None:
+                raise ValueError(f"Unknown setting {name!r}; available: {', '.join(self.FIELDS)}.")
+            if kind is bool and not isinstance(value, bool):
+                raise ValueError(f"{name} must be true or false.")
+            if kind is float and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+                raise ValueError(f"{name} must be a non-negative number.")
+            values[name] = kind(value)
+        if values.get("profile_rate", 0) > 1:
+            raise ValueError("profile_rate must be between 0 and 1.")
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+settings = TraceSettings()
+
+
+# --- span ---
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "end", "children")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.children: list[Span] = []
+
+    def set(self, key: str, value: Any) -> None:
+        self.attrs[key] = value
+
+    def to_dict(self, origin: float) -> dict:
+        end = self.end if self.end is not None else time.perf_counter()
+        node = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+        }
+        if self.attrs:
+            node["attrs"] = self.attrs
+        if self.end is None:
+            # 调用结束时仍未完成 (如被取消的后台任务)
+            node["unfinished"] = True
+        if self.children:
+            node["children"] = [child.to_dict(origin) for child in self.children]
+        return node
+
+
+class _NoopSpan:
+    """未在追踪中时 span() 返回的占位对象, set() 什么都不做。"""
+
+    __slots__ = ()
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Trace:
+    """一次工具调用的追踪: 根 span、栈采样计数与可选的 cProfile。"""
+
+    def __init__(self, tool: str, arguments: dict):
+        self.id = uuid.uuid4().hex[:12]
+        self.tool = tool
+        self.arguments = arguments
+        self.started_at = datetime.now()
+        self.root = Span(tool, {})
+        self.span_count = 1
+        self.dropped_spans = 0
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        # 采样期间同时进行中的追踪数的最大值 (大于 1 时栈样本包含其他调用的工作)
+        self.max_concurrent = 1
+        self.profiler: Optional[cProfile.Profile] = None
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("compass_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("compass_span", default=None)
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """
+    在当前追踪中记录一个子 span, 产出可调用 set(key, value) 的对象。
+
+    不在追踪中 (追踪关闭或不在工具调用内) 时只有一次 contextvar 读取的开销。
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield _NOOP
+        return
+    trace = _current_trace.get()
+    if trace.span_count >= MAX_SPANS:
+        trace.dropped_spans += 1
+        yield _NOOP
+        return
+    trace.span_count += 1
+    child = Span(name, attrs)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        child.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+# --- 栈采样 ---
+
+class StackSampler:
+    """
+    后台线程按固定间隔采样指定线程 (事件循环线程) 的调用栈, 样本计入当时所有进行中的追踪。
+
+    同一事件循环上并发的调用共享同一个线程, 因此样本无法区分属于哪个调用; 落盘时记录同时进行中的追踪数。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: dict[int, list[Trace]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+
+    def register(self, trace: Trace) -> None:
+        thread_id = threading.get_ident()
+        with self._lock:
+            traces = self._active.setdefault(thread_id, [])
+            traces.append(trace)
+            for other in traces:
+                other.max_concurrent = max(other.max_concurrent, len(traces))
+            if self._thread is None or not self._thread.is_alive():
+                self._wakeup.clear()
+                self._thread = threading.Thread(target=self._run, name="compass-stack-sampler", daemon=True)
+                self._thread.start()
+
+    def unregister(self, trace: Trace) -> None:
+        thread_id = threading.get_ident()
+        with self._lock:
+            traces = self._active.get(thread_id, [])
+            if trace in traces:
+                traces.remove(trace)
+            if not traces:
+                self._active.pop(thread_id, None)
+            if not self._active:
+                self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            interval = settings.sample_interval_ms / 1000
+            if self._wakeup.wait(interval if interval > 0 else 0.1):
+                with self._lock:
+                    if not self._active:
+                        self._thread = None
+                        return
+                    self._wakeup.clear()
+            if interval <= 0:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, traces in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    stack = _collapse(frame)
+                    for trace in traces:
+                        trace.stacks[stack] += 1
+                        trace.samples += 1
+
+
+def _collapse(frame) -> str:
+    """把调用栈转成折叠格式 (根在前, 以分号分隔)。"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+_sampler = StackSampler()
+# cProfile 在同一时刻只能有一个处于开启状态
+_profiler_lock = threading.Lock()
+
+
+# --- 工具调用追踪 ---
+
+@contextlib.contextmanager
+def trace_call(tool: str, arguments: dict):
+    """
+    追踪一次工具调用 (在工具调用的最外层使用)。追踪关闭时不做任何事。
+
+    调用耗时超过阈值时把追踪写入 TRACE_DIR, 返回后其余数据即被丢弃。
+    """
+    if not settings.enabled or _current_trace.get() is not None:
+        yield
+        return
+    trace = Trace(tool, arguments)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    if settings.sample_interval_ms > 0:
+        _sampler.register(trace)
+    if settings.profile_rate > 0 and random.random() < settings.profile_rate and _profiler_lock.acquire(blocking=False):
+        trace.profiler = cProfile.Profile()
+        try:
+            trace.profiler.enable()
+        except ValueError:
+            # 已有其他剖析工具在运行
+            trace.profiler = None
+            _profiler_lock.release()
+    try:
+        yield
+    except BaseException as e:
+        trace.root.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        trace.root.end = time.perf_counter()
+        if trace.profiler is not None:
+            trace.profiler.disable()
+            _profiler_lock.release()
+        _sampler.unregister(trace)
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        duration = trace.root.end - trace.root.start
+        if duration >= settings.slow_seconds:
+            _schedule_write(trace, duration)
+
+
+# 进行中的落盘任务 (保留引用, 避免任务在完成前被回收)
+_pending_writes: set = set()
+
+
+def _write_quietly(trace: Trace, duration: float) -> None:
+    try:
+        write_trace(trace, duration)
+    except OSError as e:
+        print(f"写入追踪文件失败: {e}")
+
+
+def _schedule_write(trace: Trace, duration: float) -> None:
+    """在线程中落盘 (JSON、折叠栈与 .prof 都可能较大), 不阻塞事件循环; 不在事件循环中时直接写入。"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _write_quietly(trace, duration)
+        return
+    task = loop.create_task(asyncio.to_thread(_write_quietly, trace, duration))
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+
+
+def _redact(name: str, value: Any) -> Any:
+    """去掉敏感参数的值; 字典与列表逐层检查键名。"""
+    if SENSITIVE_ARGUMENT.search(name):
+        return REDACTED
+    if isinstance(value, dict):
+        return {key: _redact(str(key), item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_redact("", item) for item in value]
+    return value
+
+
+def _truncate(value: Any) -> Any:
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    if len(text) <= MAX_ARGUMENT_CHARS:
+        return value
+    return text[:MAX_ARGUMENT_CHARS] + f"... ({len(text)} chars)"
+
+
+def write_trace(trace: Trace, duration: float) -> str:
+    """把追踪写入 TRACE_DIR, 返回 JSON 文件路径。同一追踪的文件共用文件名前缀; 敏感参数的值不会写入。"""
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    stem = os.path.join(TRACE_DIR, f"{trace.started_at:%Y%m%d-%H%M%S}-{trace.tool}-{trace.id}")
+    files = {"trace": os.path.basename(stem + ".json")}
+    if trace.stacks:
+        with open(stem + ".folded", "w", encoding="utf-8") as f:
+            for stack, count in trace.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        files["stacks"] = os.path.basename(stem + ".folded")
+    if trace.profiler is not None:
+        trace.profiler.dump_stats(stem + ".prof")
+        files["profile"] = os.path.basename(stem + ".prof")
+    document = {
+        "id": trace.id,
+        "tool": trace.tool,
+        "arguments": {name: _truncate(_redact(name, value)) for name, value in (trace.arguments or {}).items()},
+        "started_at": trace.started_at.isoformat(timespec="milliseconds"),
+        "duration_seconds": round(duration, 3),
+        "slow_seconds": settings.slow_seconds,
+        "files": files,
+        "spans": trace.root.to_dict(trace.root.start),
+        "span_count": trace.span_count,
+        "dropped_spans": trace.dropped_spans,
+        "samples": {
+            "count": trace.samples,
+            "interval_ms": settings.sample_interval_ms,
+            "max_concurrent_calls": trace.max_concurrent,
+            "top": [{"stack": stack.rsplit(";", 3)[-3:], "count": count} for stack, count in trace.stacks.most_common(10)],
+        },
+    }
+    with open(stem + ".json", "w", encoding="utf-8") as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+    _prune()
+    return stem + ".json"
+
+
+def list_traces(limit: Optional[int] = None) -> list[str]:
+    """TRACE_DIR 中的追踪 (JSON 文件名), 最新的在前。"""
+    try:
+        names = [name for name in os.listdir(TRACE_DIR) if name.endswith(".json")]
+    except FileNotFoundError:
+        return []
+    names.sort(reverse=True)
+    return names[:limit] if limit is not None else names
+
+
+def _prune() -> None:
+    """只保留最新的 TRACE_MAX_FILES 个追踪, 删除更早追踪的全部文件。"""
+    for name in list_traces()[TRACE_MAX_FILES:]:
+        stem = os.path.join(TRACE_DIR, name[:-len(".json")])
+        for suffix in (".json", ".folded", ".prof"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(stem + suffix)
+
+
+# --- 运行时开关端点 ---
+
+def _authorized(request: Request) -> bool:
+    if TRACE_ADMIN_TOKEN:
+        return request.headers.get("authorization", "") == f"Bearer {TRACE_ADMIN_TOKEN}"
+    return request.client is not None and request.client.host in ("127.0.0.1", "::1", "localhost")
+
+
+async def tracing_endpoint(request: Request) -> JSONResponse:
+    """
+    GET 返回当前设置与最近的追踪文件; POST 以 JSON 对象修改设置, 例如 {"enabled": true, "slow_seconds": 2}。
+    两者都需要管理令牌, 未设置令牌时只接受本机请求。
+    """
+    if not _authorized(request):
+        return JSONResponse({"status": 403, "error": "Forbidden", "details": "Set COMPASS_TRACE_ADMIN_TOKEN and send it as a Bearer token, or call from localhost."}, status_code=403)
+    if request.method == "POST":
+        try:
+            changes = await request.json()
+            if not isinstance(changes, dict):
+                raise ValueError("Request body must be a JSON object.")
+            settings.update(changes)
+        except ValueError as e:
+            return JSONResponse({"status": 400, "error": "Invalid Settings", "details": str(e)}, status_code=400)
+        print(f"追踪设置已更新: {settings.as_dict()}")
+    return JSONResponse({**settings.as_dict(), "trace_dir": TRACE_DIR, "recent_traces": list_traces(20)})
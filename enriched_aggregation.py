@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+# enriched_aggregation.py
+# 服务端聚合丰富化数据: 边获取边把每批条目只抽取用到的字段转成列式 NumPy 数组 (原始条目随即释放),
+# 最后拼接各批的数组, 在服务端完成分组统计 (每周提交数、作者增删行数、PR 合并耗时分位数、Issue 关闭耗时直方图等),
+# 只把聚合后的小结果返回给模型。
+
+import os
+import math
+import asyncio
+import numpy as np
+from compass_bulk import DATASETS, ItemSink, fetch_dataset
+from compass_columns import (
+    numeric_column, datetime_column, encode_categories, duration_column, bucket_dates,
+    group_index, grouped_aggregate, grouped_distinct, DURATION_UNITS,
+)
+
+# --- 配置 ---
+# 聚合时每页请求的条目数与最多请求的页数 (大仓库的提交数可达数十万, 上限比普通 fetch_all 更高)
+AGGREGATE_PAGE_SIZE = int(os.getenv("COMPASS_AGGREGATE_PAGE_SIZE", "500"))
+AGGREGATE_MAX_PAGES = int(os.getenv("COMPASS_AGGREGATE_MAX_PAGES", "2000"))
+# 每累积多少条原始条目转换一次列式表; 峰值内存只与这一批和已转换的列相关, 与结果总量无关
+AGGREGATE_CHUNK_ROWS = int(os.getenv("COMPASS_AGGREGATE_CHUNK_ROWS", "20000"))
+# 单次返回的最大分组数
+MAX_RESULT_GROUPS = 1000
+
+BUCKETS = ("day", "week", "month", "year")
+_SIMPLE_OPS = ("count", "sum", "mean", "min", "max", "median", "distinct")
+# 由 duration_from/duration_to 计算出的派生字段名
+DURATION_FIELD = "duration"
+
+
+class AggregationError(ValueError):
+    """聚合参数不合法。"""
+
+
+# --- 参数校验 ---
+
+def parse_metric(metric: str) -> tuple[str, str | None]:
+    """解析 'count' 或 'op:field' (op 为 sum/mean/min/max/median/distinct/pNN), 返回 (op, field)。"""
+    op, _, field = metric.partition(":")
+    op, field = op.strip(), field.strip() or None
+    is_percentile = op.startswith("p") and op[1:].replace(".", "", 1).isdigit() and 0 <= float(op[1:]) <= 100
+    if op not in _SIMPLE_OPS and not is_percentile:
+        raise AggregationError(f"Unknown metric {metric!r}; use count or op:field with op in sum/mean/min/max/median/distinct/pNN.")
+    if op == "count":
+        return op, None
+    if field is None:
+        raise AggregationError(f"Metric {metric!r} needs a field, e.g. '{op}:lines_added'.")
+    return op, field
+
+
+def validate_request(
+    dataset: str,
+    metrics: list[str],
+    group_by: list[str],
+    bucket_field: str,
+    bucket: str,
+    duration_from: str,
+    duration_to: str,
+    duration_unit: str,
+    histogram_field: str,
+    bins: int,
+    top_n: int,
+    sort_by: str,
+) -> dict:
+    if dataset not in DATASETS:
+        raise AggregationError(f"Unknown dataset {dataset!r}; available: {', '.join(DATASETS)}.")
+    parsed = [(m.strip(), *parse_metric(m)) for m in (metrics or ["count"])]
+    if bool(bucket_field) != bool(bucket):
+        raise AggregationError("bucket_field and bucket must be given together.")
+    if bucket and bucket not in BUCKETS:
+        raise AggregationError(f"bucket must be one of {', '.join(BUCKETS)}.")
+    if bool(duration_from) != bool(duration_to):
+        raise AggregationError("duration_from and duration_to must be given together.")
+    if duration_unit not in DURATION_UNITS:
+        raise AggregationError(f"duration_unit must be one of {', '.join(DURATION_UNITS)}.")
+    uses_duration = any(field == DURATION_FIELD for _, _, field in parsed) or histogram_field == DURATION_FIELD
+    if uses_duration and not duration_from:
+        raise AggregationError("The 'duration' field needs duration_from and duration_to.")
+    if not 1 <= bins <= 500:
+        raise AggregationError("bins must be between 1 and 500.")
+    if top_n < 1:
+        raise AggregationError("top_n must be a positive integer.")
+    if sort_by and sort_by not in [name for name, _, _ in parsed]:
+        raise AggregationError(f"sort_by must be one of the requested metrics: {', '.join(name for name, _, _ in parsed)}.")
+    return {
+        "dataset": dataset,
+        "metrics": parsed,
+        "group_by": list(group_by or []),
+        "bucket_field": bucket_field or None,
+        "bucket": bucket or None,
+        "duration": (duration_from, duration_to, duration_unit) if duration_from else None,
+        "histogram_field": histogram_field or None,
+        "bins": bins,
+        "top_n": min(top_n, MAX_RESULT_GROUPS),
+        "sort_by": sort_by or None,
+    }
+
+
+# --- 列式表 ---
+
+class ColumnarTable:
+    """只保存聚合需要的列: 数值 float64、时间 datetime64、类别为 int32 编码 + 类别表。"""
+
+    def __init__(self, items: list, request: dict):
+        self.rows = len(items)
+        self.numeric: dict[str, np.ndarray] = {}
+        self.categories: dict[str, tuple[np.ndarray, list[str]]] = {}
+        self.bucket: np.ndarray | None = None
+
+        for field in request["group_by"]:
+            self.categories[field] = encode_categories(items, field)
+        if request["bucket_field"]:
+            self.bucket = bucket_dates(datetime_column(items, request["bucket_field"]), request["bucket"])
+        if request["duration"]:
+            start_field, end_field, unit = request["duration"]
+            self.numeric[DURATION_FIELD] = duration_column(
+                datetime_column(items, start_field, "s"), datetime_column(items, end_field, "s"), unit
+            )
+        for _, op, field in request["metrics"]:
+            if field is None:
+                continue
+            if op == "distinct":
+                if field not in self.categories:
+                    self.categories[field] = encode_categories(items, field)
+            elif field not in self.numeric:
+                self.numeric[field] = numeric_column(items, field)
+        field = request["histogram_field"]
+        if field and field not in self.numeric:
+            self.numeric[field] = numeric_column(items, field)
+
+    @classmethod
+    def concat(cls, tables: list["ColumnarTable"], request: dict) -> "ColumnarTable":
+        """按行拼接分批构建的列式表; 各批的类别编码重新映射到合并后的类别表。"""
+        if len(tables) == 1:
+            return tables[0]
+        table = cls([], request)
+        if not tables:
+            return table
+        table.rows = sum(t.rows for t in tables)
+        for field in table.numeric:
+            table.numeric[field] = np.concatenate([t.numeric[field] for t in tables])
+        for field in table.categories:
+            mapping: dict[str, int] = {}
+            codes = []
+            for t in tables:
+                part, names = t.categories[field]
+                lookup = np.array([mapping.setdefault(name, len(mapping)) for name in names], dtype=np.int32)
+                codes.append(lookup[part] if len(part) else part)
+            table.categories[field] = (np.concatenate(codes), list(mapping))
+        if table.bucket is not None:
+            table.bucket = np.concatenate([t.bucket for t in tables])
+        return table
+
+    @property
+    def nbytes(self) -> int:
+        total = sum(a.nbytes for a in self.numeric.values())
+        total += sum(codes.nbytes for codes, _ in self.categories.values())
+        return total + (self.bucket.nbytes if self.bucket is not None else 0)
+
+
+# --- 聚合 ---
+
+def _clean(value: float):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return round(float(value), 4)
+
+
+def aggregate_table(table: ColumnarTable, request: dict) -> dict:
+    """在列式表上完成分组聚合, 返回可直接序列化的小结果。"""
+    rows = np.ones(table.rows, dtype=bool)
+    key_columns, key_names = [], []
+    for field in request["group_by"]:
+        key_columns.append(table.categories[field][0])
+        key_names.append(field)
+    if table.bucket is not None:
+        rows &= ~np.isnat(table.bucket)
+        key_columns.append(table.bucket.astype("int64"))
+        key_names.append(request["bucket"])
+
+    index, keys = group_index([c[rows] for c in key_columns], int(rows.sum()))
+    size = len(keys)
+
+    columns = {}
+    for name, op, field in request["metrics"]:
+        if op == "count":
+            columns[name] = grouped_aggregate(index, None, size, "count")
+        elif op == "distinct":
+            columns[name] = grouped_distinct(index, table.categories[field][0][rows], size)
+        else:
+            columns[name] = grouped_aggregate(index, table.numeric[field][rows], size, op)
+
+    # 排序: 指定 sort_by 时按该指标降序; 只按时间分桶时按时间顺序; 否则按第一个指标降序
+    first_metric = request["metrics"][0][0]
+    if request["sort_by"]:
+        order = np.argsort(-np.nan_to_num(columns[request["sort_by"]], nan=-np.inf), kind="stable")
+    elif table.bucket is not None and not request["group_by"]:
+        order = np.arange(size)
+    else:
+        order = np.argsort(-np.nan_to_num(columns[first_metric], nan=-np.inf), kind="stable")
+    order = order[:request["top_n"]]
+
+    groups = []
+    for g in order:
+        group = {}
+        for i, name in enumerate(key_names):
+            key = keys[g, i]
+            if i < len(request["group_by"]):
+                group[name] = table.categories[name][1][key]
+            else:
+                group[name] = str(np.datetime64(int(key), "D"))
+        for name, op, _ in request["metrics"]:
+            value = columns[name][g]
+            group[name] = int(value) if op in ("count", "distinct") else _clean(value)
+        groups.append(group)
+
+    result = {
+        "rows": table.rows,
+        "rows_used": int(rows.sum()),
+        "groups_total": size,
+        "groups": groups,
+    }
+    if request["histogram_field"]:
+        values = table.numeric[request["histogram_field"]]
+        values = values[~np.isnan(values)]
+        if len(values):
+            counts, edges = np.histogram(values, bins=request["bins"])
+            result["histogram"] = {
+                "field": request["histogram_field"],
+                "values": int(len(values)),
+                "edges": [_clean(e) for e in edges],
+                "counts": counts.tolist(),
+            }
+        else:
+            result["histogram"] = {"field": request["histogram_field"], "values": 0, "edges": [], "counts": []}
+    return result
+
+
+def aggregate_items(items: list, request: dict) -> dict:
+    """把条目转成列式表后聚合; CPU 密集, 调用方应放在线程中执行。"""
+    table = ColumnarTable(items, request)
+    result = aggregate_table(table, request)
+    result["column_bytes"] = table.nbytes
+    return result
+
+
+async def aggregate_dataset(label: str, begin_date: str, end_date: str, request: dict) -> dict:
+    """
+    获取数据集窗口内的全部条目 (复用分页、分片与缓存) 并在服务端聚合, 失败时抛出 CompassDataError。
+
+    条目逐页到达后每累积 AGGREGATE_CHUNK_ROWS 条就在线程中转成列式表, 不会同时持有全部原始条目。
+    """
+    tables: list[ColumnarTable] = []
+    pending: list = []
+
+    async def columnarize(items: list) -> None:
+        pending.extend(items)
+        if len(pending) >= AGGREGATE_CHUNK_ROWS:
+            batch = pending[:]
+            pending.clear()
+            tables.append(await asyncio.to_thread(ColumnarTable, batch, request))
+
+    data = await fetch_dataset(
+        request["dataset"], label, begin_date, end_date,
+        page_size=AGGREGATE_PAGE_SIZE, max_pages=AGGREGATE_MAX_PAGES, sink=ItemSink(columnarize),
+    )
+    if pending:
+        tables.append(await asyncio.to_thread(ColumnarTable, pending, request))
+    table = await asyncio.to_thread(ColumnarTable.concat, tables, request)
+    result = await asyncio.to_thread(aggregate_table, table, request)
+    result["column_bytes"] = table.nbytes
+    result["truncated"] = data.get("truncated", False)
+    if data.get("errors"):
+        result["failed_requests"] = len(data["errors"])
+    return result
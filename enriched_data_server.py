@@ -2,15 +2,21 @@
 
 import os
 import json
-import httpx
+import asyncio
 from typing import Optional
-from mcp.server import FastMCP
 from dotenv import load_dotenv
+from compass_client import post_to_compass, serve_sse, ENRICHED_BASE_URL
+import compass_json
+from compass_metrics import InstrumentedFastMCP
+from compass_bulk import fetch_range, CompassDataError, ENRICHED_DATASETS
+from compass_prefetch import prefetcher
+from compass_sync import sync_label, query_synced, get_store, range_summary
+from enriched_aggregation import aggregate_dataset, validate_request, AggregationError
 
 # --- 配置 ---
 # Gitee Compass API 的基础 URL
 # BASE_URL = "https://compass.gitee.com/"
-BASE_URL = "https://oss-compass.isrc.ac.cn"
+BASE_URL = ENRICHED_BASE_URL
 
 # --- 初始化 ---
 
@@ -22,12 +28,18 @@ load_dotenv(dotenv_path=dotenv_path)
 # 初始化 FastMCP 服务器为 SSE 模式
 # 新服务名: compass_enriched_data_tools
 # 新端口: 8001
-app = FastMCP(
+app = InstrumentedFastMCP(
     'compass_enriched_data_tools',
     host='0.0.0.0',
     port=8001
 )
 
+# 进程级钩子: 配置了关注列表 (COMPASS_PREFETCH_WATCHLIST) 时在后台预取
+lifespans = [prefetcher.lifespan]
+
+# 端点 -> 数据集名称 (本地同步库与按日统计索引按数据集名称存储)
+DATASET_BY_ENDPOINT = {endpoint: name for name, (_, endpoint) in ENRICHED_DATASETS.items()}
+
 # --- 内部辅助函数 ---
 
 async def _post_request_to_compass(
@@ -38,39 +50,31 @@ async def _post_request_to_compass(
     direction: str = "desc",
     page: int = 1,
     size: int = 10,
+    fetch_all: bool = False,
+    summary: bool = False,
 ) -> str:
     """一个通用的辅助函数，用于调用 Gitee Compass 的 enriched data API"""
-    full_url = os.path.join(BASE_URL, endpoint)
-    token = os.getenv("GITEE_ACCESS_TOKEN")
-
-    if not token:
-        return json.dumps({"status": 401, "error": "Access token not found in .env file."})
-
-    payload = {
-        "access_token": token,
-        "label": label,
-        "direction": direction,
-        "begin_date": begin_date,
-        "end_date": end_date,
-        "page": page,
-        "size": size,
-    }
-    headers = {"Content-Type": "application/json"}
-
-    async with httpx.AsyncClient() as client:
+    if summary:
+        # 由本地同步库的按日统计前缀和直接回答, 窗口超出已同步范围时先同步缺少的部分
         try:
-            response = await client.post(url=full_url, headers=headers, json=payload, timeout=30.0)
-            response.raise_for_status()
-            return response.text
-        except httpx.HTTPStatusError as e:
-            return json.dumps({"status": e.response.status_code, "error": "HTTP Error", "details": e.response.text})
-        except httpx.RequestError as e:
-            return json.dumps({"status": 500, "error": "Request Failed", "details": str(e)})
+            result = await range_summary(DATASET_BY_ENDPOINT[endpoint], label, begin_date, end_date)
+        except CompassDataError as e:
+            return e.details
+        return compass_json.dumps(result)
+    if fetch_all:
+        return await fetch_range(BASE_URL, endpoint, label, begin_date, end_date, direction=direction, page_size=size)
+    # 单页查询不分片: 整个窗口的第 page 页无法映射到各分片的页 (分片共享边界日期, 偏移会错位)
+    return await post_to_compass(BASE_URL, endpoint, label, begin_date, end_date, direction=direction, page=page, size=size)
 
 # --- MCP 工具定义 ---
+# 各工具共用的两个开关 (由 _post_request_to_compass 处理):
+#   fetch_all: 自动翻页并发获取窗口内的全部数据并合并去重, 长窗口按月分片; 此时忽略 page, size 作为每页大小。
+#              按 page 的单页查询不分片, 长窗口建议使用 fetch_all。
+#   summary:   只返回窗口内的汇总数 (提交数、增删行数、打开/关闭数等), 由本地同步库的按日统计即时计算;
+#              窗口超出已同步范围时先同步缺少的部分, 同步不完整时返回 complete=false 而不给出汇总。
 
-@app.tool()
-async def get_fork_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_fork_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False, summary: bool = False) -> str:
     """
     获取 GitHub/Gitee 仓库的 fork enriched(丰富)数据。提供了关于谁、在何时 fork 了仓库的详细信息。
     Args:
@@ -79,13 +83,14 @@ async def get_fork_enriched_data(label: str, begin_date: str, end_date: str, pag
         end_date: 查询结束日期, 格式为 'YYYY-MM-DD'。
         page: 分页页码, 默认为 1。
         size: 每页数量, 默认为 10。
+        fetch_all / summary: 为 True 时分别获取窗口内的全部数据、只返回窗口内的汇总数。
     Returns:
         包含 fork enriched 数据的 JSON 字符串。
     """
-    return await _post_request_to_compass("api/v2/fork/search", label, begin_date, end_date, page=page, size=size)
+    return await _post_request_to_compass("api/v2/fork/search", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all, summary=summary)
 
-@app.tool()
-async def get_pull_event_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_pull_event_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False, summary: bool = False) -> str:
     """
     获取 GitHub/Gitee 的 pull request event enriched(丰富)数据。包含 PR 被合并、关闭、评论等事件的详细信息。
     Args:
@@ -94,14 +99,15 @@ async def get_pull_event_enriched_data(label: str, begin_date: str, end_date: st
         end_date: 查询结束日期。
         page: 分页页码。
         size: 每页数量。
+        fetch_all / summary: 为 True 时分别获取窗口内的全部数据、只返回窗口内的汇总数。
     Returns:
         包含 pull request event enriched 数据的 JSON 字符串。
     """
     # 注意: 根据您的文档，原始路径为 'pull_envet', 这里已修正为 'pull_event'
-    return await _post_request_to_compass("api/v2/pull_event/search", label, begin_date, end_date, page=page, size=size)
+    return await _post_request_to_compass("api/v2/pull_event/search", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all, summary=summary)
 
-@app.tool()
-async def get_git_commit_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_git_commit_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False, summary: bool = False) -> str:
     """
     获取 GitHub/Gitee 的 git commit enriched(丰富)数据。提供每次代码提交的详细信息，包括作者、提交者、代码增删行数等。
     Args:
@@ -110,13 +116,14 @@ async def get_git_commit_enriched_data(label: str, begin_date: str, end_date: st
         end_date: 查询结束日期。
         page: 分页页码。
         size: 每页数量。
+        fetch_all / summary: 为 True 时分别获取窗口内的全部数据、只返回窗口内的汇总数。
     Returns:
         包含 git commit enriched 数据的 JSON 字符串。
     """
-    return await _post_request_to_compass("api/v2/git/search", label, begin_date, end_date, page=page, size=size)
+    return await _post_request_to_compass("api/v2/git/search", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all, summary=summary)
 
-@app.tool()
-async def get_issue_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_issue_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False, summary: bool = False) -> str:
     """
     获取 GitHub/Gitee 的 issue enriched(丰富)数据。提供关于 issue 创建、状态变更、分配人等的详细信息。
     Args:
@@ -125,13 +132,14 @@ async def get_issue_enriched_data(label: str, begin_date: str, end_date: str, pa
         end_date: 查询结束日期。
         page: 分页页码。
         size: 每页数量。
+        fetch_all / summary: 为 True 时分别获取窗口内的全部数据、只返回窗口内的汇总数。
     Returns:
         包含 issue enriched 数据的 JSON 字符串。
     """
-    return await _post_request_to_compass("api/v2/issue/search", label, begin_date, end_date, page=page, size=size)
+    return await _post_request_to_compass("api/v2/issue/search", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all, summary=summary)
 
-@app.tool()
-async def get_pull_request_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_pull_request_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False, summary: bool = False) -> str:
     """
     获取 GitHub/Gitee 的 pull request enriched(丰富)数据。提供 PR 的详细元数据，包括创建者、合并者、状态、标签等。
     Args:
@@ -140,13 +148,14 @@ async def get_pull_request_enriched_data(label: str, begin_date: str, end_date:
         end_date: 查询结束日期。
         page: 分页页码。
         size: 每页数量。
+        fetch_all / summary: 为 True 时分别获取窗口内的全部数据、只返回窗口内的汇总数。
     Returns:
         包含 pull request enriched 数据的 JSON 字符串。
     """
-    return await _post_request_to_compass("api/v2/metadata/pullRequests", label, begin_date, end_date, page=page, size=size)
+    return await _post_request_to_compass("api/v2/metadata/pullRequests", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all, summary=summary)
 
-@app.tool()
-async def get_repo_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_repo_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False, summary: bool = False) -> str:
     """
     获取 GitHub/Gitee 的 repository enriched(丰富)数据。提供仓库的综合信息，如 star 数、fork 数、订阅数、版本发布历史等。
     Args:
@@ -155,13 +164,14 @@ async def get_repo_enriched_data(label: str, begin_date: str, end_date: str, pag
         end_date: 查询结束日期。
         page: 分页页码。
         size: 每页数量。
+        fetch_all / summary: 为 True 时分别获取窗口内的全部数据、只返回窗口内的汇总数。
     Returns:
         包含 repository enriched 数据的 JSON 字符串。
     """
-    return await _post_request_to_compass("api/v2/repo/search", label, begin_date, end_date, page=page, size=size)
+    return await _post_request_to_compass("api/v2/repo/search", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all, summary=summary)
 
-@app.tool()
-async def get_stargazer_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_stargazer_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False, summary: bool = False) -> str:
     """
     获取 GitHub/Gitee 的 stargazer (点赞者) enriched(丰富)数据。提供关于谁、在何时 star 了仓库的详细信息。
     Args:
@@ -170,13 +180,14 @@ async def get_stargazer_enriched_data(label: str, begin_date: str, end_date: str
         end_date: 查询结束日期。
         page: 分页页码。
         size: 每页数量。
+        fetch_all / summary: 为 True 时分别获取窗口内的全部数据、只返回窗口内的汇总数。
     Returns:
         包含 stargazer enriched 数据的 JSON 字符串。
     """
-    return await _post_request_to_compass("api/v2/stargazer/search", label, begin_date, end_date, page=page, size=size)
+    return await _post_request_to_compass("api/v2/stargazer/search", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all, summary=summary)
 
-@app.tool()
-async def get_watch_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_watch_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False, summary: bool = False) -> str:
     """
     获取 GitHub/Gitee 的 watch (关注者) enriched(丰富)数据。提供关于谁、在何时 watch 了仓库的详细信息。
     Args:
@@ -185,13 +196,14 @@ async def get_watch_enriched_data(label: str, begin_date: str, end_date: str, pa
         end_date: 查询结束日期。
         page: 分页页码。
         size: 每页数量。
+        fetch_all / summary: 为 True 时分别获取窗口内的全部数据、只返回窗口内的汇总数。
     Returns:
         包含 watch enriched 数据的 JSON 字符串。
     """
-    return await _post_request_to_compass("api/v2/watch/search", label, begin_date, end_date, page=page, size=size)
+    return await _post_request_to_compass("api/v2/watch/search", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all, summary=summary)
 
-@app.tool()
-async def get_releases_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_releases_enriched_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False, summary: bool = False) -> str:
     """
     获取 GitHub/Gitee 的 releases (版本发布) enriched(丰富)数据。提供仓库所有版本发布的详细列表。
     Args:
@@ -200,13 +212,14 @@ async def get_releases_enriched_data(label: str, begin_date: str, end_date: str,
         end_date: 查询结束日期。
         page: 分页页码。
         size: 每页数量。
+        fetch_all / summary: 为 True 时分别获取窗口内的全部数据、只返回窗口内的汇总数。
     Returns:
         包含 releases enriched 数据的 JSON 字符串。
     """
-    return await _post_request_to_compass("api/v2/releases/search", label, begin_date, end_date, page=page, size=size)
+    return await _post_request_to_compass("api/v2/releases/search", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all, summary=summary)
 
-@app.tool()
-async def get_github_event_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_github_event_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False, summary: bool = False) -> str:
     """
     获取原始的 GitHub Event 数据。这包括了推送(PushEvent)、创建(CreateEvent)等多种类型的事件。
     Args:
@@ -215,13 +228,14 @@ async def get_github_event_data(label: str, begin_date: str, end_date: str, page
         end_date: 查询结束日期。
         page: 分页页码。
         size: 每页数量。
+        fetch_all / summary: 为 True 时分别获取窗口内的全部数据、只返回窗口内的汇总数。
     Returns:
         包含 GitHub event 数据的 JSON 字符串。
     """
-    return await _post_request_to_compass("api/v2/event/search", label, begin_date, end_date, page=page, size=size)
+    return await _post_request_to_compass("api/v2/event/search", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all, summary=summary)
     
-@app.tool()
-async def get_github_repo_event_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10) -> str:
+@app.tool(structured_output=False)
+async def get_github_repo_event_data(label: str, begin_date: str, end_date: str, page: int = 1, size: int = 10, fetch_all: bool = False, summary: bool = False) -> str:
     """
     获取 GitHub 仓库级别的 Event 聚合数据。提供了按时间段聚合的贡献统计，如推送贡献、PR贡献、Issue贡献等。
     Args:
@@ -230,11 +244,114 @@ async def get_github_repo_event_data(label: str, begin_date: str, end_date: str,
         end_date: 查询结束日期。
         page: 分页页码。
         size: 每页数量。
+        fetch_all / summary: 为 True 时分别获取窗口内的全部数据、只返回窗口内的汇总数。
     Returns:
         包含 GitHub repo event 数据的 JSON 字符串。
     """
-    return await _post_request_to_compass("api/v2/repo_event/search", label, begin_date, end_date, page=page, size=size)
+    return await _post_request_to_compass("api/v2/repo_event/search", label, begin_date, end_date, page=page, size=size, fetch_all=fetch_all, summary=summary)
+
+
+@app.tool(structured_output=False)
+async def aggregate_enriched_data(
+    dataset: str,
+    label: str,
+    begin_date: str,
+    end_date: str,
+    metrics: Optional[list[str]] = None,
+    group_by: Optional[list[str]] = None,
+    bucket_field: str = "",
+    bucket: str = "",
+    duration_from: str = "",
+    duration_to: str = "",
+    duration_unit: str = "hours",
+    histogram_field: str = "",
+    bins: int = 20,
+    top_n: int = 50,
+    sort_by: str = "",
+) -> str:
+    """
+    在服务端对窗口内的全部丰富化数据做分组聚合, 只返回聚合结果, 适合统计提交数、增删行数、耗时分位数等。
+    Args:
+        dataset: 数据集, 如 git_commit, issue, pull_request, pull_event, fork, stargazer, watch, releases 等。
+        label: 要查询的仓库地址。
+        begin_date: 查询起始日期, 格式为 'YYYY-MM-DD'。
+        end_date: 查询结束日期, 格式为 'YYYY-MM-DD'。
+        metrics: 指标列表, 默认 ["count"]。格式为 "count" 或 "op:字段", op 为 sum/mean/min/max/median/distinct/pNN (如 p90);
+            字段为 "duration" 时使用 duration_from 到 duration_to 的时长。
+        group_by: 分组字段列表, 如 ["author_name"]。
+        bucket_field: 按时间分桶的日期字段, 如 "grimoire_creation_date"; 需与 bucket 一起使用。
+        bucket: 时间桶粒度 day/week/month/year。
+        duration_from: 时长起点字段, 如 "created_at"。
+        duration_to: 时长终点字段, 如 "merged_at" 或 "closed_at"; 缺失或早于起点的记录不计入时长统计。
+        duration_unit: 时长单位 seconds/minutes/hours/days, 默认 hours。
+        histogram_field: 额外返回该数值字段 (或 "duration") 的直方图。
+        bins: 直方图分箱数, 默认 20。
+        top_n: 最多返回的分组数, 默认 50。
+        sort_by: 按哪个指标降序排列; 默认只按时间分桶时按时间顺序, 否则按第一个指标降序。
+        例: 每周提交数 metrics=["count"], bucket_field="grimoire_creation_date", bucket="week";
+            作者增删行数 metrics=["sum:lines_added", "sum:lines_removed"], group_by=["author_name"];
+            PR 合并耗时分位数 dataset="pull_request", duration_from="created_at", duration_to="merged_at",
+            metrics=["count", "p50:duration", "p90:duration"]。
+    Returns:
+        包含分组聚合结果 (groups) 与可选直方图的 JSON 字符串。
+    """
+    try:
+        request = validate_request(
+            dataset, metrics, group_by, bucket_field, bucket, duration_from, duration_to,
+            duration_unit, histogram_field, bins, top_n, sort_by,
+        )
+        result = await aggregate_dataset(label, begin_date, end_date, request)
+    except AggregationError as e:
+        return json.dumps({"status": 400, "error": "Invalid Aggregation", "details": str(e)})
+    except CompassDataError as e:
+        return e.details
+    return compass_json.dumps(result)
+
+
+@app.tool(structured_output=False)
+async def sync_enriched_data(label: str, datasets: Optional[list[str]] = None, begin_date: str = "") -> str:
+    """
+    把仓库的丰富化数据增量同步到本地库。每个 (数据集, 仓库) 记录已同步到的日期, 之后只请求该日期之后的新数据。
+    Args:
+        label: 要同步的仓库地址。
+        datasets: 数据集列表, 默认 ["fork", "stargazer", "git_commit", "issue"]; 也可用 pull_request, pull_event, watch, releases 等。
+        begin_date: 首次同步的起始日期 'YYYY-MM-DD', 默认一年前; 早于已同步范围时会补齐更早的历史。
+    Returns:
+        每个数据集的同步结果 (本次获取数、新增数、同步水位) 的 JSON 字符串。
+    """
+    results = await sync_label(label, datasets or ["fork", "stargazer", "git_commit", "issue"], begin_date or None)
+    return compass_json.dumps(results)
+
+@app.tool(structured_output=False)
+async def query_synced_enriched_data(dataset: str, label: str, begin_date: str, end_date: str, page: int = 1, size: int = 100) -> str:
+    """
+    从本地同步库按日期范围查询丰富化数据, 不请求上游。需先用 sync_enriched_data 同步。
+    Args:
+        dataset: 数据集名称, 如 git_commit, issue, fork, stargazer。
+        label: 仓库地址。
+        begin_date: 查询起始日期 'YYYY-MM-DD' (含)。
+        end_date: 查询结束日期 'YYYY-MM-DD' (含)。
+        page: 分页页码, 默认为 1。
+        size: 每页数量, 默认为 100。
+    Returns:
+        包含记录与同步水位 (synced_from/synced_through) 的 JSON 字符串; 查询范围超出水位时应先同步。
+    """
+    if page < 1 or not 1 <= size <= 1000:
+        return json.dumps({"status": 400, "error": "Invalid Paging", "details": "page must be >= 1 and size between 1 and 1000."})
+    return compass_json.dumps(await query_synced(dataset, label, begin_date, end_date, page, size))
+
+@app.tool(structured_output=False)
+async def get_sync_status(label: str = "") -> str:
+    """
+    查看本地同步库中各 (数据集, 仓库) 的同步范围与记录数。
+    Args:
+        label: 只显示指定仓库, 默认显示全部。
+    Returns:
+        同步水位列表的 JSON 字符串。
+    """
+    store = get_store()
+    return compass_json.dumps(await asyncio.to_thread(store.status, label or None))
 
 
 if __name__ == "__main__":
-    app.run(transport='sse')
\ No newline at end of file
+    serve_sse(app, lifespans=lifespans)
\ No newline at end of file
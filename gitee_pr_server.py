@@ -2,10 +2,10 @@
 
 import os
 import json
-import httpx
 from typing import Optional
-from mcp.server import FastMCP
 from dotenv import load_dotenv
+from compass_client import post_to_compass, serve_sse, MODEL_BASE_URL
+from compass_metrics import InstrumentedFastMCP
 
 # 加载 .env 文件 (我们依然保留方案2B中的代码，使其更健壮)
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -13,13 +13,33 @@ dotenv_path = os.path.join(script_dir, '.env')
 load_dotenv(dotenv_path=dotenv_path)
 
 # 1. 初始化 FastMCP 时，指定 host 和 port
-app = FastMCP(
+app = InstrumentedFastMCP(
     'gitee-tools',
     host='0.0.0.0', # 监听所有网络接口
     port=8000      # 您可以选择一个未被占用的端口
 )
 
-@app.tool()
+def _baseline_error(text: str) -> str:
+    """
+    把共享请求路径返回的错误信息 {"status", "error", "details"} 转换回本工具原有的格式
+    {"error", "status_code", "details"} (status_code 只在 HTTP 错误时出现), 成功的响应原样返回。
+    """
+    # 错误信息由 compass_client 以 json.dumps 生成, 按前缀判断, 成功的响应不必解析
+    if not text.startswith('{"status": '):
+        return text
+    try:
+        error = json.loads(text)
+    except ValueError:
+        return text
+    if not isinstance(error, dict) or "error" not in error:
+        return text
+    shaped = {"error": error["error"]}
+    if error["error"] == "HTTP Error":
+        shaped["status_code"] = error["status"]
+    shaped.update((key, value) for key, value in error.items() if key not in ("status", "error"))
+    return json.dumps(shaped)
+
+@app.tool(structured_output=False)
 async def get_pull_requests(
     label: str,
     begin_date: str,
@@ -44,54 +64,18 @@ async def get_pull_requests(
     Returns:
         包含 Pull Request 数据的 JSON 字符串。如果请求失败，则返回错误信息。
     """
-    # 接口 URL
-    url = "https://compass.gitee.com/api/v2/metadata/pullRequests"
-
     # 优先使用函数参数中的 access_token，否则从环境变量中读取
     token = access_token or os.getenv("GITEE_ACCESS_TOKEN")
     if not token:
         return json.dumps({"error": "Access token not provided. Please provide it as a parameter or set the GITEE_ACCESS_TOKEN environment variable."})
 
-    # 构建请求体
-    payload = {
-        "access_token": token,
-        "label": label,
-        "direction": direction,
-        "begin_date": begin_date,
-        "end_date": end_date,
-        "page": page,
-        "size": size,
-    }
-
-    headers = {
-        "Content-Type": "application/json"
-    }
-
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                url=url,
-                headers=headers,
-                json=payload  # httpx可以直接使用json参数传递字典
-            )
-            # 抛出HTTP错误状态（如 4xx 或 5xx）的异常
-            response.raise_for_status()
-            
-            # 返回 JSON 响应的字符串形式
-            return response.text
-
-        except httpx.HTTPStatusError as e:
-            return json.dumps({
-                "error": "HTTP Error",
-                "status_code": e.response.status_code,
-                "details": e.response.text
-            })
-        except httpx.RequestError as e:
-            return json.dumps({
-                "error": "Request Failed",
-                "details": str(e)
-            })
+    # 与其他工具共用连接池、限流、重试预算与响应缓存, 每次尝试的超时为 compass_client.REQUEST_TIMEOUT
+    text = await post_to_compass(
+        MODEL_BASE_URL, "api/v2/metadata/pullRequests", label, begin_date, end_date,
+        direction=direction, page=page, size=size, access_token=token,
+    )
+    return _baseline_error(text)
 
 if __name__ == "__main__":
     # 使用 stdio 传输协议运行服务器
-    app.run(transport='sse')
\ No newline at end of file
+    serve_sse(app)
\ No newline at end of file
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# image_sinks.py
+# 绘图结果的发布后端: 本地内容寻址存储 (由同一进程通过 HTTP 提供) 与 imgbb 图床上传。
+# IMAGE_SINK 选择后端:
+#   local        - PNG 写入本地目录后立即返回本地 URL, 适用于无法访问外网的环境
+#   imgbb        - 以 multipart 原始字节上传到 imgbb, 返回图床 URL (默认, 与原有行为一致)
+#   local+imgbb  - 先返回本地 URL, 再在后台把图片镜像到 imgbb
+
+import os
+import re
+import asyncio
+import hashlib
+import tempfile
+import contextvars
+import httpx
+from dotenv import load_dotenv
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from compass_client import get_client
+from compass_deadline import budget
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(dotenv_path=os.path.join(script_dir, '.env'))
+
+# --- 配置 ---
+IMAGE_SINK = os.getenv("IMAGE_SINK", "imgbb").lower()
+# 本地图片目录, 文件名为 PNG 内容的 sha256
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join(script_dir, ".compass_images"))
+# 返回给客户端的本地图片 URL 前缀, 为空时使用服务监听的地址
+IMAGE_PUBLIC_BASE_URL = os.getenv("IMAGE_PUBLIC_BASE_URL", "")
+IMGBB_UPLOAD_URL = os.getenv("IMGBB_UPLOAD_URL", "https://api.imgbb.com/1/upload")
+UPLOAD_TIMEOUT = 30.0
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ImageSinkError(Exception):
+    """图片发布失败; error 与 details 对应工具返回的 JSON 字段。"""
+
+    def __init__(self, error: str, details: str, status: int = 500):
+        super().__init__(details)
+        self.error = error
+        self.details = details
+        self.status = status
+
+
+def image_digest(png: bytes) -> str:
+    return hashlib.sha256(png).hexdigest()
+
+
+class LocalImageStore:
+    """以内容哈希命名的本地图片目录; 相同图片只写一次, 写入通过临时文件 + 重命名保证原子性。"""
+
+    def __init__(self, directory: str, base_url: str):
+        self.directory = directory
+        self.base_url = base_url.rstrip('/')
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.png")
+
+    def url_for(self, digest: str) -> str:
+        return f"{self.base_url}/images/{digest}.png"
+
+    def _write(self, digest: str, png: bytes) -> None:
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    async def save(self, digest: str, png: bytes) -> str:
+        try:
+            await asyncio.to_thread(self._write, digest, png)
+        except OSError as e:
+            raise ImageSinkError("Image Store Failed", f"Failed to write image to {self.directory}: {e}")
+        return self.url_for(digest)
+
+    async def serve(self, request: Request) -> Response:
+        """GET /images/{digest}.png; 内容寻址的文件永不变化, 允许客户端长期缓存。"""
+        digest = request.path_params["digest"]
+        path = self.path_for(digest)
+        if not _DIGEST_RE.match(digest) or not os.path.exists(path):
+            return Response("Not Found", status_code=404)
+        return FileResponse(
+            path,
+            media_type="image/png",
+            headers={"Cache-Control": "public, max-age=31536000, immutable"},
+        )
+
+
+class ImgbbUploader:
+    """以 multipart/form-data 上传原始 PNG 字节到 imgbb, 省去 base64 编码带来的约 33% 体积膨胀。"""
+
+    async def upload(self, digest: str, png: bytes) -> str:
+        api_key = os.getenv("IMGBB_API_KEY")
+        if not api_key:
+            raise ImageSinkError("Configuration Error", "IMGBB_API_KEY not found in .env file.", status=401)
+        client = get_client()
+        try:
+            response = await client.post(
+                IMGBB_UPLOAD_URL,
+                data={"key": api_key},
+                files={"image": (f"{digest}.png", png, "image/png")},
+                timeout=budget(UPLOAD_TIMEOUT),
+            )
+            response.raise_for_status()
+            result = response.json()
+        except httpx.HTTPStatusError as e:
+            raise ImageSinkError("Image Upload Failed", f"HTTP {e.response.status_code}: {e.response.text}")
+        except httpx.RequestError as e:
+            raise ImageSinkError("Network Error", f"Failed to connect to image host: {e}")
+        if result.get("success"):
+            return result["data"]["url"]
+        error_message = result.get("error", {}).get("message", "Unknown upload error")
+        raise ImageSinkError("Image Upload Failed", error_message)
+
+
+class ImageSink:
+    """按 IMAGE_SINK 组合本地存储与远程上传, 对工具只暴露 publish()。"""
+
+    def __init__(self, mode: str, store: LocalImageStore | None, uploader: ImgbbUploader | None):
+        self.mode = mode
+        self.store = store
+        self.uploader = uploader
+        # local+imgbb 模式下已镜像完成的远程 URL (digest -> url)
+        self.mirror_urls: dict[str, str] = {}
+        self._mirror_tasks: dict[str, asyncio.Task] = {}
+
+    async def publish(self, png: bytes) -> tuple[str, str]:
+        """发布一张图片, 返回 (digest, url)。"""
+        digest = image_digest(png)
+        if self.store is None:
+            return digest, await self.uploader.upload(digest, png)
+        url = await self.store.save(digest, png)
+        if self.uploader is not None:
+            self._mirror(digest, png)
+        return digest, url
+
+    def _mirror(self, digest: str, png: bytes) -> None:
+        if digest in self.mirror_urls or digest in self._mirror_tasks:
+            return
+        # 使用空的上下文: 后台镜像不受触发它的工具调用的时间预算限制
+        task = asyncio.get_running_loop().create_task(self._run_mirror(digest, png), context=contextvars.Context())
+        self._mirror_tasks[digest] = task
+        task.add_done_callback(lambda _: self._mirror_tasks.pop(digest, None))
+
+    async def _run_mirror(self, digest: str, png: bytes) -> None:
+        try:
+            self.mirror_urls[digest] = await self.uploader.upload(digest, png)
+        except ImageSinkError as e:
+            print(f"图片 {digest[:12]} 镜像到 imgbb 失败: {e.error}: {e.details}")
+
+
+def create_image_sink(app, default_base_url: str, mode: str = IMAGE_SINK) -> ImageSink:
+    """根据模式创建图片发布后端; 启用本地存储时在 app 上注册 /images/{digest}.png 路由。"""
+    if mode not in ("local", "imgbb", "local+imgbb"):
+        raise ValueError(f"Unknown IMAGE_SINK: {mode!r} (expected local, imgbb or local+imgbb)")
+    store = None
+    if mode.startswith("local"):
+        store = LocalImageStore(IMAGE_STORE_DIR, IMAGE_PUBLIC_BASE_URL or default_base_url)
+        app.custom_route("/images/{digest}.png", methods=["GET"], include_in_schema=False)(store.serve)
+    uploader = ImgbbUploader() if mode.endswith("imgbb") else None
+    return ImageSink(mode, store, uploader)
@@ -2,21 +2,29 @@
 # img_upload_server.py
 import os
 import json
-import base64
-import httpx
-import traceback
-import io
 import re
-from mcp.server import FastMCP
+import asyncio
+from typing import Awaitable, Callable
 from dotenv import load_dotenv
+from compass_client import serve_sse, SingleFlight
+import compass_json
+from compass_metrics import InstrumentedFastMCP, registry, timed
+from plot_renderer import render_pool, RenderError, render_cache, render_cache_key, chart_cache_key, RENDER_CACHE_TTL
+from chart_specs import validate_spec, load_items, build_figure, figure_summary, ChartSpecError
+from compass_bulk import CompassDataError
+from image_sinks import create_image_sink, ImageSinkError, IMAGE_SINK
 
 # --- 依赖库 ---
 # 运行此服务前, 请确保已安装以下库:
 # pip install python-dotenv httpx matplotlib numpy
+# 绘图在 plot_renderer.py 管理的预热进程池中执行, matplotlib 只在 worker 进程中导入;
+# 声明式图表的数据聚合 (chart_specs.py) 在服务进程中用 numpy 完成
 
 # --- 配置 ---
 HOST = '0.0.0.0'
 PORT = 8004
+# 批量绘图工具单次调用允许的最大图片数
+BATCH_MAX_FIGURES = int(os.getenv("PLOT_BATCH_MAX_FIGURES", "32"))
 
 # --- 初始化 ---
 
@@ -26,12 +34,29 @@ dotenv_path = os.path.join(script_dir, '.env')
 load_dotenv(dotenv_path=dotenv_path)
 
 # 初始化 FastMCP 服务器
-app = FastMCP(
+app = InstrumentedFastMCP(
     'python_plotting_tool',
     host=HOST,
     port=PORT
 )
 
+# 图片发布后端 (本地存储 / imgbb / 两者), 本地存储的图片由本服务的 /images/ 路由提供
+image_sink = create_image_sink(app, default_base_url=f"http://{'127.0.0.1' if HOST == '0.0.0.0' else HOST}:{PORT}")
+
+@registry.collector
+def _collect_render_metrics():
+    """抓取时读取渲染进程池的占用与渲染缓存的命中情况 (plot_renderer 也会被 worker 进程导入, 因此不在那里注册)。"""
+    return [
+        ("compass_render_workers", "gauge", "Render worker processes.", (), [((), render_pool.workers)]),
+        ("compass_render_inflight", "gauge", "Renders currently running in a worker.", (), [((), render_pool.inflight)]),
+        ("compass_render_cancelled_total", "counter", "Renders abandoned by their caller (disconnect or deadline).", (), [((), render_pool.cancelled)]),
+        ("compass_cache_requests_total", "counter", "Render cache lookups by result.", ("cache", "result"),
+         [(("render", "hit"), render_cache.hits), (("render", "miss"), render_cache.misses)]),
+    ]
+
+# 进程级资源的启动/关闭钩子, 独立运行与在 compass_server.py 中合并运行时都会挂到应用生命周期上
+lifespans = [render_pool.lifespan]
+
 # --- 辅助函数 ---
 def remove_safe_imports(code: str) -> str:
     """
@@ -46,12 +71,65 @@ def remove_safe_imports(code: str) -> str:
         code = re.sub(pattern, "", code, flags=re.MULTILINE)
     return code
 
+def preprocess_code(python_code: str) -> str:
+    """预处理用户代码: 移除安全导入, 并禁用代码中的 show() 和 savefig() (图片由服务统一保存)。"""
+    processed_code = remove_safe_imports(python_code)
+    processed_code = processed_code.replace("plt.show()", "")
+    processed_code = re.sub(r"plt\.savefig\s*\(.*\)", "", processed_code)
+    return processed_code
+
+# 合并同一时刻提交的相同绘图任务, 只渲染一次
+inflight_renders = SingleFlight()
+
+def _plot_result(entry: dict) -> dict:
+    """构造成功结果; local+imgbb 模式下后台镜像完成后附带 mirror_url。"""
+    result = {"status": 200, "url": entry["url"]}
+    mirror_url = image_sink.mirror_urls.get(entry["digest"])
+    if mirror_url:
+        result["mirror_url"] = mirror_url
+    return result
+
+async def _render_and_publish(cache_key: str, render: Callable[[], Awaitable[bytes]]) -> dict:
+    """按缓存键渲染 (或复用缓存) 并发布一张图, 返回结果字典 (成功时含 url, 失败时含 error/details), 不抛出异常。"""
+    # --- 渲染缓存 ---
+    # 相同的代码 (忽略注释/格式差异) 或相同的图表数据直接复用已渲染的图片和已上传的 URL
+    entry = render_cache.get(cache_key)
+    if entry is not None and entry["url"]:
+        return _plot_result(entry)
+
+    if entry is None:
+        # --- 渲染 ---
+        # 在预热的 worker 进程中隔离执行, 受 CPU 时间/内存/超时限制, 不阻塞事件循环
+        try:
+            with timed("render"):
+                image_data = await inflight_renders.do(cache_key, render)
+        except RenderError as e:
+            return {"status": e.status, "error": e.error, "details": e.details}
+        entry = {"png": image_data, "digest": None, "url": None}
+        render_cache.set(cache_key, entry, RENDER_CACHE_TTL, size=len(image_data))
+    image_data = entry["png"]
+
+    # --- 图片发布 ---
+    # 本地存储模式在 PNG 写入磁盘后立即返回; 远程上传以 multipart 原始字节发送
+    try:
+        with timed("publish"):
+            digest, image_url = await image_sink.publish(image_data)
+    except ImageSinkError as e:
+        return {"status": e.status, "error": e.error, "details": e.details}
+    entry["digest"], entry["url"] = digest, image_url
+    return _plot_result(entry)
+
+async def _generate_plot(python_code: str) -> dict:
+    """执行绘图代码并发布图片。"""
+    processed_code = preprocess_code(python_code)
+    return await _render_and_publish(render_cache_key(processed_code), lambda: render_pool.render(processed_code))
+
 # --- MCP 工具定义 ---
 
-@app.tool()
+@app.tool(structured_output=False)
 async def generate_plot_from_python(python_code: str) -> str:
     """
-    执行一段 Python 绘图代码 (使用 Matplotlib), 生成图片并上传到图床。
+    执行一段 Python 绘图代码 (使用 Matplotlib), 生成图片并发布到本地图片服务或图床。
 
     Args:
         python_code: 包含 Matplotlib 绘图逻辑的 Python 代码字符串。
@@ -59,93 +137,77 @@ async def generate_plot_from_python(python_code: str) -> str:
     Returns:
         一个 JSON 字符串，包含成功后的图片 URL 或失败后的错误信息。
     """
-    # --- 安全沙箱环境 ---
-    # 为了安全，我们只允许代码访问受限的库和函数
-    safe_globals = {
-        "__builtins__": {
-            "print": print, "range": range, "list": list, "dict": dict, "str": str,
-            "int": int, "float": float, "len": len, "abs": abs, "min": min, "max": max,
-            "sum": sum, "sorted": sorted, "enumerate": enumerate, "zip": zip,
-        },
-        "plt": None, # Matplotlib.pyplot
-        "np": None,  # Numpy
-    }
-
-    # 动态导入安全的库
-    try:
-        import matplotlib
-        matplotlib.use('Agg')  # 使用非交互式后端, 避免 GUI 错误
-        import matplotlib.pyplot as plt
-        import numpy as np
-        
-        # 解决中文显示问题：设置支持中文的字体
-        # 请确保您的服务器/容器已安装此字体 (例如: sudo apt-get install -y fonts-wqy-zenhei)
-        plt.rcParams['font.sans-serif'] = ['WenQuanYi Zen Hei']
-        plt.rcParams['axes.unicode_minus'] = False  # 解决保存图像是负号'-'显示为方块的问题
-
-        safe_globals["plt"] = plt
-        safe_globals["np"] = np
-    except ImportError as e:
-        return json.dumps({"status": 500, "error": "Server Environment Error", "details": f"Required library not found: {e}"})
-
-    image_buffer = io.BytesIO()
+    return json.dumps(await _generate_plot(python_code))
+
+
+@app.tool(structured_output=False)
+async def generate_plots_from_python(python_codes: list[str]) -> str:
+    """
+    批量执行多段 Python 绘图代码 (使用 Matplotlib), 在多个 worker 进程中并行渲染并同时发布。
+
+    整批的耗时取决于最慢的一张图, 而不是所有图的耗时之和; 单张图失败不影响其他图。
+
+    Args:
+        python_codes: 绘图代码字符串列表, 每段代码生成一张图。
+
+    Returns:
+        一个 JSON 字符串, results 与输入顺序一一对应, 每项包含图片 URL 或该图的错误信息。
+    """
+    if len(python_codes) > BATCH_MAX_FIGURES:
+        return json.dumps({"status": 400, "error": "Too Many Figures", "details": f"At most {BATCH_MAX_FIGURES} figures per call, got {len(python_codes)}."})
+    results = await asyncio.gather(*(_generate_plot(code) for code in python_codes))
+    failed = sum(1 for r in results if r["status"] != 200)
+    return json.dumps({"status": 200, "succeeded": len(results) - failed, "failed": failed, "results": results})
+
+
+@app.tool(structured_output=False)
+async def generate_chart_from_spec(spec: dict) -> str:
+    """
+    按声明式图表规格直接从 Compass 数据绘图, 数据由服务端获取 (复用缓存) 并聚合, 无需把数据写进绘图代码。
+
+    Args:
+        spec: 图表规格 (JSON 对象), 字段如下:
+            source: {"dataset", "label", "begin_date", "end_date"} 数据源。dataset 可选值:
+                contributor_milestone_persona, contributor_role_persona, contributor_domain_persona,
+                organizations_activity, project_activity, community_service_and_support,
+                collaboration_development_index, fork, pull_event, git_commit, issue, pull_request,
+                repo, stargazer, watch, releases, github_event, github_repo_event。
+            chart: line (默认) / bar / stacked_bar / scatter / hist / pie。
+            x: 横轴字段; 配合 bucket 时为日期字段 (YYYY-MM-DD 开头的字符串)。
+            y: 数值字段; 省略时统计条目数。
+            aggregate: count / sum / mean / min / max / median, 有 y 时默认 sum, 否则 count。
+            bucket: day / week / month / year, 按时间分桶 (缺失的时间桶补齐)。
+            group_by: 分组字段, 每组一条序列, 只保留总量最大的 top_n 组 (默认 10)。
+            bins: hist 的分箱数 (默认 20)。
+            title / xlabel / ylabel: 标题与坐标轴名称。
+            例: {"source": {"dataset": "git_commit", "label": "https://github.com/oss-compass/compass-web-service",
+                 "begin_date": "2024-01-01", "end_date": "2024-12-31"},
+                 "chart": "stacked_bar", "x": "grimoire_creation_date", "bucket": "month",
+                 "y": "lines_added", "group_by": "author_org_name", "top_n": 5}
 
+    Returns:
+        一个 JSON 字符串, 包含图片 URL 与所绘数据的摘要 (点数、序列名、横轴范围), 或错误信息。
+    """
     try:
-        # --- 代码执行 ---
-        # 预处理用户代码: 移除安全导入和不必要的函数调用
-        processed_code = remove_safe_imports(python_code)
-        # 禁用用户代码中的 show() 和 savefig()
-        processed_code = processed_code.replace("plt.show()", "")
-        processed_code = re.sub(r"plt\.savefig\s*\(.*\)", "", processed_code)
-        
-        # 在安全环境中执行用户的绘图逻辑
-        exec(processed_code, safe_globals, {})
-
-        # 在代码执行后，由服务显式保存内存中的当前图表
-        plt.savefig(image_buffer, format='png', dpi=150, bbox_inches='tight')
-
-        plt.close('all') # 执行后关闭所有图形，释放内存
-
-        image_buffer.seek(0)
-        image_data = image_buffer.read()
-
-        if not image_data:
-            raise ValueError("The executed Python code did not generate an image. This might be due to a rendering issue (e.g., fonts not found).")
-
-    except Exception:
-        error_details = traceback.format_exc()
-        plt.close('all') # 确保即使出错也关闭图形
-        return json.dumps({"status": 500, "error": "Python Code Execution Error", "details": error_details})
-    
-    finally:
-        image_buffer.close()
-
-    # --- 图片上传 ---
-    api_key = os.getenv("IMGBB_API_KEY")
-    if not api_key:
-        return json.dumps({"status": 401, "error": "Configuration Error", "details": "IMGBB_API_KEY not found in .env file."})
-
-    upload_url = "https://api.imgbb.com/1/upload"
-    payload = {"key": api_key, "image": base64.b64encode(image_data).decode('utf-8')}
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(upload_url, data=payload, timeout=30.0)
-            response.raise_for_status()
-            result = response.json()
-            if result.get("success"):
-                image_url = result["data"]["url"]
-                return json.dumps({"status": 200, "url": image_url})
-            else:
-                error_message = result.get("error", {}).get("message", "Unknown upload error")
-                return json.dumps({"status": 500, "error": "Image Upload Failed", "details": error_message})
-        except httpx.RequestError as e:
-            return json.dumps({"status": 500, "error": "Network Error", "details": f"Failed to connect to image host: {e}"})
+        normalized = validate_spec(spec)
+        items = await load_items(normalized["source"])
+        # 大数据集的分组聚合放到线程中执行, 不阻塞事件循环
+        figure = await asyncio.to_thread(build_figure, normalized, items)
+    except ChartSpecError as e:
+        return json.dumps({"status": 400, "error": "Invalid Chart Spec", "details": str(e)})
+    except CompassDataError as e:
+        return json.dumps({"status": 502, "error": "Data Source Error", "details": e.details})
+    result = await _render_and_publish(chart_cache_key(figure), lambda: render_pool.render_chart(figure))
+    if result["status"] == 200:
+        result["summary"] = figure_summary(figure)
+    return compass_json.dumps(result)
 
 
 if __name__ == "__main__":
     print("MCP server for Python plotting is running...")
     print(f"Listening on http://{HOST}:{PORT}")
-    print("Ensure your .env file contains: IMGBB_API_KEY='your_api_key_here'")
-    app.run(transport='sse')
+    print(f"Image sink: {IMAGE_SINK}")
+    if IMAGE_SINK.endswith("imgbb"):
+        print("Ensure your .env file contains: IMGBB_API_KEY='your_api_key_here'")
+    serve_sse(app, lifespans=lifespans)
 
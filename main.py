@@ -2,19 +2,41 @@
 
 import os
 import json
+import codecs
+import time
 import asyncio
 from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
 
-import requests
+import httpx
 import uvicorn
 from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
+from compass_client import get_client, lifespan
+from compass_metrics import (
+    CONTENT_TYPE, UPSTREAM_REQUESTS, record_tool_call, registry, upstream_outcome,
+)
+from compass_deadline import TOOL_DEADLINE, DeadlineExceeded, budget, iterate_within
 
 # 加载环境变量
 load_dotenv()
 
+# SSE 心跳间隔 (秒): 只在空闲时按此间隔发送注释行, 避免代理/客户端判定连接超时
+HEARTBEAT_INTERVAL = float(os.getenv("MCP_HEARTBEAT_INTERVAL", "15"))
+# 连接在没有任何业务事件后保留的最长时间 (秒), 超时后服务端主动关闭以回收资源; 0 表示不回收
+IDLE_TIMEOUT = float(os.getenv("MCP_IDLE_TIMEOUT", "300"))
+# 工具结果的发送方式: single 表示只发送一个 tool_result 事件 (原有协议); stream 表示边解析上游响应边分批发送 tool_result_chunk 事件
+# 请求体中的 "stream": true/false 可以覆盖该默认值
+RESULT_MODE = os.getenv("MCP_RESULT_MODE", "single")
+# stream 模式下每个 tool_result_chunk 事件包含的条目数
+STREAM_BATCH_SIZE = int(os.getenv("MCP_STREAM_BATCH_SIZE", "100"))
+# 上游接口的超时 (秒), 实际超时不超过工具调用剩余的时间预算 (COMPASS_TOOL_DEADLINE)
+PERSONA_TIMEOUT = 60.0
+# 贡献者里程碑画像接口 (可指向本地模拟服务做压测, 见 benchmarks/mock_compass.py)
+PERSONA_API_URL = os.getenv("OSS_COMPASS_PERSONA_URL", "https://oss-compass.org/api/v2/metricModel/contributorMilestonePersona")
+
 # 1. 定义我们工具的元数据 (描述信息)
 TOOL_METADATA = {
     "name": "get_contributor_milestone_persona",
@@ -31,14 +53,109 @@ TOOL_METADATA = {
     }
 }
 
-# 2. 我们的核心业务逻辑
-def get_contributor_persona_logic(repo_url: str) -> dict:
+# 2. 我们的核心业务逻辑 (异步实现, 复用共享连接池, 不会阻塞事件循环上的其他 SSE 连接)
+class UpstreamError(Exception):
+    """调用 OSS-Compass 失败, 消息可直接作为 tool_error 返回给客户端。"""
+
+
+class ItemsArrayParser:
+    """
+    增量解析上游响应中的顶层 items 数组, 逐个返回条目的原始 JSON 文本。
+
+    条目只用于定位边界, 不会被反序列化后再次序列化; 返回前去掉字符串外的换行
+    (合法 JSON 的字符串内不会出现未转义的换行), 以便直接放进单行的 SSE data 字段。
+    定位 items 时跟踪嵌套深度与字符串状态, 只认顶层对象的键, 嵌套对象中的同名键不会被误认。
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self.found = False
+        self.done = False
+        # 定位顶层 items 之前的扫描状态
+        self._scan = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._key: Optional[str] = None
+        self._after_colon = False
+
+    def _find_items(self) -> bool:
+        """从上次停下的位置继续扫描, 找到顶层的 "items": [ 时丢弃它之前的内容并返回 True。"""
+        buffer = self._buffer
+        for pos in range(self._scan, len(buffer)):
+            char = buffer[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._key = buffer[self._string_start + 1:pos]
+                        self._after_colon = False
+            elif char == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif char == ":":
+                self._after_colon = self._depth == 1 and self._key is not None
+            elif char == "[" and self._depth == 1 and self._after_colon and self._key == "items":
+                self._buffer = buffer[pos + 1:]
+                return True
+            elif char in "{[":
+                self._depth += 1
+                self._key, self._after_colon = None, False
+            elif char in "}]":
+                self._depth -= 1
+                self._key, self._after_colon = None, False
+            elif char == ",":
+                self._key, self._after_colon = None, False
+        self._scan = len(buffer)
+        return False
+
+    def feed(self, chunk: bytes, final: bool = False) -> list[str]:
+        self._buffer += self._decoder.decode(chunk, final)
+        if not self.found:
+            if not self._find_items():
+                return []
+            self.found = True
+
+        items = []
+        buffer, pos = self._buffer, 0
+        while not self.done:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == "]":
+                self.done = True
+                break
+            try:
+                _, end = self._json.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                break
+            if end == len(buffer) and not final:
+                # 数字等标量可能被数据块截断, 等下一块到达后再确认
+                break
+            items.append(buffer[pos:end].replace("\n", "").replace("\r", ""))
+            pos = end
+        self._buffer = buffer[pos:]
+        return items
+
+
+async def stream_contributor_persona(repo_url: str) -> AsyncIterator[list[str]]:
+    """流式获取贡献者里程画像, 每次产出最多 STREAM_BATCH_SIZE 个条目的原始 JSON 文本。"""
     access_token = os.getenv("OSS_COMPASS_ACCESS_TOKEN")
     if not access_token:
-        return {"error": "错误：服务器环境变量 'OSS_COMPASS_ACCESS_TOKEN' 未设置。"}
-    
-    # ... (API 调用代码保持不变) ...
-    api_url = "https://oss-compass.org/api/v2/metricModel/contributorMilestonePersona"
+        raise UpstreamError("错误：服务器环境变量 'OSS_COMPASS_ACCESS_TOKEN' 未设置。")
+
+    api_url = PERSONA_API_URL
+    host = httpx.URL(api_url).host
     end_date = datetime.now().strftime('%Y-%m-%d')
     begin_date = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-%d')
     payload = {
@@ -48,15 +165,33 @@ def get_contributor_persona_logic(repo_url: str) -> dict:
     }
     headers = {"Content-Type": "application/json"}
     try:
-        response = requests.post(api_url, headers=headers, json=payload, timeout=60)
-        response.raise_for_status()
-        items = response.json().get('items', [])
-        return {"result": items}
-    except requests.exceptions.RequestException as e:
-        return {"error": f"错误：调用API失败 - {str(e)}"}
+        async with get_client().stream("POST", api_url, headers=headers, json=payload, timeout=budget(PERSONA_TIMEOUT)) as response:
+            UPSTREAM_REQUESTS.inc((host, upstream_outcome(response.status_code)))
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            parser = ItemsArrayParser()
+            batch = []
+            async for chunk in response.aiter_bytes():
+                for item in parser.feed(chunk):
+                    batch.append(item)
+                    if len(batch) >= STREAM_BATCH_SIZE:
+                        yield batch
+                        batch = []
+            batch.extend(parser.feed(b"", final=True))
+            if not parser.found:
+                raise UpstreamError("错误：API 响应中缺少 items 字段。")
+            if batch:
+                yield batch
+    except httpx.HTTPError as e:
+        if not isinstance(e, httpx.HTTPStatusError):
+            UPSTREAM_REQUESTS.inc((host, upstream_outcome(error=e)))
+        raise UpstreamError(f"错误：调用API失败 - {str(e)}") from e
+    except json.JSONDecodeError as e:
+        raise UpstreamError(f"错误：解析API响应失败 - {str(e)}") from e
 
-# 3. 创建我们自己的 FastAPI 应用
-app = FastAPI(title="Reliable MCP Server")
+# 3. 创建我们自己的 FastAPI 应用 (生命周期内持有共享连接池)
+app = FastAPI(title="Reliable MCP Server", lifespan=lifespan)
 
 # 4. 配置CORS
 app.add_middleware(
@@ -68,52 +203,104 @@ app.add_middleware(
 )
 
 # 5. 实现健壮的 MCP over SSE 端点
-async def mcp_event_stream(request: Request):
+async def mcp_event_stream(body_bytes: bytes):
     # 步骤 A: 客户端一连接，立刻发送工具元数据
     yield f"event: tool_metadata\ndata: {json.dumps(TOOL_METADATA)}\n\n"
     print("已发送 tool_metadata。")
 
-    # 步骤 B: 检查初始请求是不是 POST。如果是，说明 Langflow 要运行工具。
-    if request.method == "POST":
+    # 步骤 B: 请求体非空说明 Langflow 要运行工具。
+    if body_bytes:
+        tool_started = None
         try:
-            body_bytes = await request.body()
-            if body_bytes:
-                run_request = json.loads(body_bytes.decode('utf-8'))
-                
-                # 确认是运行我们的工具
-                if run_request.get("name") == TOOL_METADATA["name"]:
-                    params = run_request.get("parameters", {})
-                    repo_url = params.get("repo_url")
-                    
-                    print(f"--- 接收到 tool_run 请求，参数: {params} ---")
-                    result_data = get_contributor_persona_logic(repo_url=repo_url)
-                    
-                    # 准备并发送 tool_result 或 tool_error
-                    if "error" in result_data:
-                        event_type, payload = "tool_error", {"error": result_data["error"]}
-                    else:
-                        event_type, payload = "tool_result", {"result": json.dumps(result_data["result"], indent=2, ensure_ascii=False)}
-                    
-                    yield f"event: {event_type}\ndata: {json.dumps(payload)}\n\n"
-                    print(f"已发送 {event_type}。")
+            run_request = json.loads(body_bytes.decode('utf-8'))
+
+            # 确认是运行我们的工具
+            if run_request.get("name") == TOOL_METADATA["name"]:
+                params = run_request.get("parameters", {})
+                repo_url = params.get("repo_url")
+                streaming = run_request.get("stream", RESULT_MODE == "stream")
+
+                print(f"--- 接收到 tool_run 请求，参数: {params} ---")
+                tool_started = time.perf_counter()
+                # 整个工具调用受时间预算约束, 到期时关闭上游连接并返回 tool_error
+                upstream = iterate_within(stream_contributor_persona(repo_url), TOOL_DEADLINE)
+                if streaming:
+                    # 上游响应还在解析时就分批发送, 内存占用与首字节时间都不随结果规模增长
+                    batches = count = 0
+                    async for batch in upstream:
+                        yield f'event: tool_result_chunk\ndata: {{"batch": {batches}, "items": [{",".join(batch)}]}}\n\n'
+                        batches += 1
+                        count += len(batch)
+                    yield f"event: tool_result_end\ndata: {json.dumps({'batches': batches, 'count': count})}\n\n"
+                    record_tool_call(TOOL_METADATA["name"], time.perf_counter() - tool_started, "ok")
+                    print(f"已发送 {batches} 个 tool_result_chunk。")
+                else:
+                    items = []
+                    async for batch in upstream:
+                        items.extend(batch)
+                    event = f'event: tool_result\ndata: {{"result": [{",".join(items)}]}}\n\n'
+                    record_tool_call(TOOL_METADATA["name"], time.perf_counter() - tool_started, "ok", len(event.encode()))
+                    yield event
+                    print("已发送 tool_result。")
+        except UpstreamError as e:
+            if tool_started is not None:
+                record_tool_call(TOOL_METADATA["name"], time.perf_counter() - tool_started, "upstream_error")
+            yield f"event: tool_error\ndata: {json.dumps({'error': str(e)})}\n\n"
+            print(f"已发送 tool_error: {e}")
+        except DeadlineExceeded as e:
+            record_tool_call(TOOL_METADATA["name"], time.perf_counter() - tool_started, "deadline_exceeded")
+            yield f"event: tool_error\ndata: {json.dumps({'error': f'错误：调用超时 - {e}'})}\n\n"
+            print(f"已发送 tool_error: {e}")
+        except asyncio.CancelledError:
+            # 客户端在工具运行期间断开: 生成器被取消, 上游连接随之关闭
+            if tool_started is not None:
+                record_tool_call(TOOL_METADATA["name"], time.perf_counter() - tool_started, "cancelled")
+            raise
         except Exception as e:
+            if tool_started is not None:
+                record_tool_call(TOOL_METADATA["name"], time.perf_counter() - tool_started, "exception")
             yield f"event: tool_error\ndata: {json.dumps({'error': str(e)})}\n\n"
             print(f"处理 POST 请求时发生错误: {e}")
-    
-    # 步骤 C: 对于所有连接 (包括 GET 和 完成了 POST 的)，保持心跳直到客户端断开
+
+    # 步骤 C: 保持连接直到客户端断开。只在心跳间隔到期时唤醒一次并发送 SSE 注释行,
+    # 连接空闲超过 IDLE_TIMEOUT 后由服务端主动关闭, 防止僵尸连接长期占用资源。
+    # 客户端断开时 Starlette 会取消这个生成器。
+    loop = asyncio.get_running_loop()
+    idle_deadline = loop.time() + IDLE_TIMEOUT if IDLE_TIMEOUT > 0 else None
     try:
         while True:
-            await asyncio.sleep(1) # 保持连接
+            timeout = HEARTBEAT_INTERVAL
+            if idle_deadline is not None:
+                remaining = idle_deadline - loop.time()
+                if remaining <= 0:
+                    yield "event: close\ndata: {\"reason\": \"idle_timeout\"}\n\n"
+                    return
+                timeout = min(timeout, remaining)
+            await asyncio.sleep(timeout)
+            if idle_deadline is None or loop.time() < idle_deadline:
+                yield ": ping\n\n"
     except asyncio.CancelledError:
         # 当客户端断开连接时，FastAPI/Uvicorn 会取消这个任务
         print("客户端断开连接，数据流正常关闭。")
-        
+        raise
+
 
 @app.get("/mcp", tags=["MCP"])
 @app.post("/mcp", tags=["MCP"])
 async def mcp_endpoint(request: Request):
     # 这个端点是 Langflow 连接的目标
-    return StreamingResponse(mcp_event_stream(request), media_type="text/event-stream")
+    # 请求体必须在开始流式响应之前读取: 响应开始后 Starlette 会并发监听断开事件, 与读取请求体争用 receive 通道
+    body_bytes = await request.body() if request.method == "POST" else b""
+    return StreamingResponse(
+        mcp_event_stream(body_bytes),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    # Prometheus 抓取端点 (与各 FastMCP 工具服务共用 compass_metrics 的进程级注册表)
+    return Response(registry.render(), media_type=CONTENT_TYPE)
 
 # mcp: 127.0.0.1
 # 0.0.0.0
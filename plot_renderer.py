@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+# plot_renderer.py
+# 预热的绘图进程池: 每个 worker 启动时导入 matplotlib 并加载字体缓存,
+# 每次渲染都在 worker 中隔离执行, 受 CPU 时间、内存和墙钟超时限制, 不会阻塞服务的事件循环。
+
+import os
+import io
+import ast
+import json
+import time
+import hashlib
+import signal
+import asyncio
+import resource
+import traceback
+import contextlib
+import multiprocessing
+from compass_cache import ResponseCache
+from compass_tracing import span
+from compass_deadline import budget
+
+# --- 配置 ---
+# worker 进程数, 默认与 CPU 核数相同
+RENDER_WORKERS = int(os.getenv("PLOT_RENDER_WORKERS", str(os.cpu_count() or 2)))
+# 单次渲染的墙钟超时 (秒)
+RENDER_TIMEOUT = float(os.getenv("PLOT_RENDER_TIMEOUT", "30"))
+# 单次渲染可用的 CPU 时间 (秒)
+RENDER_CPU_SECONDS = int(os.getenv("PLOT_RENDER_CPU_SECONDS", "20"))
+# 每个 worker 的地址空间上限 (MB), 0 表示不限制
+RENDER_MEMORY_MB = int(os.getenv("PLOT_RENDER_MEMORY_MB", "2048"))
+# 进程启动方式; spawn 不会继承父进程的事件循环与线程状态
+RENDER_START_METHOD = os.getenv("PLOT_RENDER_START_METHOD", "spawn")
+# 渲染结果缓存的内存上限 (字节) 与保留时间 (秒), 上限设为 0 可关闭缓存
+RENDER_CACHE_MAX_BYTES = int(os.getenv("PLOT_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+RENDER_CACHE_TTL = float(os.getenv("PLOT_CACHE_TTL", str(7 * 86400)))
+# 超时 (或调用方离开) 后等待 worker 自行中断的宽限时间 (秒), 之后强制结束该 worker
+_KILL_GRACE = 5.0
+# 等待新 worker 完成预热的最长时间 (秒)
+_START_TIMEOUT = 60.0
+
+DEFAULT_DPI = 150
+FONT_FAMILY = ['WenQuanYi Zen Hei']
+# 影响输出图片的固定渲染参数, 修改后旧的缓存键自动失效
+RENDER_SETTINGS = f"png|bbox=tight|font={','.join(FONT_FAMILY)}|unicode_minus=False"
+
+
+class RenderError(Exception):
+    """渲染失败; error 与 details 对应工具返回的 JSON 字段。"""
+
+    def __init__(self, error: str, details: str, status: int = 500):
+        super().__init__(details)
+        self.error = error
+        self.details = details
+        self.status = status
+
+
+class _JobInterrupted(BaseException):
+    """worker 内部用于打断用户代码的信号异常 (继承 BaseException, 用户代码里的 except Exception 拦不住)。"""
+
+
+# --- worker 进程内执行的部分 ---
+
+_plt = None
+_np = None
+# 服务进程要求中断的任务编号 (每个 worker 一个共享整数) 与本 worker 正在执行的任务编号
+_cancel_target = None
+_current_job = 0
+
+
+def _interrupt(signum, frame):
+    reason = "CPU time limit exceeded" if signum == signal.SIGXCPU else "Wall-clock time limit exceeded"
+    raise _JobInterrupted(reason)
+
+
+def _cancel_requested(signum, frame):
+    # 核对任务编号: 信号晚到 (任务已结束) 时不会打断之后的任务
+    if _current_job and _cancel_target is not None and _cancel_target.value == _current_job:
+        raise _JobInterrupted("Cancelled: the caller went away or ran out of its time budget")
+
+
+def _init_worker(memory_mb: int, cancel_target=None) -> None:
+    """worker 初始化: 导入绘图库, 设置中文字体并预热字体缓存与 Agg 后端。"""
+    global _plt, _np, _cancel_target
+    # 每个 worker 只做单线程渲染, 避免 BLAS 线程池预留大量内存
+    os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+    import matplotlib
+    matplotlib.use('Agg')  # 使用非交互式后端, 避免 GUI 错误
+    import matplotlib.pyplot as plt
+    import numpy as np
+    from matplotlib import font_manager
+
+    # 解决中文显示问题：设置支持中文的字体
+    # 请确保您的服务器/容器已安装此字体 (例如: sudo apt-get install -y fonts-wqy-zenhei)
+    plt.rcParams['font.sans-serif'] = FONT_FAMILY
+    plt.rcParams['axes.unicode_minus'] = False  # 解决保存图像是负号'-'显示为方块的问题
+
+    # 预热: 加载字体缓存并完整渲染一次, 让首个真实请求不再承担这部分开销
+    font_manager.findfont(font_manager.FontProperties(family=plt.rcParams['font.sans-serif']))
+    figure = plt.figure()
+    plt.plot([0, 1], [0, 1])
+    figure.savefig(io.BytesIO(), format='png')
+    plt.close('all')
+
+    _plt, _np = plt, np
+    signal.signal(signal.SIGXCPU, _interrupt)
+    signal.signal(signal.SIGALRM, _interrupt)
+    signal.signal(signal.SIGUSR1, _cancel_requested)
+    _cancel_target = cancel_target
+    if memory_mb > 0:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+
+
+def _worker_main(conn, memory_mb: int, cancel_target) -> None:
+    """worker 进程入口: 预热后逐个接收 (任务编号, 任务函数, 参数) 并回传结果, 收到 None 或管道关闭时退出。"""
+    _init_worker(memory_mb, cancel_target)
+    conn.send(os.getpid())
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        job_id, job, args = message
+        try:
+            result = job(*args, job_id)
+        except (Exception, _JobInterrupted) as e:
+            result = ("error", ("Render Worker Error", repr(e)))
+        conn.send(result)
+
+
+@contextlib.contextmanager
+def _job_limits(cpu_seconds: int, wall_seconds: float):
+    """为当前任务设置 CPU 时间 (在已用时间基础上累加) 与墙钟闹钟, 结束后恢复。"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime) + 1
+    if cpu_seconds > 0:
+        new_soft = used + cpu_seconds
+        if hard != resource.RLIM_INFINITY:
+            new_soft = min(new_soft, hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (new_soft, hard))
+    signal.setitimer(signal.ITIMER_REAL, max(wall_seconds, 0.001))
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _safe_globals() -> dict:
+    # --- 安全沙箱环境 ---
+    # 为了安全，我们只允许代码访问受限的库和函数
+    return {
+        "__builtins__": {
+            "print": print, "range": range, "list": list, "dict": dict, "str": str,
+            "int": int, "float": float, "len": len, "abs": abs, "min": min, "max": max,
+            "sum": sum, "sorted": sorted, "enumerate": enumerate, "zip": zip,
+        },
+        "plt": _plt,  # Matplotlib.pyplot
+        "np": _np,    # Numpy
+    }
+
+
+def _run_job(draw, dpi: int, cpu_seconds: int, wall_seconds: float, error_label: str, job_id: int = 0) -> tuple[str, object]:
+    """
+    在 worker 中执行 draw() 并把当前图表保存为 PNG 字节。
+
+    返回 ("ok", (png_bytes, 各步骤耗时)) 或 ("error", (error, details)), 异常不会跨进程抛出。
+    """
+    global _current_job
+    image_buffer = io.BytesIO()
+    started = time.perf_counter()
+    try:
+        _current_job = job_id
+        with _job_limits(cpu_seconds, wall_seconds):
+            _plt.close('all')
+            # rc_context 保证对 rcParams 的修改不会泄漏到后续任务
+            with _plt.rc_context():
+                draw()
+                drawn = time.perf_counter()
+                # 绘制完成后，由服务显式保存内存中的当前图表
+                _plt.savefig(image_buffer, format='png', dpi=dpi, bbox_inches='tight')
+        image_data = image_buffer.getvalue()
+        if not image_data:
+            raise ValueError("The executed Python code did not generate an image. This might be due to a rendering issue (e.g., fonts not found).")
+        timings = {
+            "worker_pid": os.getpid(),
+            "draw_ms": round((drawn - started) * 1000, 3),
+            "savefig_ms": round((time.perf_counter() - drawn) * 1000, 3),
+        }
+        return "ok", (image_data, timings)
+    except _JobInterrupted as e:
+        return "error", ("Render Limit Exceeded", str(e))
+    except MemoryError:
+        return "error", ("Render Limit Exceeded", "Memory limit exceeded")
+    except Exception:
+        return "error", (error_label, traceback.format_exc())
+    finally:
+        _current_job = 0
+        _plt.close('all')  # 执行后关闭所有图形，释放内存
+        image_buffer.close()
+
+
+def _render_job(processed_code: str, dpi: int, cpu_seconds: int, wall_seconds: float, job_id: int = 0) -> tuple[str, object]:
+    """在 worker 中执行用户的绘图代码。"""
+    return _run_job(
+        lambda: exec(processed_code, _safe_globals(), {}),
+        dpi, cpu_seconds, wall_seconds, "Python Code Execution Error", job_id,
+    )
+
+
+def _draw_chart(figure: dict) -> None:
+    """按 chart_specs.build_figure 生成的 figure 字典绘图, 不执行任何用户代码。"""
+    chart, series = figure["chart"], figure["series"]
+    fig, ax = _plt.subplots(figsize=(10, 5))
+    x = figure["x"]
+    if figure.get("x_is_date"):
+        x = _np.array(x, dtype="datetime64[D]")
+
+    if chart == "line":
+        for s in series:
+            ax.plot(x, _np.array(s["values"], dtype=float), label=s["name"], marker="o" if len(x) <= 40 else None)
+    elif chart in ("bar", "stacked_bar"):
+        positions = _np.arange(len(x))
+        if chart == "stacked_bar":
+            bottom = _np.zeros(len(x))
+            for s in series:
+                values = _np.nan_to_num(_np.array(s["values"], dtype=float))
+                ax.bar(positions, values, bottom=bottom, label=s["name"])
+                bottom += values
+        else:
+            width = 0.8 / len(series)
+            for i, s in enumerate(series):
+                values = _np.nan_to_num(_np.array(s["values"], dtype=float))
+                ax.bar(positions + (i - (len(series) - 1) / 2) * width, values, width=width, label=s["name"])
+        labels = figure["x"]
+        step = max(1, len(labels) // 30)
+        ax.set_xticks(positions[::step])
+        ax.set_xticklabels(labels[::step], rotation=45, ha="right")
+    elif chart == "scatter":
+        ax.scatter(x, series[0]["values"], s=8, alpha=0.6)
+    elif chart == "hist":
+        edges = _np.array(x, dtype=float)
+        ax.bar(edges[:-1], series[0]["values"], width=_np.diff(edges), align="edge", edgecolor="white")
+    elif chart == "pie":
+        values = _np.nan_to_num(_np.array(series[0]["values"], dtype=float))
+        ax.pie(values, labels=figure["x"], autopct="%1.1f%%", startangle=90)
+        ax.axis("equal")
+
+    if chart != "pie":
+        ax.set_xlabel(figure.get("xlabel", ""))
+        ax.set_ylabel(figure.get("ylabel", ""))
+        ax.grid(alpha=0.3)
+    if len(series) > 1:
+        ax.legend()
+    if figure.get("title"):
+        ax.set_title(figure["title"])
+    if figure.get("x_is_date"):
+        fig.autofmt_xdate()
+
+
+def _render_chart_job(figure: dict, dpi: int, cpu_seconds: int, wall_seconds: float, job_id: int = 0) -> tuple[str, object]:
+    """在 worker 中按 figure 字典绘制声明式图表。"""
+    return _run_job(lambda: _draw_chart(figure), dpi, cpu_seconds, wall_seconds, "Chart Render Error", job_id)
+
+
+# --- 服务进程内使用的部分 ---
+
+class _Worker:
+    """服务进程持有的一个渲染 worker: 进程、通信管道与用于请求中断的共享任务编号。"""
+
+    __slots__ = ("process", "conn", "cancel_target")
+
+    def __init__(self, context, memory_mb: int):
+        parent, child = context.Pipe()
+        self.cancel_target = context.RawValue("q", 0)
+        self.process = context.Process(target=_worker_main, args=(child, memory_mb, self.cancel_target), daemon=True)
+        self.process.start()
+        child.close()
+        self.conn = parent
+
+    async def receive(self) -> tuple[str, object]:
+        """等待管道可读后读取 worker 回传的结果 (不占用线程); worker 已退出时抛出 EOFError。"""
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        fd = self.conn.fileno()
+        loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await readable
+        finally:
+            loop.remove_reader(fd)
+        return self.conn.recv()
+
+    def interrupt(self, job_id: int) -> None:
+        """请求 worker 中断 job_id (worker 核对编号后打断用户代码并照常回传结果)。"""
+        self.cancel_target.value = job_id
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(self.process.pid, signal.SIGUSR1)
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.conn.close()
+        self.process.join(timeout=1)
+
+
+class RenderPool:
+    """
+    管理预热的渲染 worker 进程; 在事件循环中通过 await render(...) 提交任务。
+
+    每个 worker 同时只执行一个任务, 同时占用 worker 的渲染数不超过 worker 数, 多出的请求在服务进程内排队,
+    排队时间不计入渲染超时。worker 卡死时只结束这一个 worker, 其他 worker 上的渲染不受影响, 缺少的 worker 按需补齐。
+    """
+
+    def __init__(
+        self,
+        workers: int = RENDER_WORKERS,
+        timeout: float = RENDER_TIMEOUT,
+        cpu_seconds: int = RENDER_CPU_SECONDS,
+        memory_mb: int = RENDER_MEMORY_MB,
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self._context = multiprocessing.get_context(RENDER_START_METHOD)
+        self._workers: set[_Worker] = set()
+        self._idle: list[_Worker] = []
+        # 每个执行中 (或被放弃后等待收尾) 的任务占一个名额
+        self._slots = asyncio.Semaphore(workers)
+        self._draining: set[asyncio.Task] = set()
+        self._job_ids = 0
+        self.inflight = 0
+        self.cancelled = 0
+
+    def _spawn(self) -> _Worker:
+        """启动一个 worker 并等待其预热完成 (阻塞, 在线程中调用)。"""
+        worker = _Worker(self._context, self.memory_mb)
+        try:
+            if not worker.conn.poll(_START_TIMEOUT):
+                raise RenderError("Render Worker Crashed", f"Render worker did not start within {_START_TIMEOUT}s.")
+            worker.conn.recv()
+        except EOFError:
+            worker.kill()
+            raise RenderError("Render Worker Crashed", "Render worker exited during startup.")
+        except RenderError:
+            worker.kill()
+            raise
+        return worker
+
+    async def _start_worker(self) -> _Worker:
+        task = asyncio.ensure_future(asyncio.to_thread(self._spawn))
+        try:
+            worker = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # 调用方离开时 worker 仍在启动, 启动完成后收为空闲 worker
+            task.add_done_callback(self._adopt)
+            raise
+        self._workers.add(worker)
+        return worker
+
+    def _adopt(self, task: asyncio.Future) -> None:
+        if task.cancelled() or task.exception() is not None:
+            return
+        worker = task.result()
+        self._workers.add(worker)
+        self._checkin(worker)
+
+    async def start(self) -> None:
+        """拉起全部 worker 并等待预热完成。"""
+        missing = self.workers - len(self._workers)
+        self._idle.extend(await asyncio.gather(*(self._start_worker() for _ in range(missing))))
+
+    def shutdown(self) -> None:
+        for task in self._draining:
+            task.cancel()
+        for worker in self._workers:
+            worker.kill()
+        self._workers.clear()
+        self._idle.clear()
+
+    def _discard(self, worker: _Worker) -> None:
+        """强制结束一个 worker (卡死在 C 代码中、信号无法打断, 或已退出), 下次需要时再补齐。"""
+        self._workers.discard(worker)
+        worker.kill()
+
+    def _checkin(self, worker: _Worker) -> None:
+        """任务结束后放回空闲列表; 取消启动等情况下多出的 worker 直接结束, worker 总数回到上限以内。"""
+        if len(self._workers) > self.workers:
+            self._discard(worker)
+        else:
+            self._idle.append(worker)
+
+    def _drain(self, worker: _Worker, job_id: int) -> None:
+        """
+        调用方放弃了执行中的任务: 通知 worker 中断, 在后台读走它的结果后放回空闲列表并归还名额;
+        宽限期内没有结果时结束该 worker。
+        """
+        worker.interrupt(job_id)
+
+        async def drain() -> None:
+            try:
+                await asyncio.wait_for(worker.receive(), timeout=_KILL_GRACE)
+            except (asyncio.TimeoutError, EOFError, OSError):
+                self._discard(worker)
+            else:
+                self._checkin(worker)
+            finally:
+                self._slots.release()
+
+        task = asyncio.get_running_loop().create_task(drain())
+        self._draining.add(task)
+        task.add_done_callback(self._draining.discard)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self, _app):
+        """ASGI 生命周期钩子: 启动时预热 worker, 关闭时结束它们。"""
+        await self.start()
+        try:
+            yield
+        finally:
+            self.shutdown()
+
+    async def _submit(self, job, payload, dpi: int) -> bytes:
+        await self._slots.acquire()
+        worker, handed_off = None, False
+        try:
+            worker = self._idle.pop() if self._idle else await self._start_worker()
+            # 墙钟上限不超过调用剩余的时间预算; 从任务交给空闲 worker 时开始计时
+            wall_seconds = budget(self.timeout)
+            self._job_ids += 1
+            job_id = self._job_ids
+            self.inflight += 1
+            # worker 进程中的 span 无法跨进程传递, 由 worker 返回各步骤耗时记录在这个 span 上
+            with span("render.worker", job=job.__name__, inflight=self.inflight) as current:
+                try:
+                    worker.conn.send((job_id, job, (payload, dpi, self.cpu_seconds, wall_seconds)))
+                    status, result = await asyncio.wait_for(worker.receive(), timeout=wall_seconds + _KILL_GRACE)
+                except asyncio.TimeoutError:
+                    self._discard(worker)
+                    worker = None
+                    raise RenderError("Render Limit Exceeded", f"Render did not finish within {wall_seconds:.1f}s; its worker was terminated.", status=504)
+                except (EOFError, OSError) as e:
+                    self._discard(worker)
+                    worker = None
+                    raise RenderError("Render Worker Crashed", f"Render worker exited unexpectedly: {e!r}")
+                except asyncio.CancelledError:
+                    # 调用方已离开 (断开或超出时间预算): worker 中断任务后在后台收尾, 之后继续服务其他请求
+                    self.cancelled += 1
+                    self._drain(worker, job_id)
+                    worker, handed_off = None, True
+                    raise
+                finally:
+                    self.inflight -= 1
+                if status != "ok":
+                    error, details = result
+                    raise RenderError(error, details)
+                image_data, timings = result
+                for key, value in timings.items():
+                    current.set(key, value)
+            return image_data
+        finally:
+            if worker is not None:
+                self._checkin(worker)
+            if not handed_off:
+                self._slots.release()
+
+    async def render(self, processed_code: str, dpi: int = DEFAULT_DPI) -> bytes:
+        """在 worker 中渲染一张图, 成功返回 PNG 字节, 失败抛出 RenderError。"""
+        return await self._submit(_render_job, processed_code, dpi)
+
+    async def render_chart(self, figure: dict, dpi: int = DEFAULT_DPI) -> bytes:
+        """在 worker 中按 figure 字典 (见 chart_specs.build_figure) 绘制图表, 不执行用户代码。"""
+        return await self._submit(_render_chart_job, figure, dpi)
+
+
+# 进程内共享的渲染进程池
+render_pool = RenderPool()
+
+
+# --- 渲染结果缓存 ---
+
+def render_cache_key(processed_code: str, dpi: int = DEFAULT_DPI) -> str:
+    """
+    由预处理后的代码与渲染参数计算内容寻址的缓存键。
+
+    代码先解析为 AST 再取哈希, 注释、空行、缩进风格和引号差异都不会影响缓存键;
+    无法解析的代码按原文计算 (执行时会报语法错误, 错误结果不会被缓存)。
+    """
+    try:
+        normalized = ast.dump(ast.parse(processed_code))
+    except SyntaxError:
+        normalized = processed_code
+    return hashlib.sha256(f"{RENDER_SETTINGS}|dpi={dpi}|{normalized}".encode("utf-8")).hexdigest()
+
+
+def chart_cache_key(figure: dict, dpi: int = DEFAULT_DPI) -> str:
+    """声明式图表的缓存键: 由绘图所用的数组与参数决定, 数据不变时复用同一张图。"""
+    payload = json.dumps(figure, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(f"{RENDER_SETTINGS}|dpi={dpi}|chart|{payload}".encode("utf-8")).hexdigest()
+
+
+# 缓存键 -> {"png": PNG 字节, "digest": PNG 内容哈希, "url": 已发布的图片 URL (尚未发布成功时为 None)}
+render_cache = ResponseCache(max_bytes=RENDER_CACHE_MAX_BYTES)
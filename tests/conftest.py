@@ -0,0 +1,55 @@
+# 测试共用的夹具: 不访问真实的 Compass 服务, 以内存中的模拟后端代替 compass_bulk 发出的请求。
+
+import json
+from datetime import date, timedelta
+
+import pytest
+
+import compass_bulk
+
+
+class FakeCompass:
+    """
+    模拟 Compass 查询接口: 按日期闭区间 [begin_date, end_date] 过滤记录, 再按 direction 排序分页。
+
+    calls 记录每次请求的 (begin_date, end_date, page); fail 中的 (begin_date, page) 返回错误信息。
+    """
+
+    def __init__(self, records: list):
+        self.records = records
+        self.calls = []
+        self.fail = set()
+
+    async def post(self, base_url, endpoint, label, begin_date, end_date, direction="desc", page=1, size=10, **_):
+        self.calls.append((begin_date, end_date, page))
+        if (begin_date, page) in self.fail:
+            return json.dumps({"status": 500, "error": "HTTP Error", "details": "boom"})
+        matched = [r for r in self.records if begin_date <= r["grimoire_creation_date"][:10] <= end_date]
+        matched.sort(key=lambda r: r["grimoire_creation_date"], reverse=direction == "desc")
+        return json.dumps({
+            "count": len(matched),
+            "total_page": -(-len(matched) // size),
+            "items": matched[(page - 1) * size:page * size],
+        })
+
+
+def daily_records(begin: str, days: int, per_day: int = 1) -> list:
+    """从 begin 起连续 days 天, 每天 per_day 条记录。"""
+    start = date.fromisoformat(begin)
+    return [
+        {"uuid": f"{start + timedelta(days=d)}-{n}", "grimoire_creation_date": f"{start + timedelta(days=d)}T12:00:00"}
+        for d in range(days)
+        for n in range(per_day)
+    ]
+
+
+@pytest.fixture
+def fake_compass(monkeypatch):
+    """返回一个工厂: fake_compass(records) 创建模拟后端并替换 compass_bulk 的上游请求。"""
+
+    def install(records: list) -> FakeCompass:
+        backend = FakeCompass(records)
+        monkeypatch.setattr(compass_bulk, "post_to_compass", backend.post)
+        return backend
+
+    return install
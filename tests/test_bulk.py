@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+import compass_bulk
+from compass_bulk import CompassDataError, ItemSink, item_identity, merge_items, split_date_range
+from conftest import daily_records
+
+
+def test_split_date_range_aligns_to_months_and_shares_boundaries():
+    assert split_date_range("2024-01-15", "2024-03-10") == [
+        ("2024-01-15", "2024-02-01"),
+        ("2024-02-01", "2024-03-01"),
+        ("2024-03-01", "2024-03-10"),
+    ]
+
+
+def test_split_date_range_weeks_start_on_monday():
+    shards = split_date_range("2024-01-03", "2024-01-20", unit="week")
+    assert shards == [("2024-01-03", "2024-01-08"), ("2024-01-08", "2024-01-15"), ("2024-01-15", "2024-01-20")]
+
+
+def test_split_date_range_single_day_window():
+    assert split_date_range("2024-05-01", "2024-05-01") == [("2024-05-01", "2024-05-01")]
+
+
+def test_merge_items_dedups_by_identity_and_keeps_first_occurrence():
+    pages = [[{"uuid": "a", "v": 1}, {"id": 7}], [{"uuid": "a", "v": 2}, {"hash": "h"}, {"id": 7}]]
+    assert merge_items(pages) == [{"uuid": "a", "v": 1}, {"id": 7}, {"hash": "h"}]
+
+
+def test_item_identity_falls_back_to_canonical_json():
+    assert item_identity({"b": 1, "a": 2}) == item_identity({"a": 2, "b": 1})
+    assert item_identity({"uuid": None, "id": 3}) == "id:3"
+
+
+def test_long_window_is_sharded_merged_in_order_without_boundary_duplicates(fake_compass):
+    records = daily_records("2024-01-01", 200, per_day=2)
+    backend = fake_compass(records)
+    result = asyncio.run(compass_bulk.fetch_dataset("git_commit", "repo", "2024-01-01", "2024-07-18", page_size=100))
+
+    dates = [item["grimoire_creation_date"] for item in result["items"]]
+    assert result["shards"] == 7
+    assert dates == sorted(dates)
+    assert len({item["uuid"] for item in result["items"]}) == len(result["items"]) == result["count"] == 400
+    # 分片共享边界日期: 上游按闭区间处理时边界日的记录会返回两次, 合并时去重
+    assert len({(b, e) for b, e, _ in backend.calls}) == 7
+    assert not result["truncated"]
+
+
+def test_desc_direction_returns_newest_first(fake_compass):
+    fake_compass(daily_records("2024-01-01", 120))
+    result = asyncio.run(compass_bulk.fetch_range_data("u", "e", "repo", "2024-01-01", "2024-04-29", direction="desc"))
+    dates = [item["grimoire_creation_date"] for item in result["items"]]
+    assert dates == sorted(dates, reverse=True)
+
+
+def test_max_pages_is_a_global_budget_across_shards(fake_compass):
+    backend = fake_compass(daily_records("2024-01-01", 365, per_day=5))
+    result = asyncio.run(compass_bulk.fetch_dataset("git_commit", "repo", "2024-01-01", "2024-12-30", page_size=100, max_pages=5))
+    # 截断时另外请求一次整个窗口的总数, 其余都是分片的页
+    window_query = ("2024-01-01", "2024-12-30", 1)
+    assert backend.calls.count(window_query) == 1
+    assert len(backend.calls) == 6
+    assert result["truncated"]
+    assert result["count"] == 365 * 5
+    assert result["fetched"] == len(result["items"]) < result["count"]
+
+
+def test_count_is_the_upstream_total_whether_or_not_the_window_is_sharded(fake_compass):
+    fake_compass(daily_records("2024-01-01", 200, per_day=3))
+    short = asyncio.run(compass_bulk.fetch_dataset("git_commit", "repo", "2024-01-01", "2024-03-31", page_size=100, max_pages=2))
+    long = asyncio.run(compass_bulk.fetch_dataset("git_commit", "repo", "2024-01-01", "2024-07-18", page_size=100, max_pages=2))
+    assert (short["count"], short["fetched"]) == (91 * 3, 200)
+    assert long["count"] == 200 * 3 and long["fetched"] == len(long["items"]) < long["count"]
+    complete = asyncio.run(compass_bulk.fetch_dataset("git_commit", "repo", "2024-01-01", "2024-07-18", page_size=100))
+    assert complete["count"] == complete["fetched"] == 600 and not complete["truncated"]
+
+
+def test_short_window_is_not_sharded_and_respects_max_pages(fake_compass):
+    backend = fake_compass(daily_records("2024-01-01", 30, per_day=10))
+    result = asyncio.run(compass_bulk.fetch_dataset("git_commit", "repo", "2024-01-01", "2024-01-30", page_size=100, max_pages=2))
+    assert {(b, e) for b, e, _ in backend.calls} == {("2024-01-01", "2024-01-30")}
+    assert result["fetched_pages"] == 2 and result["truncated"]
+    assert len(result["items"]) == result["fetched"] == 200 and result["count"] == 300
+
+
+def test_failed_page_is_reported_and_other_pages_kept(fake_compass):
+    backend = fake_compass(daily_records("2024-01-01", 30, per_day=10))
+    backend.fail.add(("2024-01-01", 2))
+    result = asyncio.run(compass_bulk.fetch_dataset("git_commit", "repo", "2024-01-01", "2024-01-30", page_size=100))
+    assert [error["page"] for error in result["errors"]] == [2]
+    assert len(result["items"]) == 200
+
+
+def test_first_page_failure_raises(fake_compass):
+    backend = fake_compass([])
+    backend.fail.add(("2024-01-01", 1))
+    with pytest.raises(CompassDataError):
+        asyncio.run(compass_bulk.fetch_dataset("git_commit", "repo", "2024-01-01", "2024-01-30"))
+
+
+def test_item_sink_receives_each_record_once_across_shards(fake_compass):
+    fake_compass(daily_records("2024-01-01", 150, per_day=3))
+    received = []
+
+    async def consume(items):
+        received.extend(items)
+
+    sink = ItemSink(consume)
+    result = asyncio.run(compass_bulk.fetch_dataset("git_commit", "repo", "2024-01-01", "2024-05-29", page_size=100, sink=sink))
+    assert result["items"] == []
+    assert result["count"] == sink.count == len(received) == 450
+    assert len({item["uuid"] for item in received}) == 450
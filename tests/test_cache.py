@@ -0,0 +1,132 @@
+import sys
+from datetime import date, timedelta
+
+import pytest
+
+import compass_cache
+from compass_cache import DiskCache, ResponseCache, is_historical, is_settled, make_key, ttl_for
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(compass_cache.time, "monotonic", clock)
+    return clock
+
+
+SIZE = sys.getsizeof("A")
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = ResponseCache(max_bytes=1000)
+    cache.set("a", "value", ttl=10)
+    assert cache.get("a") == "value"
+    clock.now += 10
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_stale_values_are_served_only_within_the_stale_window(clock):
+    cache = ResponseCache(max_bytes=1000)
+    cache.set("a", "old", ttl=10, size=1, stale=5)
+    assert cache.get_stale("a") is None
+    clock.now += 12
+    assert cache.get("a") is None
+    assert cache.get_stale("a") == "old"
+    assert cache.remaining_ttl("a") == -2
+    clock.now += 3
+    assert cache.get_stale("a") is None
+
+
+def test_lru_eviction_is_by_size(clock):
+    cache = ResponseCache(max_bytes=2 * SIZE + 1)
+    cache.set("a", "A", ttl=60)
+    cache.set("b", "B", ttl=60)
+    cache.get("a")
+    cache.set("c", "C", ttl=60)
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+    assert cache.current_bytes == 2 * SIZE and cache.evictions == 1
+
+
+def test_replacing_an_entry_updates_its_size(clock):
+    cache = ResponseCache(max_bytes=1000)
+    cache.set("a", "A" * 100, ttl=60)
+    cache.set("a", "A", ttl=60)
+    assert cache.current_bytes == SIZE and cache.get("a") == "A"
+
+
+def test_oversized_values_and_zero_ttl_are_not_cached(clock):
+    cache = ResponseCache(max_bytes=SIZE)
+    cache.set("big", "AB", ttl=60)
+    cache.set("zero", "A", ttl=0)
+    assert cache.stats()["entries"] == 0
+
+
+def test_make_key_normalizes_parameters():
+    assert make_key("u", " repo ", "2024-01-01 ", "2024-02-01", "DESC", "1", 10) == \
+        make_key("u", "repo", "2024-01-01", "2024-02-01", "desc", 1, "10")
+    assert make_key("u", "repo", "2024-01-01", "2024-02-01", "desc", 1, 10) != \
+        make_key("u", "repo", "2024-01-01", "2024-02-01", "desc", 2, 10)
+
+
+def test_ttl_depends_on_endpoint_and_whether_the_window_is_over():
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    today = date.today().isoformat()
+    assert is_historical(yesterday) and not is_historical(today)
+    assert not is_historical("not-a-date")
+    assert ttl_for("/api/v2/metricModel/activity", today) == 1800
+    assert ttl_for("api/v2/metricModel/activity", yesterday) == 7 * 86400
+    assert ttl_for("api/v2/metadata/gitCommits", today) == compass_cache.DEFAULT_LIVE_TTL
+    assert ttl_for("api/v2/metadata/gitCommits", yesterday) == compass_cache.DEFAULT_HISTORICAL_TTL
+
+
+def test_only_windows_past_the_settle_period_are_settled():
+    today = date.today()
+    assert is_settled((today - timedelta(days=7)).isoformat(), settle_days=7)
+    assert not is_settled((today - timedelta(days=6)).isoformat(), settle_days=7)
+    assert is_settled((today - timedelta(days=1)).isoformat(), settle_days=1)
+    assert not is_settled("not-a-date")
+
+
+def test_disk_cache_roundtrip_purge_and_eviction(tmp_path):
+    path = str(tmp_path / "cache.db")
+    key_a = make_key("u", "repo-a", "2023-01-01", "2023-02-01", "desc", 1, 10)
+    key_b = make_key("u", "repo-b", "2023-01-01", "2023-02-01", "desc", 1, 10)
+    cache = DiskCache(path)
+    cache.set(key_a, '{"items": ["中文"]}')
+    cache.set(key_b, '{"items": []}')
+    cache.close()
+
+    cache = DiskCache(path)
+    assert cache.get(key_a) == '{"items": ["中文"]}'
+    assert cache.purge(label="repo-b") == 1
+    assert cache.get(key_b) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    keys = [make_key("u", f"repo-{n}", "2023-01-01", "2023-02-01", "desc", 1, 10) for n in range(3)]
+    probe = DiskCache(str(tmp_path / "probe.db"))
+    probe.set(keys[0], "x" * 100)
+    size = probe.current_bytes
+    probe.close()
+
+    cache = DiskCache(str(tmp_path / "cache.db"), max_bytes=size * 2)
+    cache.set(keys[0], "x" * 100)
+    cache.set(keys[1], "x" * 100)
+    cache._conn.execute("UPDATE responses SET accessed_at = accessed_at - 60 WHERE key = ?", (keys[1],))
+    cache.set(keys[2], "x" * 100)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    cache.close()
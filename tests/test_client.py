@@ -0,0 +1,89 @@
+import asyncio
+import json
+from datetime import date, timedelta
+
+import httpx
+import pytest
+
+import compass_client
+from compass_cache import DiskCache, ResponseCache
+
+
+@pytest.fixture
+def upstream(monkeypatch, tmp_path):
+    """替换上游请求与两级缓存: 返回请求过的 access_token 列表, 以及启用的磁盘缓存。"""
+    tokens = []
+
+    async def post(full_url, payload):
+        tokens.append(payload["access_token"])
+        body = json.dumps({"count": 1, "items": [{"token": payload["access_token"]}]})
+        return httpx.Response(200, text=body, request=httpx.Request("POST", full_url))
+
+    disk = DiskCache(str(tmp_path / "cache.db"))
+    monkeypatch.setenv("GITEE_ACCESS_TOKEN", "envtok")
+    monkeypatch.setattr(compass_client, "_post_with_retry", post)
+    monkeypatch.setattr(compass_client, "response_cache", ResponseCache())
+    monkeypatch.setattr(compass_client, "disk_cache", disk)
+    yield tokens, disk
+    disk.close()
+
+
+def post(access_token=None):
+    text = asyncio.run(compass_client.post_to_compass(
+        "https://compass.example", "api/v2/git/search", "repo", "2020-01-01", "2020-01-31", access_token=access_token,
+    ))
+    return json.loads(text)
+
+
+def test_caller_token_is_cached_separately_in_memory_and_on_disk(upstream):
+    tokens, disk = upstream
+    assert post(access_token="othertok")["items"] == [{"token": "othertok"}]
+    assert post()["items"] == [{"token": "envtok"}]
+    assert tokens == ["othertok", "envtok"]
+    # 历史窗口写入磁盘缓存, 令牌隔离后的键仍可按 JSON 解析出 label 等字段
+    assert sorted(entry["label"] for entry in disk.entries()) == ["repo", "repo"]
+
+
+def test_caller_token_entry_is_served_from_disk_after_restart(upstream, monkeypatch):
+    tokens, _ = upstream
+    post(access_token="othertok")
+    monkeypatch.setattr(compass_client, "response_cache", ResponseCache())
+    assert post(access_token="othertok")["items"] == [{"token": "othertok"}]
+    assert tokens == ["othertok"]
+
+
+def test_recently_ended_window_is_not_written_to_disk(upstream):
+    _, disk = upstream
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    asyncio.run(compass_client.post_to_compass("https://compass.example", "api/v2/git/search", "repo", "2020-01-01", yesterday))
+    assert disk.entries() == []
+
+@pytest.mark.parametrize("shared, expected", [
+    ({"status": 404, "error": "HTTP Error", "details": "Not Found"},
+     {"error": "HTTP Error", "status_code": 404, "details": "Not Found"}),
+    ({"status": 429, "error": "HTTP Error", "details": "", "retry_after": 3.0},
+     {"error": "HTTP Error", "status_code": 429, "details": "", "retry_after": 3.0}),
+    ({"status": 500, "error": "Request Failed", "details": "connect timeout"},
+     {"error": "Request Failed", "details": "connect timeout"}),
+])
+def test_gitee_pr_tool_keeps_its_error_format(monkeypatch, shared, expected):
+    import gitee_pr_server
+
+    async def post(*args, **kwargs):
+        return json.dumps(shared)
+
+    monkeypatch.setattr(gitee_pr_server, "post_to_compass", post)
+    text = asyncio.run(gitee_pr_server.get_pull_requests("repo", "2024-01-01", "2024-01-31", access_token="tok"))
+    assert json.loads(text) == expected
+
+
+def test_gitee_pr_tool_passes_data_through(monkeypatch):
+    import gitee_pr_server
+
+    body = '{"count":1,"items":[{"status":"merged"}]}'
+
+    async def post(*args, **kwargs):
+        return body
+
+    monkeypatch.setattr(gitee_pr_server, "post_to_compass", post)
+    assert asyncio.run(gitee_pr_server.get_pull_requests("repo", "2024-01-01", "2024-01-31", access_token="tok")) == body
@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import pytest
+
+from compass_deadline import (
+    Deadline, DeadlineExceeded, budget, deadline_at, deadline_scope, iterate_within, remaining, shared_context,
+)
+
+
+def test_budget_without_deadline_is_the_operation_timeout():
+    assert remaining() is None
+    assert budget(30) == 30
+
+
+def test_budget_is_capped_by_the_remaining_time():
+    async def run():
+        async with deadline_scope(0.5):
+            assert 0 < budget(30) <= 0.5
+            assert budget(0.1) == 0.1
+
+    asyncio.run(run())
+
+
+def test_nested_scopes_keep_the_earlier_deadline():
+    async def run():
+        async with deadline_scope(0.2):
+            outer = deadline_at()
+            async with deadline_scope(10):
+                assert deadline_at() == outer
+            async with deadline_scope(None):
+                assert deadline_at() == outer
+
+    asyncio.run(run())
+
+
+def test_expired_scope_cancels_work_and_raises_deadline_exceeded():
+    cancelled = []
+
+    async def work():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        async with deadline_scope(0.05):
+            await work()
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert cancelled and time.monotonic() - started < 1
+
+
+def test_budget_raises_once_the_deadline_has_passed():
+    async def run():
+        async with deadline_scope(0.01):
+            time.sleep(0.02)
+            budget(30)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+
+
+def test_iterate_within_closes_the_generator_on_expiry():
+    closed = []
+
+    async def slow():
+        try:
+            yield 1
+            await asyncio.sleep(5)
+            yield 2
+        finally:
+            closed.append(True)
+
+    async def run():
+        return [item async for item in iterate_within(slow(), 0.05)]
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert closed
+
+
+def test_iterate_within_passes_items_through():
+    async def numbers():
+        for n in range(3):
+            yield n
+
+    async def run():
+        return [item async for item in iterate_within(numbers(), 1)]
+
+    assert asyncio.run(run()) == [0, 1, 2]
+
+
+def test_shared_deadline_extends_to_the_latest_waiter():
+    deadline = Deadline(100.0)
+    deadline.extend(50.0)
+    assert deadline.at == 100.0
+    deadline.extend(200.0)
+    assert deadline.at == 200.0
+    deadline.extend(None)
+    assert deadline.at is None
+    deadline.extend(10.0)
+    assert deadline.at is None
+
+
+def test_shared_context_carries_the_deadline():
+    deadline = Deadline(time.monotonic() + 3)
+    assert shared_context(deadline).run(deadline_at) == deadline.at
+    assert deadline_at() is None
@@ -0,0 +1,55 @@
+import pytest
+
+from compass_bulk import CompassDataError
+from compass_index import PrefixIndex, contributions
+
+ROWS = [
+    ("commits", "2024-01-02", 2.0),
+    ("commits", "2024-01-05", 3.0),
+    ("lines_added", "2024-01-05", 40.0),
+    ("commits", "2024-02-01", 1.0),
+]
+
+
+@pytest.fixture
+def index():
+    return PrefixIndex.from_rows(("commits", "lines_added"), ROWS)
+
+
+@pytest.mark.parametrize("begin, end, commits, lines", [
+    ("2024-01-01", "2024-12-31", 6, 40),
+    ("2024-01-02", "2024-01-02", 2, 0),
+    ("2024-01-03", "2024-01-04", 0, 0),
+    ("2024-01-05", "2024-02-01", 4, 40),
+    ("2023-01-01", "2023-12-31", 0, 0),
+])
+def test_range_sum_is_an_inclusive_window(index, begin, end, commits, lines):
+    assert index.range_sum(begin, end) == {"commits": commits, "lines_added": lines}
+
+
+def test_empty_index():
+    index = PrefixIndex.from_rows(("count",), [])
+    assert index.range_sum("2024-01-01", "2024-12-31") == {"count": 0}
+    assert index.first_day is None and index.last_day is None
+
+
+@pytest.mark.parametrize("begin, end", [
+    ("2024-13-01", "2024-12-31"),
+    ("2024-02-30", "2024-03-01"),
+    ("yesterday", "2024-01-01"),
+    ("2024-1-1", "2024-01-31"),
+    ("2024-03-01", "2024-01-01"),
+])
+def test_invalid_dates_raise_compass_data_error(index, begin, end):
+    with pytest.raises(CompassDataError) as error:
+        index.range_sum(begin, end)
+    assert '"status": 400' in error.value.details
+
+
+def test_contributions_skip_missing_dates_and_non_numeric_values():
+    item = {"lines_added": "12", "lines_removed": 3, "closed_at": None}
+    assert contributions("git_commit", item, "2024-01-01") == {
+        ("commits", "2024-01-01"): 1.0,
+        ("lines_removed", "2024-01-01"): 3.0,
+    }
+    assert contributions("git_commit", item, None) == {}
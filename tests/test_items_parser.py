@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from main import ItemsArrayParser
+
+
+def parse(body: bytes, step: int) -> tuple[list[str], ItemsArrayParser]:
+    parser = ItemsArrayParser()
+    items = []
+    for start in range(0, len(body), step):
+        items += parser.feed(body[start:start + step], final=start + step >= len(body))
+    return items, parser
+
+
+@pytest.mark.parametrize("step", [1, 2, 7, 64, 100000])
+def test_only_top_level_items_are_returned(step):
+    body = json.dumps({
+        "meta": {"items": [{"nested": True}]},
+        "note": 'text with "items": [1] inside',
+        "items": [{"a": {"items": [1, 2]}}, {"b": "]"}, 3, "四"],
+        "count": 4,
+    }, ensure_ascii=False).encode()
+    items, parser = parse(body, step)
+    assert [json.loads(item) for item in items] == [{"a": {"items": [1, 2]}}, {"b": "]"}, 3, "四"]
+    assert parser.found and parser.done
+
+
+def test_numbers_split_across_chunks_are_not_cut_short():
+    items, _ = parse(b'{"items": [12345, 678]}', 3)
+    assert items == ["12345", "678"]
+
+
+def test_newlines_outside_strings_are_removed():
+    items, _ = parse(b'{"items": [\n  {\n "a": "x\\ny"\n }\n]}', 5)
+    assert items == ['{ "a": "x\\ny" }']
+
+
+def test_body_without_items_yields_nothing():
+    items, parser = parse(b'{"error": "Not Found", "status": 404}', 4)
+    assert items == [] and not parser.found
+
+
+def test_escaped_quotes_in_keys_do_not_confuse_the_scanner():
+    items, _ = parse(b'{"x\\"": "\\\\", "items": [1]}', 1)
+    assert items == ["1"]
@@ -0,0 +1,157 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+from compass_limits import AdaptiveLimiter, RetryBudget, TokenBucket, backoff_delay, parse_retry_after
+
+
+def test_token_bucket_allows_a_burst_then_paces():
+    async def run():
+        bucket = TokenBucket(rate=50, burst=3)
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        burst = time.monotonic() - started
+        for _ in range(2):
+            await bucket.acquire()
+        return burst, time.monotonic() - started
+
+    burst, total = asyncio.run(run())
+    assert burst < 0.02
+    assert 0.03 <= total < 0.5
+
+
+def test_token_bucket_pause_blocks_and_drops_saved_tokens():
+    async def run():
+        bucket = TokenBucket(rate=0, burst=5)
+        bucket.pause(0.05)
+        started = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - started, bucket.tokens
+
+    waited, tokens = asyncio.run(run())
+    assert waited >= 0.04 and tokens == 0
+
+
+def test_adaptive_limiter_decreases_once_per_round_trip():
+    async def run():
+        limiter = AdaptiveLimiter(initial=8, minimum=1, maximum=16)
+        starts = [await limiter.acquire() for _ in range(4)]
+        for started in starts:
+            limiter.release(started, "overload")
+        after_burst = limiter.limit
+        started = await limiter.acquire()
+        limiter.release(started, "overload")
+        return after_burst, limiter.limit, limiter.inflight
+
+    after_burst, after_next, inflight = asyncio.run(run())
+    assert after_burst == 4
+    assert after_next == 2
+    assert inflight == 0
+
+
+def test_adaptive_limiter_grows_slowly_and_respects_bounds():
+    async def run():
+        limiter = AdaptiveLimiter(initial=2, minimum=1, maximum=3)
+        for _ in range(20):
+            limiter.release(await limiter.acquire(), "success")
+        high = limiter.limit
+        limiter.release(await limiter.acquire(), "ignore")
+        for _ in range(5):
+            limiter.release(await limiter.acquire(), "overload")
+        return high, limiter.limit
+
+    assert asyncio.run(run()) == (3, 1)
+
+
+def test_adaptive_limiter_blocks_beyond_the_limit():
+    async def run():
+        limiter = AdaptiveLimiter(initial=1)
+        first = await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        blocked = not waiter.done()
+        limiter.release(first, "ignore")
+        await asyncio.wait_for(waiter, 1)
+        return blocked
+
+    assert asyncio.run(run())
+
+
+def test_adaptive_limiter_slot_is_released_even_if_cancelled_again_during_cleanup():
+    async def request(limiter, gate):
+        started = await limiter.acquire()
+        try:
+            await gate.wait()
+        finally:
+            limiter.release(started, "ignore")
+
+    async def run():
+        limiter = AdaptiveLimiter(initial=1)
+        gate = asyncio.Event()
+        task = asyncio.create_task(request(limiter, gate))
+        await asyncio.sleep(0)
+        task.cancel()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return limiter.inflight, await asyncio.wait_for(limiter.acquire(), 1)
+
+    inflight, _ = asyncio.run(run())
+    assert inflight == 0
+
+
+def test_adaptive_limiter_cancelled_waiters_do_not_hold_slots():
+    async def run():
+        limiter = AdaptiveLimiter(initial=1)
+        first = await limiter.acquire()
+        cancelled = asyncio.create_task(limiter.acquire())
+        woken = asyncio.create_task(limiter.acquire())
+        next_in_line = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        limiter.release(first, "ignore")
+        # 被唤醒后还没来得及运行就被取消, 唤醒交给下一个等待者
+        woken.cancel()
+        await asyncio.wait_for(next_in_line, 1)
+        return limiter.inflight, len(limiter._waiters), cancelled.cancelled(), woken.cancelled()
+
+    assert asyncio.run(run()) == (1, 0, True, True)
+
+
+def test_retry_budget_is_a_ratio_of_recent_requests():
+    budget = RetryBudget(ratio=0.5, minimum=1)
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    for _ in range(4):
+        budget.record_request()
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+
+
+def test_retry_budget_window_slides(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("compass_limits.time.monotonic", lambda: now[0])
+    budget = RetryBudget(ratio=0, minimum=1, window=10)
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    now[0] += 11
+    assert budget.try_spend()
+
+
+@pytest.mark.parametrize("attempt, cap", [(1, 0.5), (3, 2.0), (10, 4.0)])
+def test_backoff_delay_stays_within_the_capped_window(attempt, cap):
+    delays = [backoff_delay(attempt, 0.5, 4.0) for _ in range(200)]
+    assert all(0 <= delay <= cap for delay in delays)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(" 1.5 ") == 1.5
+    assert parse_retry_after("-4") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert 25 <= parse_retry_after(formatdate(time.time() + 30, usegmt=True)) <= 30
+    assert parse_retry_after(formatdate(time.time() - 30, usegmt=True)) == 0.0
@@ -0,0 +1,28 @@
+import asyncio
+import json
+
+import httpx
+
+import compass_matrix
+
+
+def test_one_failing_cell_does_not_fail_the_matrix(monkeypatch):
+    async def post(base_url, endpoint, label, begin_date, end_date, **_):
+        if label == "broken":
+            raise httpx.ConnectError("connection reset")
+        if label == "bad-json":
+            return '{"items": ['
+        if label == "missing":
+            return json.dumps({"status": 404, "error": "HTTP Error", "details": "Not Found"})
+        return json.dumps({"count": 1, "items": [{"label": label}]})
+
+    monkeypatch.setattr(compass_matrix, "post_to_compass", post)
+    labels = ["ok", "broken", "bad-json", "missing"]
+    result = asyncio.run(compass_matrix.fetch_matrix(labels, ["project_activity"], "2024-01-01", "2024-01-31"))
+
+    assert result["succeeded"] == 1 and result["failed"] == 3
+    assert result["matrix"]["ok"]["project_activity"] is not None
+    errors = {error["label"]: error for error in result["errors"]}
+    assert errors["broken"]["error"] == "Cell Failed" and "ConnectError" in errors["broken"]["details"]
+    assert errors["bad-json"]["status"] == 502
+    assert errors["missing"]["status"] == 404
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from compass_client import SingleFlight
+from compass_deadline import deadline_at, deadline_scope
+
+
+def test_concurrent_callers_share_one_execution():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "body"
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("k", fetch) for _ in range(5)))
+        return results, flight
+
+    results, flight = asyncio.run(run())
+    assert results == ["body"] * 5
+    assert len(calls) == 1 and flight.shared == 4
+    assert flight._calls == {}
+
+
+def test_one_caller_leaving_does_not_cancel_the_others():
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "body"
+
+    async def run():
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.do("k", fetch))
+        second = asyncio.create_task(flight.do("k", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first
+
+    result, first = asyncio.run(run())
+    assert result == "body" and first.cancelled()
+
+
+def test_underlying_task_is_cancelled_when_every_caller_leaves():
+    cancelled = asyncio.Event()
+
+    async def run():
+        async def fetch():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        flight = SingleFlight()
+        callers = [asyncio.create_task(flight.do("k", fetch)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        return flight
+
+    flight = asyncio.run(run())
+    assert flight._calls == {}
+
+
+def test_shared_deadline_is_the_latest_of_the_callers():
+    seen = []
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        seen.append(deadline_at())
+        return "body"
+
+    async def caller(flight, seconds):
+        async with deadline_scope(seconds):
+            return await flight.do("k", fetch), deadline_at()
+
+    async def run():
+        flight = SingleFlight()
+        first = asyncio.create_task(caller(flight, 1))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(caller(flight, 5))
+        return await first, await second
+
+    (_, short), (_, long) = asyncio.run(run())
+    assert seen == [long] and long > short
+
+
+def test_exceptions_reach_every_caller_and_the_key_is_released():
+    attempts = []
+
+    async def fetch():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("k", fetch) for _ in range(3)), return_exceptions=True)
+        with pytest.raises(RuntimeError):
+            await flight.do("k", fetch)
+        return results
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(attempts) == 2
@@ -0,0 +1,202 @@
+import asyncio
+import json
+from datetime import date
+
+import pytest
+
+import compass_sync
+from compass_sync import SyncStore
+from conftest import daily_records
+
+TODAY = date(2024, 6, 30)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = SyncStore(":memory:")
+    monkeypatch.setattr(compass_sync, "_store", store)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def shards(monkeypatch):
+    """
+    按分片脚本化上游: plan[分片起始日] 为 "ok" / "truncated" / "error" / "hang", 默认 "ok"。
+
+    每个分片返回起始日与结束日各一条记录 (截断的分片只返回起始日那条); calls 记录请求过的分片。
+    """
+    plan, calls = {}, []
+
+    async def fetch(base_url, endpoint, label, begin_date, end_date, direction="desc", **_):
+        calls.append((begin_date, end_date))
+        mode = plan.get(begin_date, "ok")
+        if mode == "hang":
+            await asyncio.Event().wait()
+        items = daily_records(begin_date, 1)
+        if mode == "truncated":
+            return {"items": items, "truncated": True}
+        items += [{**record, "uuid": "end-" + record["uuid"]} for record in daily_records(end_date, 1)]
+        if mode == "error":
+            return {"items": items[:1], "truncated": False, "errors": [{"page": 2, "details": "boom"}]}
+        return {"items": items, "truncated": False}
+
+    monkeypatch.setattr(compass_sync, "fetch_all_pages_data", fetch)
+    return plan, calls
+
+
+def sync(begin_date=None, today=TODAY):
+    return asyncio.run(compass_sync.sync_dataset("git_commit", "repo", begin_date, today))
+
+
+def test_append_moves_watermark_only_outwards(store):
+    store.append("git_commit", "repo", daily_records("2024-03-01", 1), "2024-03-01", "2024-03-31")
+    store.append("git_commit", "repo", [], "2024-03-10", "2024-03-20")
+    assert store.watermark("git_commit", "repo")["first_date"] == "2024-03-01"
+    assert store.watermark("git_commit", "repo")["synced_through"] == "2024-03-31"
+    store.append("git_commit", "repo", [], "2024-02-01", None)
+    store.append("git_commit", "repo", [], None, "2024-04-15")
+    mark = store.watermark("git_commit", "repo")
+    assert (mark["first_date"], mark["synced_through"]) == ("2024-02-01", "2024-04-15")
+
+
+def test_append_without_both_bounds_creates_no_watermark(store):
+    assert store.append("git_commit", "repo", daily_records("2024-03-01", 2), "2024-03-01", None) == 2
+    assert store.watermark("git_commit", "repo") is None
+
+
+def test_query_is_an_inclusive_date_window(store):
+    store.append("git_commit", "repo", daily_records("2024-03-01", 10), "2024-03-01", "2024-03-10")
+    total, items = store.query("git_commit", "repo", "2024-03-03", "2024-03-05", limit=2)
+    assert total == 3
+    assert [json.loads(item.text)["grimoire_creation_date"][:10] for item in items] == ["2024-03-03", "2024-03-04"]
+
+
+def test_first_sync_then_incremental_sync_from_the_watermark(store, fake_compass):
+    backend = fake_compass(daily_records("2024-06-01", 30))
+    result = sync(begin_date="2024-06-01")
+    assert result["complete"] and result["synced_through"] == "2024-06-30"
+    assert result["records"] == 30
+
+    backend.calls.clear()
+    backend.records += daily_records("2024-07-01", 2)
+    result = sync(today=date(2024, 7, 2))
+    assert {b for b, _, _ in backend.calls} == {"2024-06-29"}
+    assert result["inserted"] == 2 and result["synced_through"] == "2024-07-02"
+
+
+def test_complete_first_sync_covers_the_whole_window(store, shards):
+    result = sync(begin_date="2024-01-01")
+    assert result["complete"]
+    assert (result["synced_from"], result["synced_through"]) == ("2024-01-01", "2024-06-30")
+
+
+def test_truncated_early_shard_stops_watermark_although_later_shards_complete(store, shards):
+    plan, _ = shards
+    plan["2024-02-01"] = "truncated"
+    result = sync(begin_date="2024-01-01")
+    assert not result["complete"]
+    # 截断的分片按时间升序获取, 只有其中最新记录之前是连续的
+    assert result["synced_through"] == "2024-02-01"
+    # 后面完整分片的记录仍然保存
+    total, _ = store.query("git_commit", "repo", "2024-06-30", "2024-06-30")
+    assert total == 1
+
+
+def test_failed_middle_shard_is_refetched_by_the_next_sync(store, shards):
+    plan, calls = shards
+    plan["2024-03-01"] = "error"
+    result = sync(begin_date="2024-01-01")
+    assert result["synced_through"] == "2024-03-01" and result["errors"]
+
+    plan.clear()
+    calls.clear()
+    result = sync(begin_date="2024-01-01")
+    assert result["complete"] and result["synced_through"] == "2024-06-30"
+    assert calls[0][0] <= "2024-03-01"
+
+
+def test_backfill_fetches_only_the_missing_range(store, shards):
+    _, calls = shards
+    sync(begin_date="2024-04-01")
+    calls.clear()
+    result = sync(begin_date="2023-10-01")
+    backfill = [shard for shard in calls if shard[1] <= "2024-04-01"]
+    assert result["backfill"] == ["2023-10-01", "2024-04-01"]
+    assert min(b for b, _ in backfill) == "2023-10-01"
+    # 除回填外只请求水位附近的增量, 不会重新获取 [first_date, today] 的全部数据
+    assert all(b >= "2024-06-29" for b, e in calls if (b, e) not in backfill)
+    assert result["synced_from"] == "2023-10-01"
+
+
+def test_backfill_moves_first_date_only_over_contiguous_shards(store, shards):
+    plan, _ = shards
+    sync(begin_date="2024-04-01")
+    plan["2024-02-01"] = "error"
+    result = sync(begin_date="2023-10-01")
+    # 回填从 first_date 往前推进, 遇到失败的分片即停止
+    assert result["synced_from"] == "2024-03-01"
+    assert not result["complete"]
+
+
+def test_progress_is_saved_when_the_sync_is_cancelled(store, shards):
+    plan, _ = shards
+    plan["2024-04-01"] = "hang"
+
+    async def run():
+        with pytest.raises(TimeoutError):
+            async with asyncio.timeout(0.5):
+                await compass_sync.sync_dataset("git_commit", "repo", "2024-01-01", TODAY)
+
+    asyncio.run(run())
+    mark = store.watermark("git_commit", "repo")
+    assert (mark["first_date"], mark["synced_through"]) == ("2024-01-01", "2024-04-01")
+
+
+def summary(begin_date, end_date):
+    return asyncio.run(compass_sync.range_summary("git_commit", "repo", begin_date, end_date))
+
+
+def test_summary_without_watermark_syncs_only_the_requested_window(store, shards):
+    _, calls = shards
+    result = summary("2020-03-01", "2020-03-31")
+    assert calls == [("2020-03-01", "2020-03-31")]
+    assert result["complete"] and result["summary"]["commits"] == 2
+    mark = store.watermark("git_commit", "repo")
+    assert (mark["first_date"], mark["synced_through"]) == ("2020-03-01", "2020-03-31")
+
+
+def test_summary_of_an_old_window_does_not_backfill_the_gap(store, shards):
+    _, calls = shards
+    sync(begin_date="2024-04-01")
+    calls.clear()
+    result = summary("2020-03-01", "2020-03-31")
+    assert calls == [("2020-03-01", "2020-03-31")]
+    assert result["complete"] and result["summary"]["commits"] == 2
+    # 不相连的窗口不移动同步范围
+    assert (result["synced_from"], result["synced_through"]) == ("2024-04-01", "2024-06-30")
+
+
+def test_summary_extending_the_synced_range_fetches_only_the_missing_part(store, shards):
+    _, calls = shards
+    sync(begin_date="2024-04-01")
+    calls.clear()
+    result = summary("2024-03-15", "2024-05-31")
+    assert calls == [("2024-03-15", "2024-04-01")]
+    assert result["complete"] and result["synced_from"] == "2024-03-15"
+
+
+def test_summary_within_the_synced_range_does_not_sync(store, shards):
+    _, calls = shards
+    sync(begin_date="2024-04-01")
+    calls.clear()
+    assert summary("2024-04-01", "2024-04-30")["complete"]
+    assert calls == []
+
+
+def test_incomplete_sync_returns_no_summary(store, shards):
+    plan, _ = shards
+    plan["2020-03-01"] = "error"
+    result = summary("2020-03-01", "2020-03-31")
+    assert not result["complete"] and result["summary"] is None
+    assert result["errors"][0]["details"] == "boom"